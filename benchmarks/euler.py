@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+"""
+Benchmark the Euler integrators in `pycog.euler` against the original integrator,
+which allocated several temporary arrays and computed the input projection at every
+time step.
+
+Temporary arrays per step are counted with a subclass of `numpy.ndarray` that counts
+the new arrays created from its instances, as the difference between a one-step and
+a zero-step run, so buffers allocated once per call are not counted.
+
+"""
+from __future__ import division
+
+import argparse
+import time
+
+import numpy as np
+
+from pycog.euler import euler
+from pycog.rnn   import activation_functions, activation_functions_inplace
+
+#=========================================================================================
+# Command line
+#=========================================================================================
+
+p = argparse.ArgumentParser()
+p.add_argument('-N', nargs='+', type=int, default=[100, 256, 1024])
+p.add_argument('--Nin', type=int, default=4)
+p.add_argument('-T', type=float, default=2000)
+p.add_argument('--dt', type=float, default=0.5)
+p.add_argument('--activation', type=str, default='rectify')
+p.add_argument('-s', '--seed', type=int, default=1)
+a = p.parse_args()
+
+#=========================================================================================
+# Original integrator
+#=========================================================================================
+
+def euler_reference(alpha, x_t, Win, Wrec, brec, u, noise_rec, f_hidden, r):
+    r_t = r[0]
+    for i in xrange(1, r.shape[0]):
+        x_t += alpha*(-x_t            # Leak
+                      + Wrec.dot(r_t) # Recurrent input
+                      + brec          # Bias
+                      + Win.dot(u[i]) # Input
+                      + noise_rec[i]) # Recurrent noise
+        r_t = f_hidden(x_t)
+
+        r[i] = r_t
+
+def euler_hoisted(alpha, x_t, Win, Wrec, brec, u, noise_rec, f_hidden, r):
+    """
+    Current integrator, including the computation of the external drive.
+
+    """
+    I  = noise_rec
+    I += brec
+    I += u.dot(Win.T)
+
+    euler(alpha, x_t, Wrec, I, f_hidden, r)
+
+#=========================================================================================
+
+class Counted(np.ndarray):
+    """
+    Count the new arrays created from `Counted` arrays, e.g., by arithmetic and ufuncs,
+    but not views. Ufuncs may return a view of a new base array, so new arrays are
+    those that don't share memory with the array they were created from.
+
+    """
+    allocations = 0
+
+    def __array_finalize__(self, obj):
+        if obj is None or not np.may_share_memory(self, obj):
+            Counted.allocations += 1
+
+def setup(rng, N, Nin, Nt, dtype=np.float32):
+    alpha     = (a.dt/100)*np.ones(N, dtype=dtype)
+    x0        = 0.1*np.ones(N, dtype=dtype)
+    Win       = np.asarray(rng.uniform(size=(N, Nin)), dtype=dtype)
+    Wrec      = np.asarray(rng.normal(size=(N, N))/np.sqrt(N), dtype=dtype)
+    brec      = np.zeros(N, dtype=dtype)
+    u         = np.asarray(rng.uniform(size=(Nt, Nin)), dtype=dtype)
+    noise_rec = np.asarray(rng.normal(size=(Nt, N)), dtype=dtype)
+
+    return alpha, x0, Win, Wrec, brec, u, noise_rec
+
+def prepare(args, Nt):
+    alpha, x0, Win, Wrec, brec, u, noise_rec = args
+
+    x_t = x0.copy()
+    r   = np.zeros((Nt, len(x0)), dtype=x0.dtype)
+    r[0] = activation_functions[a.activation](x_t)
+
+    return alpha, x_t, Win, Wrec, brec, u[:Nt], noise_rec[:Nt].copy(), r
+
+def temporaries_per_step(integrator, f_hidden, args):
+    """
+    Arrays allocated by a one-step run in addition to those of a zero-step run. For
+    the current integrator only the time loop is measured, since the external drive
+    is computed once for the whole trial.
+
+    """
+    counts = []
+    for Nt in [1, 2]:
+        alpha, x_t, Win, Wrec, brec, u, noise_rec, r = [
+            v.view(Counted) for v in prepare(args, Nt)
+            ]
+
+        if integrator is euler_hoisted:
+            I = noise_rec + brec + u.dot(Win.T)
+
+            Counted.allocations = 0
+            euler(alpha, x_t, Wrec, I, f_hidden, r)
+        else:
+            Counted.allocations = 0
+            integrator(alpha, x_t, Win, Wrec, brec, u, noise_rec, f_hidden, r)
+        counts.append(Counted.allocations)
+
+    return counts[1] - counts[0]
+
+#=========================================================================================
+
+rng = np.random.RandomState(a.seed)
+Nt  = int(a.T/a.dt) + 1
+
+integrators = [
+    ('reference', euler_reference, activation_functions[a.activation]),
+    ('in-place',  euler_hoisted,   activation_functions_inplace[a.activation])
+    ]
+
+print("{} ms at dt = {} ms ({} steps), {} activation"
+      .format(a.T, a.dt, Nt-1, a.activation))
+for N in a.N:
+    args = setup(rng, N, a.Nin, Nt)
+    for name, integrator, f_hidden in integrators:
+        alpha, x_t, Win, Wrec, brec, u, noise_rec, r = prepare(args, Nt)
+
+        tstart = time.time()
+        integrator(alpha, x_t, Win, Wrec, brec, u, noise_rec, f_hidden, r)
+        elapsed = time.time() - tstart
+
+        print("N = {:>5} | {:<9} | {:8.2f} us/step | {} temporary arrays/step"
+              .format(N, name, 1e6*elapsed/(Nt-1),
+                      temporaries_per_step(integrator, f_hidden, args)))
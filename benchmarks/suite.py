@@ -0,0 +1,421 @@
+#! /usr/bin/env python
+"""
+Benchmark suite for the hot paths of simulation, data generation, and training.
+
+Cases
+-----
+
+  euler           : `pycog.euler` integrators, over N, density of Crec, batch size, & T.
+  run             : `RNN.run`, over N, density of Crec, & T.
+  spectral_radius : `RNN.spectral_radius`, over N & density of Crec.
+  dataset         : `Dataset.update` for the example tasks, over minibatch size.
+  train_step      : `SGD.train_step` for the example tasks, over minibatch size.
+
+Each case runs in its own process and reports the best time over `--repeat` runs,
+and the peak memory: how much the peak resident set size of the process grew from
+before the case was set up (`resource.getrusage`). Times for `dataset` and
+`train_step` are per minibatch, the latter taken from the timing that `SGD.train`
+stores in the checkpoint. Setup, such as building the weights or compiling the
+training functions, is not counted in the times, but is in the peak memory.
+
+Results are compared with the baseline stored in `--baseline`, and the exit status
+is 1 if any case is slower, or uses more memory, than its baseline by more than the
+tolerance (and, for memory, by more than `--memory-slack` MB), so the suite can gate
+changes. Baselines depend on the machine, so store one with `--save` on the machine
+used for comparisons:
+
+  python benchmarks/suite.py --save                 # Store baseline
+  python benchmarks/suite.py                        # Compare with baseline
+  python benchmarks/suite.py euler run -N 100 1024  # Subset of the cases
+
+`--save` only replaces the baseline of the cases that were run.
+
+"""
+from __future__ import division
+
+import argparse
+import cPickle as pickle
+import imp
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from   collections import OrderedDict
+from   contextlib  import contextmanager
+
+import numpy as np
+
+from pycog.dataset  import Dataset
+from pycog.defaults import defaults
+from pycog.euler    import euler, euler_batch, euler_sparse, euler_batch_sparse
+from pycog.model    import Model
+from pycog.rnn      import RNN, activation_functions_inplace
+from pycog.utils    import get_here, get_parent
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+here       = get_here(__file__)
+modelspath = os.path.join(get_parent(here), 'examples', 'models')
+
+#=========================================================================================
+# Command line
+#=========================================================================================
+
+p = argparse.ArgumentParser()
+p.add_argument('cases', nargs='*', default=[])
+p.add_argument('-N', nargs='+', type=int, default=[100, 256, 1024, 4096])
+p.add_argument('-d', '--density', nargs='+', type=float, default=[1, 0.1])
+p.add_argument('-B', '--batch', nargs='+', type=int, default=[1, 10])
+p.add_argument('-T', nargs='+', type=float, default=[500])
+p.add_argument('--dt', type=float, default=0.5)
+p.add_argument('--tasks', nargs='+', default=['rdm_fixed', 'mante', 'romo', 'sinewave'])
+p.add_argument('--minibatch', nargs='+', type=int, default=[20, 100])
+p.add_argument('--updates', type=int, default=10)
+p.add_argument('--backend', type=str, default=None)
+p.add_argument('-r', '--repeat', type=int, default=3)
+p.add_argument('--baseline', type=str, default=os.path.join(here, 'baseline.json'))
+p.add_argument('--save', action='store_true', default=False)
+p.add_argument('--tolerance', type=float, default=0.25)
+p.add_argument('--memory-tolerance', type=float, default=0.1)
+p.add_argument('--memory-slack', type=float, default=1)
+p.add_argument('-s', '--seed', type=int, default=1)
+p.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+a = p.parse_args()
+
+# Training backend
+if a.backend is None:
+    try:
+        imp.find_module('theano')
+        a.backend = 'theano'
+    except ImportError:
+        a.backend = 'numpy'
+
+#=========================================================================================
+# Helpers
+#=========================================================================================
+
+@contextmanager
+def quiet():
+    """
+    Discard output, e.g., the settings printed by `RNN` and `SGD.train`.
+
+    """
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+def random_Wrec(rng, N, density, dtype=np.float32):
+    """
+    Random recurrent weights with a fraction `density` of nonzero connections and
+    spectral radius close to 1.
+
+    """
+    W = rng.normal(size=(N, N))/np.sqrt(N*density)
+    if density < 1:
+        W *= rng.uniform(size=(N, N)) < density
+
+    return np.asarray(W, dtype=dtype)
+
+def sparsify(W):
+    """
+    Convert `W` to a sparse matrix under the same conditions as `RNN.run`.
+
+    """
+    return RNN.sparsify(W, RNN.defaults['sparse_threshold'], RNN.defaults['sparse_min_N'])
+
+def load_model(task):
+    """
+    Load an example model as its own module, since reloading the same module would
+    keep the names from models loaded before.
+
+    """
+    m = imp.load_source('model_' + task, os.path.join(modelspath, task + '.py'))
+
+    return Model(**vars(m))
+
+#=========================================================================================
+# Cases
+#
+# Each case does its setup and returns a function that runs the benchmark once and
+# returns the time, in seconds, of the benchmarked part.
+#=========================================================================================
+
+def case_euler(N, density, batch, T):
+    rng   = np.random.RandomState(a.seed)
+    Nt    = int(T/a.dt) + 1
+    alpha = (a.dt/100)*np.ones(N, dtype=np.float32)
+    Wrec  = sparsify(random_Wrec(rng, N, density))
+    shape = (N,) if batch == 1 else (batch, N)
+    x0    = 0.1*np.ones(shape, dtype=np.float32)
+    I     = np.asarray(rng.normal(size=(Nt,) + shape), dtype=np.float32)
+    r     = np.zeros((Nt,) + shape, dtype=np.float32)
+
+    f_hidden = activation_functions_inplace['rectify']
+    if sparse is not None and sparse.issparse(Wrec):
+        integrate = euler_sparse if batch == 1 else euler_batch_sparse
+    else:
+        integrate = euler if batch == 1 else euler_batch
+
+    def run():
+        x_t = x0.copy()
+        f_hidden(x_t, r[0])
+
+        tstart = time.time()
+        integrate(alpha, x_t, Wrec, I, f_hidden, r)
+        return time.time() - tstart
+
+    return run
+
+def case_run(N, density, T):
+    rng  = np.random.RandomState(a.seed)
+    Nin  = 4
+    Nout = 2
+    rnnparams = {'N': N, 'Nin': Nin, 'Nout': Nout, 'dt': a.dt,
+                 'hidden_activation': 'rectify'}
+    with quiet():
+        rnn = RNN(rnnparams=rnnparams, verbose=False)
+    rnn.Win  = np.asarray(rng.uniform(size=(N, Nin)), dtype=RNN.dtype)
+    rnn.Wrec = random_Wrec(rng, N, density, RNN.dtype)
+    rnn.Wout = np.asarray(rng.normal(size=(Nout, N))/np.sqrt(N), dtype=RNN.dtype)
+    rnn.bout = np.zeros(Nout, dtype=RNN.dtype)
+
+    def run():
+        tstart = time.time()
+        rnn.run(T, seed=a.seed)
+        return time.time() - tstart
+
+    return run
+
+def case_spectral_radius(N, density):
+    rng  = np.random.RandomState(a.seed)
+    Wrec = sparsify(random_Wrec(rng, N, density, np.float64))
+
+    def run():
+        tstart = time.time()
+        RNN.spectral_radius(Wrec, defaults['rho_tol'], defaults['rho_min_N'])
+        return time.time() - tstart
+
+    return run
+
+def case_dataset(task, minibatch):
+    model  = load_model(task)
+    params = {k: getattr(model.m, k, v) for k, v in defaults.items()}
+    if params['dt'] is None:
+        params['dt'] = np.min(params['tau'])/5 # As in `Trainer`
+    dataset = Dataset(minibatch, model.m, np.float32, params, seed=a.seed,
+                      name='gradient')
+
+    def run():
+        tstart = time.time()
+        for i in xrange(a.updates):
+            dataset.update([], None)
+        return (time.time() - tstart)/a.updates
+
+    return run
+
+def case_train_step(task, minibatch):
+    model = load_model(task)
+
+    # Check after the last update only, with a small validation set
+    settings = {'backend':               a.backend,
+                'n_gradient':            minibatch,
+                'gradient_batch_size':   None,
+                'n_validation':          minibatch,
+                'validation_batch_size': None,
+                'prefetch':              False,
+                'async_validation':      False,
+                'checkfreq':             a.updates,
+                'max_iter':              a.updates + 1}
+    for k, v in settings.items():
+        setattr(model.m, k, v)
+
+    workdir  = tempfile.mkdtemp()
+    savefile = os.path.join(workdir, task + '.pkl')
+
+    def run():
+        with quiet():
+            model.train(savefile, compiledir=workdir, recover=False)
+        with open(savefile, 'rb') as f:
+            timing = pickle.load(f)['timing']
+        return timing['phases']['train_step']/timing['updates']
+
+    run.cleanup = lambda: shutil.rmtree(workdir, ignore_errors=True)
+
+    return run
+
+cases = OrderedDict([
+    ('euler',           (case_euler,           ['N', 'density', 'batch', 'T'])),
+    ('run',             (case_run,             ['N', 'density', 'T'])),
+    ('spectral_radius', (case_spectral_radius, ['N', 'density'])),
+    ('dataset',         (case_dataset,         ['task', 'minibatch'])),
+    ('train_step',      (case_train_step,      ['task', 'minibatch']))
+    ])
+
+grid = {'N':         a.N,
+        'density':   a.density,
+        'batch':     a.batch,
+        'T':         a.T,
+        'task':      a.tasks,
+        'minibatch': a.minibatch}
+
+#=========================================================================================
+# Measure
+#=========================================================================================
+
+def get_maxrss():
+    """
+    Peak resident set size of this process, in bytes.
+
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss
+    return 1024*maxrss
+
+def measure(name, args):
+    """
+    Run a case in this process.
+
+    Returns
+    -------
+
+    time : float
+           Best time over `a.repeat` runs.
+
+    peak_memory : int
+                  Growth of the peak resident set size, in bytes, from before setup.
+
+    """
+    maxrss_start = get_maxrss()
+
+    run = cases[name][0](**args)
+    try:
+        elapsed = min([run() for i in xrange(a.repeat)])
+    finally:
+        if hasattr(run, 'cleanup'):
+            run.cleanup()
+
+    return {'time': elapsed, 'peak_memory': get_maxrss() - maxrss_start}
+
+def measure_in_subprocess(name, args):
+    """
+    Run a case in a new process with the same options, so that its peak memory
+    isn't hidden by the cases before it.
+
+    """
+    job    = json.dumps({'name': name, 'args': args})
+    cmd    = ([sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+              + ['--worker', job])
+    output = subprocess.check_output(cmd).decode('utf-8')
+
+    # The result is the last line, after anything the case prints
+    return json.loads(output.strip().splitlines()[-1])
+
+def compare(result, base):
+    """
+    Relative changes in time and peak memory, and whether either is a regression.
+
+    """
+    changes    = []
+    regression = False
+    for k, tol in [('time', a.tolerance), ('peak_memory', a.memory_tolerance)]:
+        if not base.get(k):
+            changes.append('')
+            continue
+        change = result[k]/base[k] - 1
+        changes.append('{:+.0%}'.format(change))
+        if change > tol:
+            # Resident memory is only measured in pages and allocator chunks, so
+            # small growths are ignored
+            if k == 'peak_memory' and result[k] - base[k] <= a.memory_slack*2**20:
+                continue
+            regression = True
+
+    return changes, regression
+
+def format_memory(nbytes):
+    return '{:.1f} MB'.format(nbytes/2**20)
+
+#=========================================================================================
+# Run
+#=========================================================================================
+
+# Run a single case for `measure_in_subprocess`
+if a.worker is not None:
+    job = json.loads(a.worker)
+    print(json.dumps(measure(job['name'], job['args'])))
+    sys.exit(0)
+
+names = a.cases or list(cases)
+for name in names:
+    if name not in cases:
+        print("Unknown case {}, choose from {}.".format(name, ', '.join(cases)))
+        sys.exit(2)
+
+# Baseline
+if os.path.isfile(a.baseline):
+    with open(a.baseline) as f:
+        baseline = json.load(f)
+else:
+    baseline = {'cases': {}}
+    if not a.save:
+        print("No baseline at {}, run with --save to store one.".format(a.baseline))
+
+print("{} | numpy {} | {} backend | best of {}"
+      .format(platform.node(), np.__version__, a.backend, a.repeat))
+
+results     = OrderedDict()
+regressions = []
+for name in names:
+    dims = cases[name][1]
+    for values in itertools.product(*[grid[d] for d in dims]):
+        args = OrderedDict(zip(dims, values))
+        key  = ' '.join([name] + ['{}={}'.format(d, v) for d, v in args.items()])
+        if name == 'train_step':
+            key += ' backend={}'.format(a.backend)
+
+        result = measure_in_subprocess(name, args)
+        results[key] = result
+
+        s = '{:<55} | {:10.2f} ms | {:>10}'.format(key, 1e3*result['time'],
+                                                   format_memory(result['peak_memory']))
+        if key in baseline['cases']:
+            (dt, dmem), regression = compare(result, baseline['cases'][key])
+            s += ' | {:>6} time, {:>6} memory'.format(dt, dmem)
+            if regression:
+                s += ' | REGRESSION'
+                regressions.append(key)
+        print(s)
+        sys.stdout.flush()
+
+#=========================================================================================
+# Save or gate
+#=========================================================================================
+
+if a.save:
+    baseline['cases'].update(results)
+    baseline['machine'] = {'node':     platform.node(),
+                           'platform': platform.platform(),
+                           'python':   platform.python_version(),
+                           'numpy':    np.__version__}
+    baseline['date'] = time.strftime('%b %d %Y %I:%M:%S %p')
+    with open(a.baseline, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print("Baseline saved to {}.".format(a.baseline))
+elif regressions:
+    print("{} of {} cases regressed (tolerance {:.0%} time, {:.0%} memory)."
+          .format(len(regressions), len(results), a.tolerance, a.memory_tolerance))
+    sys.exit(1)
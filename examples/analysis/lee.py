@@ -70,7 +70,8 @@ def run_trials(p, args):
             # Trial
             trial_func = m.generate_trial
             trial_args = {'name': 'test', 'seq': seq}
-            info = rnn.run(inputs=(trial_func, trial_args), rng=rng)
+            info = rnn.run(inputs=(trial_func, trial_args), rng=rng,
+                           dt_save=p['dt_save'])
 
             # Display trial type
             s = "Trial {:>{}}/{}: Sequence #{}".format(i+1, w, ntrials, info['seq'])
@@ -79,13 +80,11 @@ def run_trials(p, args):
             backspaces = len(s)
 
             # Add
-            dt    = rnn.t[1] - rnn.t[0]
-            step  = int(p['dt_save']/dt)
             trial = {
-                't':    rnn.t[::step],
-                'u':    rnn.u[:,::step],
-                'r':    rnn.r[:,::step],
-                'z':    rnn.z[:,::step],
+                't':    rnn.t,
+                'u':    rnn.u,
+                'r':    rnn.r,
+                'z':    rnn.z,
                 'info': info
                 }
             trials.append(trial)
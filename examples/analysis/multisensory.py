@@ -83,7 +83,8 @@ def run_trials(p, args):
                 'modality': modality,
                 'freq':     freq
                 }
-            info = rnn.run(inputs=(trial_func, trial_args), rng=rng)
+            info = rnn.run(inputs=(trial_func, trial_args), rng=rng,
+                           dt_save=p['dt_save'])
 
             # Display trial type
             if info['modality'] == 'v':
@@ -97,13 +98,11 @@ def run_trials(p, args):
             backspaces = len(s)
 
             # Save
-            dt    = rnn.t[1] - rnn.t[0]
-            step  = int(p['dt_save']/dt)
             trial = {
-                't':    rnn.t[::step],
-                'u':    rnn.u[:,::step],
-                'r':    rnn.r[:,::step],
-                'z':    rnn.z[:,::step],
+                't':    rnn.t,
+                'u':    rnn.u,
+                'r':    rnn.r,
+                'z':    rnn.z,
                 'info': info
                 }
             trials.append(trial)
@@ -30,18 +30,9 @@ def get_trialsfile(p):
 
 # Load trials
 def load_trials(trialsfile):
-    
-    while True:             
-        try:
-            with file(trialsfile, 'rb') as f:
-                trials = pickle.load(f)
-                break
-        except EOFError:
-            wait = 5
-            print("[ {}.RNN ] Got an EOFError, trying again in {} seconds."
-                  .format(THIS, wait))
-            time.sleep(wait)
-    
+    with file(trialsfile, 'rb') as f:
+        trials = pickle.load(f)
+
     return trials, len(trials)
 
 # File to store sorted trials in
@@ -152,7 +143,8 @@ def run_trials(p, args):
                 'coh':    coh,
                 'in_out': in_out
                 }
-            info = rnn.run(inputs=(trial_func, trial_args), rng=rng)
+            info = rnn.run(inputs=(trial_func, trial_args), rng=rng,
+                           dt_save=p['dt_save'])
 
             # Display trial type
             #if coh == 0:
@@ -167,13 +159,11 @@ def run_trials(p, args):
                 sys.stdout.flush()
 
             # Save
-            dt    = rnn.t[1] - rnn.t[0]
-            step  = int(p['dt_save']/dt)
             trial = {
-                't':    rnn.t[::step],
-                'u':    rnn.u[:,::step],
-                'r':    rnn.r[:,::step],
-                'z':    rnn.z[:,::step],
+                't':    rnn.t,
+                'u':    rnn.u,
+                'r':    rnn.r,
+                'z':    rnn.z,
                 'info': info
                 }
             trials.append(trial)
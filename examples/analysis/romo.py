@@ -107,7 +107,8 @@ def run_trials(p, args):
                 'fpair': fpair,
                 'gt_lt': gt_lt
                 }
-            info = rnn.run(inputs=(trial_func, trial_args), rng=rng)
+            info = rnn.run(inputs=(trial_func, trial_args), rng=rng,
+                           dt_save=p['dt_save'])
 
             # Display trial type
             if info['f1'] > info['f2']:
@@ -121,13 +122,11 @@ def run_trials(p, args):
             backspaces = len(s)
 
             # Save
-            dt    = rnn.t[1] - rnn.t[0]
-            step  = int(p['dt_save']/dt)
             trial = {
-                't':    rnn.t[::step],
-                'u':    rnn.u[:,::step],
-                'r':    rnn.r[:,::step],
-                'z':    rnn.z[:,::step],
+                't':    rnn.t,
+                'u':    rnn.u,
+                'r':    rnn.r,
+                'z':    rnn.z,
                 'info': info
                 }
             trials.append(trial)
@@ -13,10 +13,10 @@ import os
 import shutil
 import subprocess
 import sys
-import time
 from   os.path import join
 
-from pycog.utils import get_here, mkdir_p
+from pycog        import netfile
+from pycog.utils  import get_here, mkdir_p
 
 #=========================================================================================
 # Command line
@@ -116,13 +116,14 @@ elif action == 'clean':
 
     # Data files
     base, ext = os.path.splitext(savefile)
-    fnames = glob(base + '*' + ext)
+    fnames = (glob(base + '*' + ext) + glob(base + '*' + netfile.EXT)
+              + glob(base + '*.history') + glob(base + '*.timing.jsonl'))
     for fname in fnames:
         os.remove(fname)
         print("Removed {}".format(fname))
 
     # Theano compile directories
-    fnames = glob('{}/{}-*'.format(theanopath, name))
+    fnames = glob('{}/*'.format(theanopath))
     for fname in fnames:
         shutil.rmtree(fname)
         print("Removed {}".format(fname))
@@ -165,11 +166,8 @@ elif action == 'train':
     # Model specification
     model = Model(modelfile=modelfile)
 
-    # Avoid locks on the cluster
-    compiledir = join(theanopath, '{}-{}'.format(name, int(time.time())))
-
-    # Train
-    model.train(savefile, seed=seed, compiledir=compiledir, gpus=gpus)
+    # Train, reusing code compiled for the same network by previous runs
+    model.train(savefile, seed=seed, compiledir=theanopath, gpus=gpus)
 
 #=========================================================================================
 # Test resting state
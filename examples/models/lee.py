@@ -28,7 +28,8 @@ sequences = {
     7: [4] + [3, 7, 6],
     8: [4] + [5, 7, 8]
 }
-nseq = len(sequences)
+nseq       = len(sequences)
+conditions = sorted(sequences)
 
 # Possible targets from each position
 #
@@ -88,7 +89,9 @@ def generate_trial(rng, dt, params):
     # Select task condition
     #---------------------------------------------------------------------------------
 
-    if params['name'] in ['gradient', 'test']:
+    if 'condition' in params:
+        seq = params['condition']
+    elif params['name'] in ['gradient', 'test']:
         seq = params.get('seq', rng.choice(sequences.keys()))
     elif params['name'] == 'validation':
         b = params['minibatch_index'] % nseq
@@ -178,6 +181,92 @@ def generate_trial(rng, dt, params):
 
     return trial
 
+def generate_batch(rng, dt, params, B):
+    #---------------------------------------------------------------------------------
+    # Select task conditions
+    #---------------------------------------------------------------------------------
+
+    if params['name'] in ['gradient', 'test']:
+        seq = np.asarray(sorted(sequences))[rng.choice(nseq, B)]
+    elif params['name'] == 'validation':
+        seq = np.concatenate([rng.permutation(nseq) for b in xrange(0, B, nseq)])[:B] + 1
+    else:
+        raise ValueError("Unknown trial type.")
+
+    #-------------------------------------------------------------------------------------
+    # Epochs
+    #-------------------------------------------------------------------------------------
+
+    iti      = 1000
+    fixation = 1000
+    M1       = 500
+    M2       = 500
+    M3       = 500
+    T        = iti + fixation + M1 + M2 + M3
+
+    epochs = {
+        'iti':      (0, iti),
+        'fixation': (iti, iti + fixation),
+        'M1':       (iti + fixation, iti + fixation + M1),
+        'M2':       (iti + fixation + M1, iti + fixation + M1 + M2),
+        'M3':       (iti + fixation + M1 + M2, iti + fixation + M1 + M2 + M3),
+        }
+    T = T*np.ones(B, dtype=int)
+
+    #---------------------------------------------------------------------------------
+    # Trial info
+    #---------------------------------------------------------------------------------
+
+    t, lengths, e = tasktools.get_epochs_mask(dt, T, epochs)
+
+    catch  = np.zeros(B, dtype=bool)
+    infos  = [{'seq': seq[b].item()} for b in xrange(B)]
+    trials = tasktools.split_trials(t, lengths, T, epochs, infos, catch)
+
+    #---------------------------------------------------------------------------------
+    # Inputs and target outputs
+    #---------------------------------------------------------------------------------
+
+    X = np.zeros((len(t), B, Nin))
+    Y = np.zeros((len(t), B, Nout))
+    M = np.zeros((len(t), B, Nout))
+
+    # Which sequence?
+    X[:,np.arange(B),np.asarray(SEQUENCE)[seq-1]] = 1
+
+    for s, sequence in sequences.items():
+        trial = (seq == s)
+
+        # Options
+        X[e['fixation'] & trial,sequence[0]] = 1
+        for I, J in zip([e['M1'], e['M2'], e['M3']],
+                        [[sequence[0]] + options[sequence[0]],
+                         [sequence[1]] + options[sequence[1]],
+                         [sequence[2]] + options[sequence[2]]]):
+            for j in J:
+                X[I & trial,j] = 1
+
+        # Hold gaze
+        Y[e['fixation'] & trial] = target_position(sequence[0])
+        Y[e['M1'] & trial]       = target_position(sequence[1])
+        Y[e['M2'] & trial]       = target_position(sequence[2])
+        Y[e['M3'] & trial]       = target_position(sequence[3])
+
+    # We don't constrain the intertrial interval
+    M[e['fixation'] | e['M1'] | e['M2'] | e['M3']] = 1
+
+    #---------------------------------------------------------------------------------
+
+    return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
+def sample_conditions(rng, params, B):
+    if params['name'] in ['gradient', 'test']:
+        return rng.choice(nseq, B)
+    elif params['name'] == 'validation':
+        return np.concatenate([rng.permutation(nseq) for b in xrange(0, B, nseq)])[:B]
+    else:
+        raise ValueError("Unknown trial type.")
+
 min_error = 0.05
 
 mode         = 'continuous'
@@ -40,6 +40,12 @@ cohs        = [1, 3, 10]
 left_rights = [1, -1]
 nconditions = len(contexts)*(len(cohs)*len(left_rights))**2
 pcatch      = 1/(nconditions + 1)
+conditions  = [None] + [(context, coh_m, coh_c, left_right_m, left_right_c)
+                        for left_right_c in left_rights
+                        for left_right_m in left_rights
+                        for coh_c in cohs
+                        for coh_m in cohs
+                        for context in contexts]
 
 SCALE = 5
 def scale(coh):
@@ -51,7 +57,12 @@ def generate_trial(rng, dt, params):
     #-------------------------------------------------------------------------------------
 
     catch_trial = False
-    if params['name'] in ['gradient', 'test']:
+    if 'condition' in params:
+        if params['condition'] is None:
+            catch_trial = True
+        else:
+            context, coh_m, coh_c, left_right_m, left_right_c = params['condition']
+    elif params['name'] in ['gradient', 'test']:
         if params.get('catch', rng.rand() < pcatch):
             catch_trial = True
         else:
@@ -197,9 +208,111 @@ def generate_trial(rng, dt, params):
 
     return trial
 
+def generate_batch(rng, dt, params, B):
+    #-------------------------------------------------------------------------------------
+    # Select task conditions
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] in ['gradient', 'test']:
+        catch = rng.rand(B) < pcatch
+        k     = [rng.choice(len(contexts), B),
+                 rng.choice(len(cohs), B), rng.choice(len(cohs), B),
+                 rng.choice(len(left_rights), B), rng.choice(len(left_rights), B)]
+    elif params['name'] == 'validation':
+        b     = np.arange(B) % (nconditions + 1)
+        catch = (b == 0)
+        k     = tasktools.unravel_index(np.maximum(b-1, 0),
+                                        (len(contexts),
+                                         len(cohs), len(cohs),
+                                         len(left_rights), len(left_rights)))
+    else:
+        raise ValueError("Unknown trial type.")
+    context      = np.asarray(contexts)[k[0]]
+    coh_m        = np.asarray(cohs)[k[1]]
+    coh_c        = np.asarray(cohs)[k[2]]
+    left_right_m = np.asarray(left_rights)[k[3]]
+    left_right_c = np.asarray(left_rights)[k[4]]
+
+    # Correct choice
+    left_right = np.where(context == 'm', left_right_m, left_right_c)
+    choice     = np.where(left_right > 0, 0, 1)
+
+    #-------------------------------------------------------------------------------------
+    # Epochs
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] == 'test':
+        fixation = 400
+    else:
+        fixation = 100
+    stimulus = 800
+    decision = 300
+    T        = np.where(catch, 2000, fixation + stimulus + decision)
+
+    # Catch trials have no epochs
+    on     = ~catch
+    epochs = {
+        'fixation': (0,                        on*fixation),
+        'stimulus': (on*fixation,              on*(fixation + stimulus)),
+        'decision': (on*(fixation + stimulus), on*T)
+        }
+
+    #-------------------------------------------------------------------------------------
+    # Trial info
+    #-------------------------------------------------------------------------------------
+
+    t, lengths, e = tasktools.get_epochs_mask(dt, T, epochs)
+
+    infos = [{} if catch[b] else {'coh_m':        coh_m[b].item(),
+                                  'left_right_m': left_right_m[b].item(),
+                                  'coh_c':        coh_c[b].item(),
+                                  'left_right_c': left_right_c[b].item(),
+                                  'context':      str(context[b]),
+                                  'choice':       choice[b].item()}
+             for b in xrange(B)]
+    trials = tasktools.split_trials(t, lengths, T, epochs, infos, catch)
+
+    #-------------------------------------------------------------------------------------
+    # Inputs
+    #-------------------------------------------------------------------------------------
+
+    stimulus = e['stimulus']
+
+    X = np.zeros((len(t), B, Nin))
+
+    # Context
+    X[:,:,0] = stimulus*(context == 'm')
+    X[:,:,1] = stimulus*(context != 'm')
+
+    # Motion stimulus
+    X[:,:,2] = stimulus*np.where(left_right_m > 0, scale(+coh_m), scale(-coh_m))
+    X[:,:,3] = stimulus*np.where(left_right_m > 0, scale(-coh_m), scale(+coh_m))
+
+    # Colour stimulus
+    X[:,:,4] = stimulus*np.where(left_right_c > 0, scale(+coh_c), scale(-coh_c))
+    X[:,:,5] = stimulus*np.where(left_right_c > 0, scale(-coh_c), scale(+coh_c))
+
+    #-------------------------------------------------------------------------------------
+    # Target output
+    #-------------------------------------------------------------------------------------
+
+    Y, M = tasktools.targets_2afc(lengths, e, choice, catch)
+
+    #-------------------------------------------------------------------------------------
+
+    return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
 # Gradient dataset
 n_gradient = 50
 
+def sample_conditions(rng, params, B):
+    if params['name'] in ['gradient', 'test']:
+        return np.where(rng.rand(B) < pcatch, 0, 1 + rng.choice(nconditions, B))
+    elif params['name'] == 'validation':
+        return np.arange(B) % (nconditions + 1)
+    else:
+        raise ValueError("Unknown trial type.")
+
 # Performance measure
 performance = tasktools.performance_2afc
 
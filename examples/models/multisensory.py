@@ -73,6 +73,7 @@ freqs       = range(9, 16+1)
 boundary    = 12.5
 nconditions = len(modalities)*len(freqs)
 pcatch      = 5/(nconditions + 1)
+conditions  = [None] + [(modality, freq) for freq in freqs for modality in modalities]
 
 fmin = min(freqs)
 fmax = max(freqs)
@@ -95,7 +96,12 @@ def generate_trial(rng, dt, params):
     #-------------------------------------------------------------------------------------
 
     catch_trial = False
-    if params['name'] in ['gradient', 'test']:
+    if 'condition' in params:
+        if params['condition'] is None:
+            catch_trial = True
+        else:
+            modality, freq = params['condition']
+    elif params['name'] in ['gradient', 'test']:
         if params.get('catch', rng.rand() < pcatch):
             catch_trial = True
         else:
@@ -203,6 +209,92 @@ def generate_trial(rng, dt, params):
 
     return trial
 
+def generate_batch(rng, dt, params, B):
+    #-------------------------------------------------------------------------------------
+    # Select task conditions
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] in ['gradient', 'test']:
+        catch = rng.rand(B) < pcatch
+        k1    = rng.choice(len(modalities), B)
+        k2    = rng.choice(len(freqs), B)
+    elif params['name'] == 'validation':
+        b      = np.arange(B) % (nconditions + 1)
+        catch  = (b == 0)
+        k1, k2 = tasktools.unravel_index(np.maximum(b-1, 0),
+                                         (len(modalities), len(freqs)))
+    else:
+        raise ValueError("Unknown trial type.")
+    modality = np.asarray(modalities)[k1]
+    freq     = np.asarray(freqs)[k2]
+
+    # Correct choice
+    choice = np.where(freq > boundary, 0, 1)
+
+    #-------------------------------------------------------------------------------------
+    # Epochs
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] == 'test':
+        fixation = 500
+    else:
+        fixation = 100
+    stimulus = 1000
+    decision = 300
+    T        = np.where(catch, 2500, fixation + stimulus + decision)
+
+    # Catch trials have no epochs
+    on     = ~catch
+    epochs = {
+        'fixation': (0,                        on*fixation),
+        'stimulus': (on*fixation,              on*(fixation + stimulus)),
+        'decision': (on*(fixation + stimulus), on*T)
+        }
+
+    #-------------------------------------------------------------------------------------
+    # Trial info
+    #-------------------------------------------------------------------------------------
+
+    t, lengths, e = tasktools.get_epochs_mask(dt, T, epochs)
+
+    infos = [{} if catch[b] else {'modality': str(modality[b]),
+                                  'freq':     freq[b].item(),
+                                  'choice':   choice[b].item()}
+             for b in xrange(B)]
+    trials = tasktools.split_trials(t, lengths, T, epochs, infos, catch)
+
+    #-------------------------------------------------------------------------------------
+    # Inputs
+    #-------------------------------------------------------------------------------------
+
+    visual   = np.array(['v' in m for m in modalities])[k1]
+    auditory = np.array(['a' in m for m in modalities])[k1]
+
+    X = np.zeros((len(t), B, Nin))
+    X[:,:,VISUAL_P]   = e['stimulus']*visual*scale_v_p(freq)
+    X[:,:,VISUAL_N]   = e['stimulus']*visual*scale_v_n(freq)
+    X[:,:,AUDITORY_P] = e['stimulus']*auditory*scale_a_p(freq)
+    X[:,:,AUDITORY_N] = e['stimulus']*auditory*scale_a_n(freq)
+    X[:,:,START]      = e['stimulus'] | e['decision']
+
+    #-------------------------------------------------------------------------------------
+    # Target output
+    #-------------------------------------------------------------------------------------
+
+    Y, M = tasktools.targets_2afc(lengths, e, choice, catch)
+
+    #-------------------------------------------------------------------------------------
+
+    return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
+def sample_conditions(rng, params, B):
+    if params['name'] in ['gradient', 'test']:
+        return np.where(rng.rand(B) < pcatch, 0, 1 + rng.choice(nconditions, B))
+    elif params['name'] == 'validation':
+        return np.arange(B) % (nconditions + 1)
+    else:
+        raise ValueError("Unknown trial type.")
+
 # Performance measure
 performance = tasktools.performance_2afc
 
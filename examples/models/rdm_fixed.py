@@ -86,6 +86,7 @@ cohs        = [1, 2, 4, 8, 16]
 in_outs     = [1, -1]
 nconditions = len(cohs)*len(in_outs)
 pcatch      = 1/(nconditions + 1)
+conditions  = [None] + [(coh, in_out) for in_out in in_outs for coh in cohs]
 
 SCALE = 3.2
 def scale(coh):
@@ -97,7 +98,12 @@ def generate_trial(rng, dt, params):
     #-------------------------------------------------------------------------------------
 
     catch_trial = False
-    if params['name'] in ['gradient', 'test']:
+    if 'condition' in params:
+        if params['condition'] is None:
+            catch_trial = True
+        else:
+            coh, in_out = params['condition']
+    elif params['name'] in ['gradient', 'test']:
         if params.get('catch', rng.rand() < pcatch):
             catch_trial = True
         else:
@@ -199,6 +205,85 @@ def generate_trial(rng, dt, params):
 
     return trial
 
+def generate_batch(rng, dt, params, B):
+    #-------------------------------------------------------------------------------------
+    # Select task conditions
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] in ['gradient', 'test']:
+        catch  = rng.rand(B) < pcatch
+        coh    = np.asarray(cohs)[rng.choice(len(cohs), B)]
+        in_out = np.asarray(in_outs)[rng.choice(len(in_outs), B)]
+    elif params['name'] == 'validation':
+        b      = np.arange(B) % (nconditions + 1)
+        catch  = (b == 0)
+        k0, k1 = tasktools.unravel_index(np.maximum(b-1, 0), (len(cohs), len(in_outs)))
+        coh    = np.asarray(cohs)[k0]
+        in_out = np.asarray(in_outs)[k1]
+    else:
+        raise ValueError("Unknown trial type.")
+
+    # Correct choice
+    choice = np.where(in_out > 0, 0, 1)
+
+    #-------------------------------------------------------------------------------------
+    # Epochs
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] == 'test':
+        fixation = 300
+    else:
+        fixation = 100
+    stimulus = 800
+    decision = 300
+    T        = np.where(catch, 2000, fixation + stimulus + decision)
+
+    # Catch trials have no epochs
+    on     = ~catch
+    epochs = {
+        'fixation': (0,                        on*fixation),
+        'stimulus': (on*fixation,              on*(fixation + stimulus)),
+        'decision': (on*(fixation + stimulus), on*T)
+        }
+
+    #-------------------------------------------------------------------------------------
+    # Trial info
+    #-------------------------------------------------------------------------------------
+
+    t, lengths, e = tasktools.get_epochs_mask(dt, T, epochs)
+
+    infos = [{} if catch[b] else {'coh':    coh[b].item(),
+                                  'in_out': in_out[b].item(),
+                                  'choice': choice[b].item()}
+             for b in xrange(B)]
+    trials = tasktools.split_trials(t, lengths, T, epochs, infos, catch)
+
+    #-------------------------------------------------------------------------------------
+    # Inputs
+    #-------------------------------------------------------------------------------------
+
+    X = np.zeros((len(t), B, Nin))
+    X[:,:,0] = e['stimulus']*np.where(choice == 0, scale(+coh), scale(-coh))
+    X[:,:,1] = e['stimulus']*np.where(choice == 1, scale(+coh), scale(-coh))
+
+    #-------------------------------------------------------------------------------------
+    # Target output
+    #-------------------------------------------------------------------------------------
+
+    Y, M = tasktools.targets_2afc(lengths, e, choice, catch)
+
+    #-------------------------------------------------------------------------------------
+
+    return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
+def sample_conditions(rng, params, B):
+    if params['name'] in ['gradient', 'test']:
+        return np.where(rng.rand(B) < pcatch, 0, 1 + rng.choice(nconditions, B))
+    elif params['name'] == 'validation':
+        return np.arange(B) % (nconditions + 1)
+    else:
+        raise ValueError("Unknown trial type.")
+
 # Performance measure
 performance = tasktools.performance_2afc
 
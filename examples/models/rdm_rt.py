@@ -164,6 +164,83 @@ def generate_trial(rng, dt, params):
 
     return trial
 
+def generate_batch(rng, dt, params, B):
+    #-------------------------------------------------------------------------------------
+    # Select task conditions
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] in ['gradient', 'test']:
+        catch  = rng.rand(B) < pcatch
+        coh    = np.asarray(cohs)[rng.choice(len(cohs), B)]
+        in_out = np.asarray(in_outs)[rng.choice(len(in_outs), B)]
+    elif params['name'] == 'validation':
+        b      = np.arange(B) % (nconditions + 1)
+        catch  = (b == 0)
+        k0, k1 = tasktools.unravel_index(np.maximum(b-1, 0), (len(cohs), len(in_outs)))
+        coh    = np.asarray(cohs)[k0]
+        in_out = np.asarray(in_outs)[k1]
+    else:
+        raise ValueError("Unknown trial type.")
+
+    # Correct choice
+    choice = np.where(in_out > 0, 0, 1)
+
+    #-------------------------------------------------------------------------------------
+    # Epochs
+    #-------------------------------------------------------------------------------------
+
+    if params['name'] == 'test':
+        fixation = 300
+        stimulus = 1500
+    else:
+        fixation = 100
+        stimulus = 800
+    no_reward = 300
+    T         = np.where(catch, 2000, fixation + stimulus)
+
+    # Catch trials have no epochs
+    on     = ~catch
+    epochs = {
+        'fixation': (0,                         on*fixation),
+        'stimulus': (on*fixation,               on*T),
+        'decision': (on*(fixation + no_reward), on*T)
+        }
+
+    #-------------------------------------------------------------------------------------
+    # Trial info
+    #-------------------------------------------------------------------------------------
+
+    t, lengths, e = tasktools.get_epochs_mask(dt, T, epochs)
+
+    infos = [{} if catch[b] else {'coh':    coh[b].item(),
+                                  'in_out': in_out[b].item(),
+                                  'choice': choice[b].item()}
+             for b in xrange(B)]
+    trials = tasktools.split_trials(t, lengths, T, epochs, infos, catch)
+
+    #-------------------------------------------------------------------------------------
+    # Inputs
+    #-------------------------------------------------------------------------------------
+
+    X = np.zeros((len(t), B, Nin))
+
+    # Stimulus
+    X[:,:,0] = e['stimulus']*np.where(choice == 0, scale(+coh), scale(-coh))
+    X[:,:,1] = e['stimulus']*np.where(choice == 1, scale(+coh), scale(-coh))
+
+    # Start cue
+    X[:,:,START] = e['stimulus']
+
+    #-------------------------------------------------------------------------------------
+    # Target output
+    #-------------------------------------------------------------------------------------
+
+    Y, M = tasktools.targets_2afc(lengths, e, choice, catch, hi=1.2)
+
+    #-------------------------------------------------------------------------------------
+
+    return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
 # Performance measure
 performance = tasktools.performance_2afc
 
@@ -182,6 +182,93 @@ def generate_trial(rng, dt, params):
 
     return trial
 
+def generate_batch(rng, dt, params, B):
+    #---------------------------------------------------------------------------------
+    # Select task conditions
+    #---------------------------------------------------------------------------------
+
+    if params['name'] in ['gradient', 'test']:
+        catch = rng.rand(B) < pcatch
+        k0    = rng.choice(len(fpairs), B)
+        k1    = rng.choice(len(gt_lts), B)
+    elif params['name'] == 'validation':
+        b      = np.arange(B) % (nconditions + 1)
+        catch  = (b == 0)
+        k0, k1 = tasktools.unravel_index(np.maximum(b-1, 0), (len(fpairs), len(gt_lts)))
+    else:
+        raise ValueError("Unknown trial type.")
+
+    # Correct choice
+    gt     = (np.asarray(gt_lts)[k1] == '>')
+    fpair  = np.asarray(fpairs)[k0]
+    f1     = np.where(gt, fpair[:,0], fpair[:,1])
+    f2     = np.where(gt, fpair[:,1], fpair[:,0])
+    choice = np.where(gt, 0, 1)
+
+    #---------------------------------------------------------------------------------
+    # Epochs
+    #---------------------------------------------------------------------------------
+
+    if params['name'] == 'test':
+        fixation = 500
+    else:
+        fixation = 100
+    f1_dur = 500
+    if params['name'] == 'test':
+        delay = 3000
+    else:
+        delay = tasktools.uniform_batch(rng, dt, 2500, 3500, B)
+    f2_dur   = 500
+    decision = 300
+    T        = np.where(catch, 2500, fixation + f1_dur + delay + f2_dur + decision)
+
+    # Catch trials have no epochs
+    on     = ~catch
+    epochs = {
+        'fixation': (0,                                   on*fixation),
+        'f1':       (on*fixation,                         on*(fixation + f1_dur)),
+        'delay':    (on*(fixation + f1_dur),              on*(fixation + f1_dur + delay)),
+        'f2':       (on*(fixation + f1_dur + delay),
+                     on*(fixation + f1_dur + delay + f2_dur)),
+        'decision': (on*(fixation + f1_dur + delay + f2_dur), on*T)
+        }
+
+    #---------------------------------------------------------------------------------
+    # Trial info
+    #---------------------------------------------------------------------------------
+
+    t, lengths, e = tasktools.get_epochs_mask(dt, T, epochs)
+
+    infos = [{} if catch[b] else {'f1':     f1[b].item(),
+                                  'f2':     f2[b].item(),
+                                  'choice': choice[b].item()}
+             for b in xrange(B)]
+    trials = tasktools.split_trials(t, lengths, T, epochs, infos, catch)
+
+    #---------------------------------------------------------------------------------
+    # Inputs
+    #---------------------------------------------------------------------------------
+
+    X = np.zeros((len(t), B, Nin))
+
+    # Stimulus 1
+    X[:,:,POS] += e['f1']*scale_p(f1)
+    X[:,:,NEG] += e['f1']*scale_n(f1)
+
+    # Stimulus 2
+    X[:,:,POS] += e['f2']*scale_p(f2)
+    X[:,:,NEG] += e['f2']*scale_n(f2)
+
+    #---------------------------------------------------------------------------------
+    # Target output
+    #---------------------------------------------------------------------------------
+
+    Y, M = tasktools.targets_2afc(lengths, e, choice, catch)
+
+    #---------------------------------------------------------------------------------
+
+    return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
 # Performance measure
 performance = tasktools.performance_2afc_min_condition
 
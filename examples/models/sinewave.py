@@ -51,6 +51,13 @@ trial['outputs'] = 0.9*np.sin(2*np.pi*t/period)[:,None]
 def generate_trial(rng, dt, params):
     return trial
 
+def generate_batch(rng, dt, params, B):
+    return {
+        'trials':  B*[trial],
+        'inputs':  np.zeros((len(t), B, 0)),
+        'outputs': np.tile(trial['outputs'][:,None,:], (1, B, 1))
+        }
+
 # Target error
 min_error = 0.05
 
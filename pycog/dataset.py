@@ -1,7 +1,12 @@
+from __future__ import absolute_import
 from __future__ import division
 
+import threading
+
 import numpy as np
 
+from .utils import noise_factor
+
 class Dataset(object):
     """
     Dataset for training.
@@ -11,9 +16,21 @@ class Dataset(object):
     def rectify(x):
         return x*(x > 0)
 
+    @staticmethod
+    def get_noise_factor(var):
+        """
+        Factor of a noise covariance, or `None` for independent noise.
+
+        """
+        if np.isscalar(var) or np.ndim(var) < 2:
+            return None
+        return noise_factor(var)
+
     #/////////////////////////////////////////////////////////////////////////////////////
 
-    def __init__(self, size, task, floatX, p, batch_size=None, seed=1, name='Dataset'):
+    def __init__(self, size, task, floatX, p, batch_size=None, seed=1, name='Dataset',
+                 prefetch=False, bucket=False, fixed=False, refresh=None,
+                 graph_noise=False):
         """
 
         Parameters
@@ -40,6 +57,29 @@ class Dataset(object):
                Name of the dataset, which can be used by `task`, e.g., to distinguish
                between gradient and validation datasets.
 
+        prefetch : bool
+                   If `True`, generate the next `batch_size` trials in a background
+                   thread while the current ones are used. The trials are identical
+                   to those generated without prefetching.
+
+        bucket : bool
+                 If `True`, put trials of similar duration in the same minibatch and
+                 cut each minibatch after its longest trial, which reduces the number
+                 of padded time steps when `batch_size` is larger than `size`.
+
+        fixed : bool
+                If `True`, generate the trials once and return the same trials every
+                time, generating new ones only when `callback_results` changes.
+
+        refresh : int, optional
+                  With `fixed`, draw new noise for the fixed trials every `refresh`
+                  updates. If `None`, the noise is fixed as well.
+
+        graph_noise : bool
+                      If `True`, the noise is generated in the network graph, so the
+                      inputs only contain the `Nin` input channels, without baseline
+                      and noise.
+
         """
         self.minibatch_size = size
         self.task           = task
@@ -54,6 +94,10 @@ class Dataset(object):
         self.tau     = p['tau']
         self.var_rec = 2/p['dt']*p['var_rec']
 
+        # Factor correlated noise covariances once
+        self.L_in  = Dataset.get_noise_factor(self.var_in)
+        self.L_rec = Dataset.get_noise_factor(self.var_rec)
+
         # Random number generator
         self.rng = np.random.RandomState(seed)
 
@@ -69,6 +113,33 @@ class Dataset(object):
         self.ntrials   = 0
         self.trial_idx = self.batch_size
 
+        # Prefetching
+        self.prefetch   = prefetch
+        self.next_block = None
+
+        # Bucketing
+        self.bucket        = bucket
+        self.lengths       = None
+        self.nsteps        = 0
+        self.nsteps_padded = 0
+
+        # Noise generated in the network graph
+        self.graph_noise = graph_noise
+        self.noise_draws = 0
+
+        # Fixed trials
+        self.fixed            = fixed
+        self.refresh          = refresh
+        self.clean_inputs     = None
+        self.callback_results = None
+        self.nupdates         = 0
+
+        # Condition templates
+        self.use_templates  = (hasattr(task, 'conditions')
+                               and hasattr(task, 'sample_conditions'))
+        self.templates      = None
+        self.templates_lock = threading.Lock()
+
     #/////////////////////////////////////////////////////////////////////////////////////
 
     def has_output_mask(self):
@@ -106,8 +177,28 @@ class Dataset(object):
             self.update(best_costs, callback_results)
             self.ntrials += self.minibatch_size
 
-        return [self.inputs [:,self.trial_idx:self.trial_idx+self.minibatch_size,:],
-                self.targets[:,self.trial_idx:self.trial_idx+self.minibatch_size,:]]
+        trials  = slice(self.trial_idx, self.trial_idx+self.minibatch_size)
+        lengths = self.lengths[trials]
+        if self.bucket:
+            T = np.max(lengths)
+        else:
+            T = self.inputs.shape[0]
+
+        if update:
+            self.nsteps        += T*len(lengths)
+            self.nsteps_padded += T*len(lengths) - np.sum(lengths)
+
+        return [self.inputs [:T,trials,:],
+                self.targets[:T,trials,:]]
+
+    def get_padding(self):
+        """
+        Return the fraction of time steps in the minibatches so far that are padding.
+
+        """
+        if self.nsteps == 0:
+            return 0
+        return self.nsteps_padded/self.nsteps
 
     def get_trials(self):
         """
@@ -141,35 +232,181 @@ class Dataset(object):
                            Results the trial function can use to modify training.
 
         """
+        if self.fixed:
+            self.update_fixed(best_costs, callback_results)
+            return
+
         self.trial_idx += self.minibatch_size
         if self.trial_idx + self.minibatch_size > self.batch_size:
             self.trial_idx = 0
 
-            self.trials = []
-            for b in xrange(self.batch_size):
-                params = {
-                    'callback_results': callback_results,
-                    'target_output':    True,
-                    'minibatch_index':  b,
-                    'best_costs':       best_costs,
-                    'name':             self.name
-                    }
-                self.trials.append(self.task.generate_trial(self.rng, self.dt, params))
-
-            # Longest trial
-            k = np.argmax([len(trial['t']) for trial in self.trials])
-            t = self.trials[k]['t']
-
-            # Input and output matrices
-            Nin, N, Nout = self.network_shape
-            T = len(t)
-            B = self.batch_size
-            x = np.zeros((T, B, Nin+N),  dtype=self.floatX)
-            y = np.zeros((T, B, 2*Nout), dtype=self.floatX)
-
-            # Pad trials
-            for b, trial in enumerate(self.trials):
-                Nt = len(trial['t'])
+            self.trials, self.inputs, self.targets = self.fetch(best_costs,
+                                                                callback_results)
+            self.lengths = np.array([len(trial['t']) for trial in self.trials])
+            if self.prefetch:
+                self.start_prefetch(best_costs, callback_results)
+
+    def update_fixed(self, best_costs, callback_results):
+        """
+        Update for fixed trials: generate the trials the first time and whenever
+        `callback_results` changes, and otherwise only redraw the noise every
+        `self.refresh` updates.
+
+        """
+        Nin, N, Nout = self.network_shape
+
+        if self.inputs is None or callback_results is not self.callback_results:
+            self.trial_idx = 0
+            self.trials, self.inputs, self.targets = self.generate(
+                self.rng, best_costs, callback_results, noise=False
+                )
+            self.lengths          = np.array([len(trial['t']) for trial in self.trials])
+            self.clean_inputs     = self.inputs[:,:,:Nin].copy()
+            self.callback_results = callback_results
+            self.nupdates         = 0
+        else:
+            self.nupdates += 1
+            if not self.refresh or self.nupdates % self.refresh != 0:
+                return
+            self.inputs[:,:,:Nin] = self.clean_inputs
+        self.add_noise(self.rng, self.inputs)
+
+    def get_templates(self, callback_results):
+        """
+        Return the stored trials for the task's conditions, generating them first if
+        there are none or if `callback_results` has changed since.
+
+        """
+        with self.templates_lock:
+            if self.templates is None or self.templates[0] is not callback_results:
+                self.templates = (callback_results,
+                                  self.generate_templates(callback_results))
+
+            return self.templates[1]
+
+    def generate_templates(self, callback_results):
+        """
+        Generate one noiseless trial for each of the task's conditions.
+
+        Returns
+        -------
+
+        templates : dict
+                    `trials`, and `inputs`, `outputs`, and `mask` padded to the longest
+                    trial, with conditions along the second dimension.
+
+        """
+        Nin, N, Nout = self.network_shape
+
+        params = {
+            'callback_results': callback_results,
+            'target_output':    True,
+            'name':             self.name
+            }
+
+        # The trials are determined by their conditions, so any generator will do
+        rng = np.random.RandomState(0)
+
+        trials = [self.task.generate_trial(rng, self.dt, dict(params, condition=c))
+                  for c in self.task.conditions]
+        lengths = [len(trial['t']) for trial in trials]
+
+        T = np.max(lengths)
+        C = len(trials)
+        X = np.zeros((T, C, Nin),  dtype=self.floatX)
+        Y = np.zeros((T, C, Nout), dtype=self.floatX)
+        M = np.zeros((T, C, Nout), dtype=self.floatX)
+        for c, trial in enumerate(trials):
+            Nt = lengths[c]
+            if Nin > 0:
+                X[:Nt,c] = trial['inputs']
+            Y[:Nt,c] = trial['outputs']
+            if 'mask' in trial:
+                M[:Nt,c] = trial['mask']
+            else:
+                M[:Nt,c] = 1
+
+        return {'trials': trials, 'inputs': X, 'outputs': Y, 'mask': M}
+
+    def generate(self, rng, best_costs, callback_results, noise=True):
+        """
+        Generate `batch_size` trials using `rng`. If the task declares its conditions
+        (see `pycog.tasktools`), the trials are gathered from stored templates and
+        only the noise is new. Otherwise the task's `generate_batch` is used if it has
+        one, and `generate_trial` if not.
+
+        If `noise` is `False`, the inputs contain neither noise nor baseline (see
+        `Dataset.add_noise`).
+
+        Returns
+        -------
+
+        trials : list of dicts
+
+        inputs, targets : numpy.ndarray
+                          In the format described in `Dataset.update`.
+
+        """
+        Nin, N, Nout = self.network_shape
+        B = self.batch_size
+
+        params = {
+            'callback_results': callback_results,
+            'target_output':    True,
+            'best_costs':       best_costs,
+            'name':             self.name
+            }
+
+        # Generate all trials at once if the task supports it
+        generate_batch = getattr(self.task, 'generate_batch', None)
+        if self.use_templates:
+            batch  = self.get_templates(callback_results)
+            index  = np.asarray(self.task.sample_conditions(rng, params, B))
+            trials = [batch['trials'][c] for c in index]
+        elif generate_batch is not None:
+            batch  = generate_batch(rng, self.dt, params, B)
+            index  = np.arange(B)
+            trials = batch['trials']
+        else:
+            batch  = None
+            trials = []
+            for b in xrange(B):
+                params_b = dict(params, minibatch_index=b)
+                trials.append(self.task.generate_trial(rng, self.dt, params_b))
+        lengths = np.array([len(trial['t']) for trial in trials])
+
+        # Group trials by duration into minibatches, then shuffle the minibatches
+        order = np.arange(B)
+        if self.bucket:
+            order = np.argsort(lengths, kind='mergesort')
+            size  = self.minibatch_size
+            nmb   = B//size
+            order = np.concatenate([order[k*size:(k+1)*size]
+                                    for k in rng.permutation(nmb)] + [order[nmb*size:]])
+            trials  = [trials[i] for i in order]
+            lengths = lengths[order]
+
+        # Input and output matrices
+        T = np.max(lengths)
+        if self.graph_noise:
+            x = np.zeros((T, B, Nin),   dtype=self.floatX)
+        else:
+            x = np.zeros((T, B, Nin+N), dtype=self.floatX)
+        y = np.zeros((T, B, 2*Nout), dtype=self.floatX)
+
+        # Pad trials
+        if batch is not None:
+            index = index[order]
+            if Nin > 0:
+                x[:,:,:Nin] = batch['inputs'][:T,index]
+            y[:,:,:Nout] = batch['outputs'][:T,index]
+            if 'mask' in batch:
+                y[:,:,Nout:] = batch['mask'][:T,index]
+            else:
+                y[:,:,Nout:] = (np.arange(T)[:,np.newaxis] < lengths)[:,:,np.newaxis]
+        else:
+            for b, trial in enumerate(trials):
+                Nt = lengths[b]
                 if Nin > 0:
                     x[:Nt,b,:Nin] = trial['inputs']
                 y[:Nt,b,:Nout] = trial['outputs']
@@ -178,35 +415,110 @@ class Dataset(object):
                 else:
                     y[:Nt,b,Nout:] = 1
 
-            # Input noise
-            if Nin > 0:
-                if np.isscalar(self.var_in) or self.var_in.ndim == 1:
-                    # Independent noise
-                    if np.any(self.var_in > 0):
-                        r = np.sqrt(self.var_in)*self.rng.normal(size=(T, B, Nin))
-                    else:
-                        r = 0
-                else:
-                    # Correlated noise
-                    r = self.rng.multivariate_normal(np.zeros(Nin), self.var_in, (T, B))
-                x[:,:,:Nin] += self.baseline_in + r
+        if noise:
+            self.add_noise(rng, x)
+
+        return trials, x, y
+
+    def add_noise(self, rng, x):
+        """
+        Add the baseline and noise to the inputs `x[:,:,:Nin]`, and store new recurrent
+        noise in `x[:,:,Nin:]`. If the noise is generated in the graph, only counts the
+        draw in `self.noise_draws`, which the graph uses to decide when to draw new
+        noise.
+
+        """
+        self.noise_draws += 1
+        if self.graph_noise:
+            return
 
-            # Recurrent noise
-            if np.isscalar(self.var_rec) or self.var_rec.ndim == 1:
+        Nin, N, Nout = self.network_shape
+        T, B, _      = x.shape
+
+        # Input noise
+        if Nin > 0:
+            if self.L_in is None:
                 # Independent noise
-                if np.any(self.var_rec > 0):
-                    r = np.sqrt(self.var_rec)*self.rng.normal(size=(T, B, N))
+                if np.any(self.var_in > 0):
+                    r = np.sqrt(self.var_in)*rng.normal(size=(T, B, Nin))
                 else:
                     r = 0
             else:
                 # Correlated noise
-                r = self.rng.multivariate_normal(np.zeros(N), self.var_rec, (T, B))
-            x[:,:,Nin:] = np.sqrt(self.tau)*r
+                r = rng.standard_normal(size=(T, B, Nin)).dot(self.L_in.T)
+            x[:,:,:Nin] += self.baseline_in + r
+
+        # Recurrent noise
+        if self.L_rec is None:
+            # Independent noise
+            if np.any(self.var_rec > 0):
+                r = np.sqrt(self.var_rec)*rng.normal(size=(T, B, N))
+            else:
+                r = 0
+        else:
+            # Correlated noise
+            r = rng.standard_normal(size=(T, B, N)).dot(self.L_rec.T)
+        x[:,:,Nin:] = np.sqrt(self.tau)*r
+
+        # Keep inputs positive
+        if self.rectify_inputs:
+            x[:,:,:Nin] = Dataset.rectify(x[:,:,:Nin])
 
-            # Keep inputs positive
-            if self.rectify_inputs:
-                x[:,:,:Nin] = Dataset.rectify(x[:,:,:Nin])
+    #/////////////////////////////////////////////////////////////////////////////////////
+
+    @staticmethod
+    def same_state(s1, s2):
+        """
+        Check whether two random number generator states are the same.
+
+        """
+        return np.array_equal(s1[1], s2[1]) and s1[2:] == s2[2:]
 
-            # Save
-            self.inputs  = x
-            self.targets = y
+    def start_prefetch(self, best_costs, callback_results):
+        """
+        Start generating the next block of trials in a background thread, using a
+        copy of `self.rng` so that the state of `self.rng` always corresponds to the
+        trials that have been handed out. An exception raised while generating the
+        trials is raised again by `Dataset.fetch`.
+
+        """
+        rng = np.random.RandomState()
+        rng.set_state(self.rng.get_state())
+
+        result = {}
+        def worker():
+            try:
+                result['block'] = self.generate(rng, best_costs, callback_results)
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+        self.next_block = (thread, result, rng, (best_costs, callback_results),
+                           self.rng.get_state())
+
+    def fetch(self, best_costs, callback_results):
+        """
+        Return the next block of trials.
+
+        A prefetched block is only used if it was generated from the current state of
+        `self.rng` with the same arguments; otherwise it is discarded and the block is
+        generated again. Either way the result is the same as without prefetching.
+
+        """
+        if self.next_block is not None:
+            thread, result, rng, args, state = self.next_block
+            self.next_block = None
+
+            thread.join()
+            if 'error' in result:
+                raise result['error']
+            if ('block' in result
+                and args[0] is best_costs and args[1] is callback_results
+                and Dataset.same_state(state, self.rng.get_state())):
+                self.rng.set_state(rng.get_state())
+                return result['block']
+
+        return self.generate(self.rng, best_costs, callback_results)
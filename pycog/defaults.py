@@ -25,10 +25,23 @@ defaults = {
     'hidden_activation':     'rectify',
     'output_activation':     'linear',
     'n_gradient':            20,
+    'bptt_window':           None,
+    'scan_checkpoint':       None,
     'n_validation':          1000,
     'gradient_batch_size':   None,
     'validation_batch_size': None,
+    'backend':               'theano',
+    'prefetch':              False,
+    'bucket':                False,
+    'graph_noise':           False,
+    'fixed_validation':      False,
+    'validation_refresh':    None,
+    'async_validation':      False,
+    'timing_log':            False,
     'lambda_Omega':          2,
+    'Omega_every':           1,
+    'Omega_anneal':          None,
+    'Omega_subsample':       None,
     'lambda1_in':            0,
     'lambda1_rec':           0,
     'lambda1_out':           0,
@@ -51,6 +64,8 @@ defaults = {
     'validation_seed':       22,
     'structure':             {},
     'rho0':                  1.5,
+    'rho_tol':               1e-6,
+    'rho_min_N':             1000,
     'max_iter':              int(1e7),
     'dt':                    None,
     'distribution_in':       None,
@@ -59,8 +74,12 @@ defaults = {
     'gamma_k':               2,
     'checkfreq':             None,
     'patience':              None,
-    'momentum':              False, # Not used currently
-    'method':                'sgd'  # Not used currently
+    'method':                'sgd',
+    'momentum':              False,
+    'decay':                 0.9,
+    'beta1':                 0.9,
+    'beta2':                 0.999,
+    'epsilon':               1e-8
     }
 
 def generate_trial(rng, dt, params):
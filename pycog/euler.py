@@ -1,24 +1,75 @@
+"""
+Euler integration of the network equations.
+
+The external drive `I` (inputs, recurrent bias, and recurrent noise) is known before
+integration starts and is computed for all time points at once, so the time loop
+only carries the recurrent term.
+
+All integrators reuse preallocated work buffers and copy the firing rates into the
+recording array `r` every `step` time steps, so no arrays are allocated inside the
+time loop. `r[0]` must contain the initial firing rates, `r` must have room for
+`(len(I) - 1)//step + 1` time points, and `f_hidden(x, out)` must be one of the
+in-place activation functions in `pycog.rnn.activation_functions_inplace`.
+
+The `_sparse` variants take `Wrec` as a SciPy sparse matrix. Sparse products cannot
+write into a preallocated buffer, so these allocate the recurrent input at each step.
+
+"""
 from __future__ import division
 
 import numpy as np
 
-def euler(alpha, x_t, r_t, Win, Wrec, brec, bout, u, noise_rec, f_hidden, r):
-    for i in xrange(1, r.shape[0]):
-        x_t += alpha*(-x_t            # Leak
-                      + Wrec.dot(r_t) # Recurrent input
-                      + brec          # Bias
-                      + Win.dot(u[i]) # Input
-                      + noise_rec[i]) # Recurrent noise
-        r_t = f_hidden(x_t)
-
-        r[i] = r_t
-
-def euler_no_Win(alpha, x_t, r_t, Wrec, brec, bout, noise_rec, f_hidden, r):
-    for i in xrange(1, r.shape[0]):
-        x_t += alpha*(-x_t            # Leak
-                      + Wrec.dot(r_t) # Recurrent input
-                      + brec          # Bias
-                      + noise_rec[i]) # Recurrent noise
-        r_t = f_hidden(x_t)
-
-        r[i] = r_t
+def euler(alpha, x_t, Wrec, I, f_hidden, r, step=1):
+    r_t = r[0].copy()
+    dx  = np.empty_like(x_t)
+    for i in xrange(1, I.shape[0]):
+        np.dot(Wrec, r_t, out=dx) # Recurrent input
+        dx -= x_t                 # Leak
+        dx += I[i]                # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
+
+def euler_batch(alpha, x_t, Wrec, I, f_hidden, r, step=1):
+    WrecT = Wrec.T
+    r_t   = r[0].copy()
+    dx    = np.empty_like(x_t)
+    for i in xrange(1, I.shape[0]):
+        np.dot(r_t, WrecT, out=dx) # Recurrent input
+        dx -= x_t                  # Leak
+        dx += I[i]                 # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
+
+def euler_sparse(alpha, x_t, Wrec, I, f_hidden, r, step=1):
+    r_t = r[0].copy()
+    for i in xrange(1, I.shape[0]):
+        dx  = Wrec.dot(r_t) # Recurrent input
+        dx -= x_t           # Leak
+        dx += I[i]          # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
+
+def euler_batch_sparse(alpha, x_t, Wrec, I, f_hidden, r, step=1):
+    r_t = r[0].copy()
+    for i in xrange(1, I.shape[0]):
+        dx  = Wrec.dot(r_t.T).T # Recurrent input
+        dx -= x_t               # Leak
+        dx += I[i]              # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
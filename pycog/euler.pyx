@@ -11,45 +11,95 @@ cimport cython
 @cython.wraparound(False)
 def euler(np.ndarray[np.float32_t, ndim=1] alpha,
           np.ndarray[np.float32_t, ndim=1] x_t,
-          np.ndarray[np.float32_t, ndim=1] r_t,
-          np.ndarray[np.float32_t, ndim=2] Win,
           np.ndarray[np.float32_t, ndim=2] Wrec,
-          np.ndarray[np.float32_t, ndim=1] brec,
-          np.ndarray[np.float32_t, ndim=1] bout,
-          np.ndarray[np.float32_t, ndim=2] u,
-          np.ndarray[np.float32_t, ndim=2] noise_rec,
+          np.ndarray[np.float32_t, ndim=2] I,
           f_hidden,
-          np.ndarray[np.float32_t, ndim=2] r):
+          np.ndarray[np.float32_t, ndim=2] r,
+          Py_ssize_t step=1):
     cdef Py_ssize_t i
-    for i in xrange(1, r.shape[0]):
-        x_t += alpha*(-x_t            # Leak
-                      + Wrec.dot(r_t) # Recurrent input
-                      + brec          # Bias
-                      + Win.dot(u[i]) # Input
-                      + noise_rec[i]) # Recurrent noise
-        r_t = f_hidden(x_t)
+    cdef np.ndarray[np.float32_t, ndim=1] r_t = r[0].copy()
+    cdef np.ndarray[np.float32_t, ndim=1] dx  = np.empty_like(x_t)
+    for i in xrange(1, I.shape[0]):
+        np.dot(Wrec, r_t, out=dx) # Recurrent input
+        dx -= x_t                 # Leak
+        dx += I[i]                # External drive
+        dx *= alpha
+        x_t += dx
 
-        r[i] = r_t
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
 
 @cython.boundscheck(False)
 @cython.cdivision(True)
 @cython.nonecheck(False)
 @cython.wraparound(False)
-def euler_no_Win(np.ndarray[np.float32_t, ndim=1] alpha,
+def euler_batch(np.ndarray[np.float32_t, ndim=1] alpha,
+                np.ndarray[np.float32_t, ndim=2] x_t,
+                np.ndarray[np.float32_t, ndim=2] Wrec,
+                np.ndarray[np.float32_t, ndim=3] I,
+                f_hidden,
+                np.ndarray[np.float32_t, ndim=3] r,
+                Py_ssize_t step=1):
+    cdef Py_ssize_t i
+    cdef np.ndarray[np.float32_t, ndim=2] r_t = r[0].copy()
+    cdef np.ndarray[np.float32_t, ndim=2] dx  = np.empty_like(x_t)
+    WrecT = Wrec.T
+    for i in xrange(1, I.shape[0]):
+        np.dot(r_t, WrecT, out=dx) # Recurrent input
+        dx -= x_t                  # Leak
+        dx += I[i]                 # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
+
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.nonecheck(False)
+@cython.wraparound(False)
+def euler_sparse(np.ndarray[np.float32_t, ndim=1] alpha,
                  np.ndarray[np.float32_t, ndim=1] x_t,
-                 np.ndarray[np.float32_t, ndim=1] r_t,
-                 np.ndarray[np.float32_t, ndim=2] Wrec,
-                 np.ndarray[np.float32_t, ndim=1] brec,
-                 np.ndarray[np.float32_t, ndim=1] bout,
-                 np.ndarray[np.float32_t, ndim=2] noise_rec,
+                 Wrec,
+                 np.ndarray[np.float32_t, ndim=2] I,
                  f_hidden,
-                 np.ndarray[np.float32_t, ndim=2] r):
+                 np.ndarray[np.float32_t, ndim=2] r,
+                 Py_ssize_t step=1):
     cdef Py_ssize_t i
-    for i in xrange(1, r.shape[0]):
-        x_t += alpha*(-x_t            # Leak
-                      + Wrec.dot(r_t) # Recurrent input
-                      + brec          # Bias
-                      + noise_rec[i]) # Recurrent noise
-        r_t = f_hidden(x_t)
-
-        r[i] = r_t
+    cdef np.ndarray[np.float32_t, ndim=1] r_t = r[0].copy()
+    for i in xrange(1, I.shape[0]):
+        dx  = Wrec.dot(r_t) # Recurrent input
+        dx -= x_t           # Leak
+        dx += I[i]          # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
+
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.nonecheck(False)
+@cython.wraparound(False)
+def euler_batch_sparse(np.ndarray[np.float32_t, ndim=1] alpha,
+                       np.ndarray[np.float32_t, ndim=2] x_t,
+                       Wrec,
+                       np.ndarray[np.float32_t, ndim=3] I,
+                       f_hidden,
+                       np.ndarray[np.float32_t, ndim=3] r,
+                       Py_ssize_t step=1):
+    cdef Py_ssize_t i
+    cdef np.ndarray[np.float32_t, ndim=2] r_t = r[0].copy()
+    for i in xrange(1, I.shape[0]):
+        dx  = Wrec.dot(r_t.T).T # Recurrent input
+        dx -= x_t               # Leak
+        dx += I[i]              # External drive
+        dx *= alpha
+        x_t += dx
+
+        f_hidden(x_t, r_t)
+        if i % step == 0:
+            r[i//step] = r_t
@@ -12,6 +12,7 @@ import sys
 import numpy as np
 
 from .defaults import defaults, generate_trial
+from .utils    import graph_key
 
 THIS = 'pycog.model'
 
@@ -108,16 +109,23 @@ class Model(object):
         savefile : str
         seed : int, optional
         compiledir : str, optional
+                     Directory for Theano's compiled code. Runs of the same network
+                     share a subdirectory named after a hash of the parameters that
+                     determine the graph (see `pycog.utils.graph_key`), so that, e.g.,
+                     runs with different seeds only compile once.
         recover : bool, optional
         gpus : int, optional
 
         """
-        
-        
+        # Parameters that determine the compiled code
+        graph = {k: getattr(self.m, k, v) for k, v in defaults.items()}
+
         # Theano setup
         os.environ.setdefault('THEANO_FLAGS', '')
         if compiledir is not None:
-            os.environ['THEANO_FLAGS'] += ',base_compiledir=' + compiledir
+            key = graph_key(graph, 'gpu' if gpus > 0 else 'cpu')
+            os.environ['THEANO_FLAGS'] += (',base_compiledir='
+                                           + os.path.join(compiledir, key))
         os.environ['THEANO_FLAGS'] += ',floatX=float32,allow_gc=False'
         if gpus > 0:
             os.environ['THEANO_FLAGS'] += ',device=gpu,nvcc.fastmath=True'
@@ -129,7 +137,10 @@ class Model(object):
         try:
             task = self.m.task
         except AttributeError:
-            task = Struct(generate_trial=self.m.generate_trial)
+            task = Struct(**{k: getattr(self.m, k)
+                             for k in ['generate_trial', 'generate_batch',
+                                       'conditions', 'sample_conditions']
+                             if hasattr(self.m, k)})
 
         # Parameters
         params = {}
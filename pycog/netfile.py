@@ -0,0 +1,193 @@
+"""
+Binary network files.
+
+A network file holds what is needed to run a trained network: the parameters, the
+list of trained variables, and the best weights. The weights are stored as raw arrays
+that can be memory-mapped, so loading a network does not read or copy the whole file.
+The training histories are kept in the history log next to the file (see
+`pycog.utils.append_history`) and only read on request. The training state (current
+weights, random number generators) stays in the pickled savefile, which is still
+needed to continue training. Files are replaced atomically.
+
+Layout, with all offsets in bytes:
+
+  MAGIC                      8 bytes
+  version, header size       little-endian uint32, uint64
+  header                     pickled dict
+  best weights               raw arrays, each starting on an ALIGN-byte boundary
+
+The weights start at the first ALIGN-byte boundary after the header, and the offsets
+in the header are relative to this point. In version 1 files the pickled
+`(costs_history, Omega_history)` follow the weights.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import cPickle as pickle
+import os
+import struct
+
+import numpy as np
+
+from .utils import load_history as load_history_log, open_atomic
+
+MAGIC   = b'PYCOGNET'
+VERSION = 2
+ALIGN   = 64
+PREFIX  = struct.Struct('<IQ')
+EXT     = '.net'
+
+THIS = 'pycog.netfile'
+
+def get_filename(savefile):
+    """
+    Name of the network file that goes with the pickled savefile `savefile`.
+
+    """
+    base, ext = os.path.splitext(savefile)
+    if ext == EXT:
+        return savefile
+    return base + EXT
+
+def is_current(savefile):
+    """
+    Whether the network file for `savefile` exists and is at least as recent as
+    `savefile`, if the latter exists.
+
+    """
+    filename = get_filename(savefile)
+    if not os.path.isfile(filename):
+        return False
+    if filename == savefile or not os.path.isfile(savefile):
+        return True
+
+    return os.path.getmtime(filename) >= os.path.getmtime(savefile)
+
+def align(n):
+    return -(-n//ALIGN)*ALIGN
+
+#=========================================================================================
+# Write
+#=========================================================================================
+
+def dump(filename, save):
+    """
+    Write the network in `save`, a dictionary in the format of the pickled savefile,
+    to `filename`.
+
+    """
+    best = save['best']
+
+    # Weights
+    arrays = []
+    blocks = []
+    offset = 0
+    for W in best['params']:
+        if W is None:
+            arrays.append(None)
+            continue
+
+        W = np.ascontiguousarray(W)
+        arrays.append((W.dtype.str, W.shape, offset))
+        blocks.append((offset, W))
+        offset = align(offset + W.nbytes)
+
+    header = pickle.dumps({
+        'params':  save['params'],
+        'varlist': save['varlist'],
+        'best':    {k: v for k, v in best.items() if k != 'params'},
+        'arrays':  arrays,
+        'history': (save['history_file'], save['history_size'])
+        }, pickle.HIGHEST_PROTOCOL)
+    start = align(len(MAGIC) + PREFIX.size + len(header))
+
+    with open_atomic(filename) as f:
+        f.write(MAGIC)
+        f.write(PREFIX.pack(VERSION, len(header)))
+        f.write(header)
+        for offset, W in blocks:
+            f.seek(start + offset)
+            f.write(W.tobytes())
+
+#=========================================================================================
+# Read
+#=========================================================================================
+
+def load_header(filename):
+    """
+    Return the header of a network file, its version, and the offset of its data.
+
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("[ {}.load ] {} is not a network file.".format(THIS, filename))
+
+        version, size = PREFIX.unpack(f.read(PREFIX.size))
+        if version > VERSION:
+            raise IOError("[ {}.load ] {} has version {}, but only versions up to {}"
+                          " are supported.".format(THIS, filename, version, VERSION))
+        header = pickle.loads(f.read(size))
+
+    return header, version, align(len(MAGIC) + PREFIX.size + size)
+
+def load(filename):
+    """
+    Load a network file, memory-mapping the best weights.
+
+    The weights are mapped copy-on-write, so they can be modified in memory without
+    changing the file.
+
+    Returns
+    -------
+
+    save : dict
+           Contains `params`, `varlist`, and `best`, as in the pickled savefile.
+
+    """
+    header, version, start = load_header(filename)
+
+    params = []
+    for array in header['arrays']:
+        if array is None:
+            params.append(None)
+            continue
+
+        dtype, shape, offset = array
+        if np.prod(shape) == 0:
+            params.append(np.zeros(shape, dtype=dtype))
+        else:
+            params.append(np.memmap(filename, dtype=dtype, mode='c',
+                                    offset=start+offset, shape=shape))
+
+    best = header['best'].copy()
+    best['params'] = params
+
+    return {
+        'params':  header['params'],
+        'varlist': header['varlist'],
+        'best':    best
+        }
+
+def load_history(filename):
+    """
+    Read the training histories recorded up to the time a network file was written.
+
+    Returns
+    -------
+
+    (costs_history, Omega_history)
+
+    """
+    header, version, start = load_header(filename)
+    if version == 1:
+        offset, size = header['history']
+        with open(filename, 'rb') as f:
+            f.seek(start + offset)
+            return pickle.loads(f.read(size))
+
+    history_file, size = header['history']
+    history_file = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                                history_file)
+
+    return load_history_log(history_file, size)
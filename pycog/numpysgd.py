@@ -0,0 +1,714 @@
+"""
+Train a recurrent neural network with the same minibatch stochastic gradient descent
+as `pycog.sgd`, but with backpropagation through time written in NumPy instead of
+Theano.
+
+The network equations, loss, regularization terms, vanishing gradient regularizer,
+gradient clipping, and safeguard against numerical problems are those of the Theano
+backend, and so are the savefiles. Nothing needs to be compiled, so training starts
+immediately, but large networks train faster with Theano.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+
+from .sgd import SGD
+
+THIS = 'pycog.numpysgd'
+
+#=========================================================================================
+# Activation functions and their derivatives
+#=========================================================================================
+
+def rectify(x):
+    return x*(x > 0)
+
+def d_rectify(x):
+    return 1*(x > 0)
+
+def rectify_power(x, n=2):
+    return x**n*(x > 0)
+
+def d_rectify_power(x, n=2):
+    return n*x**(n-1)*(x > 0)
+
+def sigmoid(x):
+    return 1/(1 + np.exp(-x))
+
+def d_sigmoid(x):
+    return sigmoid(x)*(1 - sigmoid(x))
+
+def d_tanh(x):
+    return 1 - np.tanh(x)**2
+
+def rtanh(x):
+    return rectify(np.tanh(x))
+
+def d_rtanh(x):
+    return d_tanh(x)*(x > 0)
+
+def softplus(x):
+    return np.log(1 + np.exp(x))
+
+def softmax(x):
+    """
+    Softmax over the last dimension of `x`.
+
+    """
+    e = np.exp(x)
+    return e/np.sum(e, axis=-1, keepdims=True)
+
+hidden_activations = {
+    'linear':        (lambda x: x,   lambda x: np.ones_like(x)),
+    'rectify':       (rectify,       d_rectify),
+    'rectify_power': (rectify_power, d_rectify_power),
+    'sigmoid':       (sigmoid,       d_sigmoid),
+    'tanh':          (np.tanh,       d_tanh),
+    'rtanh':         (rtanh,         d_rtanh),
+    'softplus':      (softplus,      sigmoid)
+    }
+
+def backprop_output(act, a, z, dz):
+    """
+    Backpropagate `dz` through the output activation function `act`, where
+    `z = f(a)`.
+
+    """
+    if act == 'linear':
+        return dz
+    if act == 'rectify':
+        return dz*(a > 0)
+    if act == 'rectify_power':
+        return dz*d_rectify_power(a)
+    if act == 'sigmoid':
+        return dz*z*(1 - z)
+    if act == 'softmax':
+        return z*(dz - np.sum(dz*z, axis=-1, keepdims=True))
+    raise ValueError("[ {}.backprop_output ] Unknown output activation {}."
+                     .format(THIS, act))
+
+output_activations = {
+    'linear':        (lambda x: x),
+    'rectify':       rectify,
+    'rectify_power': rectify_power,
+    'sigmoid':       sigmoid,
+    'softmax':       softmax
+    }
+
+#=========================================================================================
+# Loss functions and their derivatives
+#=========================================================================================
+
+epsilon = 1e-10
+
+def binary_crossentropy(y, t):
+    return -t*np.log(y + epsilon) - (1-t)*np.log((1-y) + epsilon)
+
+def d_binary_crossentropy(y, t):
+    return -t/(y + epsilon) + (1-t)/((1-y) + epsilon)
+
+def categorical_crossentropy(y, t):
+    return -t*np.log(y + epsilon)
+
+def d_categorical_crossentropy(y, t):
+    return -t/(y + epsilon)
+
+def L2(y, t):
+    return (y - t)**2
+
+def d_L2(y, t):
+    return 2*(y - t)
+
+#=========================================================================================
+# Stand-ins for Theano variables
+#=========================================================================================
+
+class Variable(object):
+    """
+    Array with the interface of a Theano shared variable used by `pycog.SGD`.
+
+    Updates replace the array instead of modifying it, so arrays returned with
+    `borrow=True` keep their values.
+
+    """
+    def __init__(self, value, name=None):
+        self.value = value
+        self.name  = name
+
+    def get_value(self, borrow=False):
+        if borrow:
+            return self.value
+        return self.value.copy()
+
+    def set_value(self, value):
+        self.value = np.asarray(value, dtype=self.value.dtype)
+
+    def eval(self):
+        return self.value
+
+class Expression(object):
+    """
+    Value computed from variables, with the interface of a Theano expression.
+
+    """
+    def __init__(self, f):
+        self.f = f
+
+    def eval(self):
+        return self.f()
+
+#=========================================================================================
+# Training
+#=========================================================================================
+
+class NumpySGD(SGD):
+    """
+    Stochastic gradient descent training for RNNs, with gradients computed by
+    backpropagation through time in NumPy.
+
+    """
+    @staticmethod
+    def build(params, init, settings, floatX):
+        """
+        Check the parameters and record the settings of the network.
+
+        Parameters
+        ----------
+
+        params : dict
+                 Training parameters, see `pycog.Trainer`.
+
+        init : list
+               Initial values of `Win`, `Wrec`, `Wout`, `brec`, `bout`, and `x0`.
+
+        settings : OrderedDict
+                   Settings to report.
+
+        floatX : str
+                 Floating-point type.
+
+        Returns
+        -------
+
+        make_sgd : function
+                   Returns the `NumpySGD` instance.
+
+        """
+        p = params
+
+        if p['graph_noise']:
+            print("[ {}.NumpySGD ] There is no graph to generate noise in,"
+                  " noise will be generated in the datasets.".format(THIS))
+            p['graph_noise'] = False
+
+        if p['scan_checkpoint'] is not None:
+            print("[ {}.NumpySGD ] Backpropagation through time in NumPy stores all"
+                  " states, ignoring scan_checkpoint.".format(THIS))
+
+        # Parameters to train
+        for k, name in [('train_brec', 'train recurrent bias'),
+                        ('train_bout', 'train output bias')]:
+            settings[name] = 'yes' if p[k] else 'no'
+
+        # In continuous mode it doesn't make sense to train x0, which is forgotten
+        if p['mode'] == 'continuous':
+            p['train_x0'] = False
+        settings['train initial conditions'] = 'yes' if p['train_x0'] else 'no'
+
+        # Sparseness
+        for k, name in [('Cin', 'Win'), ('Crec', 'Wrec'), ('Cout', 'Wout')]:
+            C = p[k]
+            if C is not None and (k != 'Cin' or p['Nin'] > 0):
+                settings['sparseness ({})'.format(name)] = (
+                    'p = {:.2f}, p_plastic = {:.2f}'.format(C.p, C.p_plastic)
+                    )
+
+        # Dale's law
+        if p['ei'] is not None:
+            if p['ei_positive_func'] == 'abs':
+                settings['E/I positivity function'] = 'absolute value'
+            elif p['ei_positive_func'] == 'rectify':
+                settings['E/I positivity function'] = 'rectify'
+            else:
+                raise ValueError("Unknown ei_positive_func.")
+
+        # Activation functions
+        settings['hidden activation'] = p['hidden_activation']
+        act = p['output_activation']
+        if act == 'sigmoid':
+            settings['output activation/loss'] = 'sigmoid/binary cross entropy'
+        elif act == 'softmax':
+            settings['output activation/loss'] = 'softmax/categorical cross entropy'
+        else:
+            settings['output activation/loss'] = act + '/squared'
+
+        # Running mode
+        if p['mode'] == 'continuous':
+            settings['mode'] = 'continuous'
+
+            if p['n_gradient'] != 1 and p['bptt_window'] is None:
+                print("[ Trainer.train ] In continuous mode,"
+                      " so we're setting n_gradient to 1.")
+                p['n_gradient'] = 1
+        else:
+            settings['mode'] = 'batch'
+
+        if p['bptt_window'] is not None:
+            settings['truncated BPTT'] = '{} steps'.format(p['bptt_window'])
+
+        # Regularization terms
+        for k, name in [('lambda1_in',  'L1 weight regularization (Win)'),
+                        ('lambda1_rec', 'L1 weight regularization (Wrec)'),
+                        ('lambda1_out', 'L1 weight regularization (Wout)'),
+                        ('lambda2_in',  'L2 weight regularization (Win)'),
+                        ('lambda2_rec', 'L2 weight regularization (Wrec)'),
+                        ('lambda2_out', 'L2 weight regularization (Wout)'),
+                        ('lambda2_r',   'L2 rate regularization')]:
+            if p[k] > 0 and (not k.endswith('_in') or p['Nin'] > 0):
+                settings[name] = '{} = {}'.format(k, p[k])
+
+        return lambda: NumpySGD(p, init, floatX)
+
+    def __init__(self, params, init, floatX):
+        """
+        Set up the network.
+
+        Parameters
+        ----------
+
+        params : dict
+                 Training parameters, see `pycog.Trainer`.
+
+        init : list
+               Initial values of `Win`, `Wrec`, `Wout`, `brec`, `bout`, and `x0`.
+
+        floatX : str
+                 Floating-point type.
+
+        """
+        self.p      = params
+        self.floatX = floatX
+
+        # Starting vector for estimating the spectral radius
+        self.rho_v0 = None
+
+        # Noise is always generated in the datasets
+        self.srng            = None
+        self.srng_validation = None
+
+        #---------------------------------------------------------------------------------
+        # Variables
+        #---------------------------------------------------------------------------------
+
+        names = ['Win', 'Wrec', 'Wout', 'brec', 'bout', 'x0']
+        self.vars = {name: Variable(np.asarray(value, dtype=floatX), name=name)
+                     for name, value in zip(names, init) if value is not None}
+
+        trained = ['Win', 'Wrec', 'Wout']
+        if self.p['train_brec']:
+            trained += ['brec']
+        if self.p['train_bout']:
+            trained += ['bout']
+        if self.p['train_x0']:
+            trained += ['x0']
+        self.trainables      = [self.vars[name] for name in names
+                                if name in trained and name in self.vars]
+        self.trainable_names = [tr.name for tr in self.trainables]
+
+        # Optimizer state
+        self.optimizer_state = []
+        for name in SGD.get_state_names(self.p, self.trainable_names):
+            if name == 'adam_t':
+                value = np.zeros((), dtype=floatX)
+            else:
+                value = np.zeros_like(self.vars[name.rsplit('_', 1)[0]].value)
+            self.optimizer_state.append(Variable(value, name=name))
+
+        #---------------------------------------------------------------------------------
+        # Connectivity masks
+        #---------------------------------------------------------------------------------
+
+        self.masks = {}
+        for name, k in [('Win', 'Cin'), ('Wrec', 'Crec'), ('Wout', 'Cout')]:
+            C = self.p[k]
+            if C is not None and name in self.vars:
+                self.masks[name] = (np.asarray(C.mask_plastic, dtype=floatX),
+                                    np.asarray(C.mask_fixed,   dtype=floatX))
+
+        if self.p['ei'] is not None:
+            self.ei = np.asarray(self.p['ei'], dtype=floatX)
+        else:
+            self.ei = None
+
+        #---------------------------------------------------------------------------------
+        # Functions
+        #---------------------------------------------------------------------------------
+
+        self.f_hidden, self.d_f_hidden = hidden_activations[self.p['hidden_activation']]
+
+        act = self.p['output_activation']
+        self.f_output = output_activations[act]
+        if act == 'sigmoid':
+            self.f_loss, self.d_f_loss = binary_crossentropy, d_binary_crossentropy
+        elif act == 'softmax':
+            self.f_loss, self.d_f_loss = (categorical_crossentropy,
+                                          d_categorical_crossentropy)
+        else:
+            self.f_loss, self.d_f_loss = L2, d_L2
+
+        #---------------------------------------------------------------------------------
+        # Variables to save
+        #---------------------------------------------------------------------------------
+
+        if 'Win' in self.vars:
+            save_values = [Expression(lambda: self.get_weight('Win'))]
+        else:
+            save_values = [None]
+        save_values += [Expression(lambda: self.get_weight('Wrec')),
+                        Expression(lambda: self.get_weight('Wout'))]
+        save_values += [self.vars[name] for name in ['brec', 'bout', 'x0']]
+        self.save_values = save_values
+
+        # Actual recurrent weight
+        self.Wrec_ = save_values[1]
+
+    #/////////////////////////////////////////////////////////////////////////////////////
+
+    def uses_gpu(self):
+        return False
+
+    def make_positive(self, W):
+        if self.p['ei_positive_func'] == 'abs':
+            return abs(W)
+        return rectify(W)
+
+    def d_make_positive(self, W):
+        if self.p['ei_positive_func'] == 'abs':
+            return np.sign(W)
+        return d_rectify(W)
+
+    def get_weight(self, name):
+        """
+        Return the weight matrix `name` used in the network, after applying the
+        connectivity mask and Dale's law to the trained weights.
+
+        """
+        W = self.vars[name].value
+        if name in self.masks:
+            mask_plastic, mask_fixed = self.masks[name]
+            W = mask_plastic*W + mask_fixed
+        if self.ei is not None:
+            W = self.make_positive(W)
+            if name != 'Win':
+                W = W*self.ei
+
+        return W
+
+    def backprop_weight(self, name, g):
+        """
+        Convert the gradient `g` with respect to the weight matrix used in the network
+        to the gradient with respect to the trained weights.
+
+        """
+        W = self.vars[name].value
+        if name in self.masks:
+            mask_plastic, mask_fixed = self.masks[name]
+            W_ = mask_plastic*W + mask_fixed
+        else:
+            mask_plastic = None
+            W_ = W
+        if self.ei is not None:
+            if name != 'Win':
+                g = g*self.ei
+            g = g*self.d_make_positive(W_)
+        if mask_plastic is not None:
+            g = g*mask_plastic
+
+        return g
+
+    #/////////////////////////////////////////////////////////////////////////////////////
+
+    def forward(self, u, alpha, x_init=None, carry=0):
+        """
+        Run the network, starting from `x_init` if `carry` is 1 (see `pycog.Trainer`).
+
+        Returns
+        -------
+
+        u_in : numpy.ndarray
+               Inputs.
+
+        x, r : numpy.ndarray
+               States and firing rates, including the initial conditions.
+
+        a, z : numpy.ndarray
+               Outputs before and after the output activation function.
+
+        """
+        Nin = self.p['Nin']
+        N   = self.p['N']
+
+        Wrec_ = self.get_weight('Wrec')
+        Wout_ = self.get_weight('Wout')
+        brec  = self.vars['brec'].value
+        bout  = self.vars['bout'].value
+        x0    = self.vars['x0'].value
+
+        # External drive for all time points and trials
+        u_in = u[:,:,:Nin]
+        I    = brec + u[:,:,Nin:]
+        if Nin > 0:
+            I = I + u_in.dot(self.get_weight('Win').T)
+
+        Nt, B = u.shape[:2]
+        x = np.empty((Nt+1, B, N), dtype=self.floatX)
+        r = np.empty_like(x)
+        if x_init is not None and carry:
+            x[0] = x_init
+        else:
+            x[0] = x0
+        r[0] = self.f_hidden(x[0])
+
+        WrecT = Wrec_.T
+        for i in xrange(Nt):
+            x[i+1] = (1 - alpha)*x[i] + alpha*(r[i].dot(WrecT) + I[i])
+            r[i+1] = self.f_hidden(x[i+1])
+
+        a = r[1:].dot(Wout_.T) + bout
+        z = self.f_output(a)
+
+        return u_in, x, r, a, z
+
+    def backward(self, x, dr, alpha):
+        """
+        Backpropagate the derivatives `dr` of the cost with respect to the firing rates
+        through time.
+
+        Returns
+        -------
+
+        dx : numpy.ndarray
+             Derivatives of the cost with respect to the states, including the initial
+             conditions.
+
+        """
+        Wrec_ = self.get_weight('Wrec')
+
+        dx     = np.empty_like(x)
+        dx[-1] = dr[-1]*self.d_f_hidden(x[-1])
+        for i in xrange(len(x)-2, -1, -1):
+            dr_i = (alpha*dx[i+1]).dot(Wrec_)
+            if i > 0:
+                dr_i += dr[i-1]
+            dx[i] = dr_i*self.d_f_hidden(x[i]) + (1 - alpha)*dx[i+1]
+
+        return dx
+
+    def costs(self, u, target, alpha, x_init=None, carry=0):
+        """
+        Loss, regularization terms, and their derivatives with respect to the outputs
+        and firing rates.
+
+        """
+        p    = self.p
+        Nout = p['Nout']
+
+        u_in, x, r, a, z = self.forward(u, alpha, x_init, carry)
+        y        = target[:,:,:Nout]
+        mask     = target[:,:,Nout:]
+        masknorm = np.sum(mask)
+
+        loss  = np.sum(self.f_loss(z, y)*mask)/masknorm
+        error = np.sqrt(np.sum(L2(z, y)*mask)/masknorm)
+
+        # Regularization terms
+        regs = 0
+        for name, k1, k2 in [('Win',  'lambda1_in',  'lambda2_in'),
+                             ('Wrec', 'lambda1_rec', 'lambda2_rec'),
+                             ('Wout', 'lambda1_out', 'lambda2_out')]:
+            if name in self.vars:
+                W = self.vars[name].value
+                if p[k1] > 0:
+                    regs += p[k1]*np.mean(abs(W))
+                if p[k2] > 0:
+                    regs += p[k2]*np.mean(W**2)
+        if p['lambda2_r'] > 0:
+            regs += p['lambda2_r']*np.mean(r[1:]**2)
+
+        return u_in, x, r, a, z, loss, regs, error
+
+    #/////////////////////////////////////////////////////////////////////////////////////
+
+    def f_cost(self, u, target):
+        """
+        Same as `pycog.SGD.f_cost`.
+
+        """
+        alpha = self.p['dt']/self.p['tau']
+        u_in, x, r, a, z, loss, regs, error = self.costs(u, target, alpha)
+
+        return [loss + regs, error, z]
+
+    def f_state(self, u, x_init, carry):
+        """
+        Same as `pycog.SGD.f_state`.
+
+        """
+        alpha = self.p['dt']/self.p['tau']
+        u_in, x, r, a, z = self.forward(u, alpha, x_init, carry)
+
+        return x[-1]
+
+    def train_step(self, *args):
+        """
+        Same as `pycog.SGD.train_step`: one gradient descent step, returning the cost,
+        gradient norm, vanishing gradient regularizer, the fraction of time points it
+        was computed for, and the states.
+
+        """
+        return self.step(True, *args)
+
+    def train_step_plain(self, *args):
+        """
+        Same as `pycog.SGD.train_step_plain`, a training step without the vanishing
+        gradient regularizer.
+
+        """
+        return self.step(False, *args)
+
+    def step(self, use_Omega, u, target, alpha, lambda_Omega, lr, maxnorm, bound,
+             x_init=None, carry=0):
+        """
+        Training step, with or without the vanishing gradient regularizer.
+
+        """
+        p    = self.p
+        N    = p['N']
+        Nout = p['Nout']
+
+        u_in, x, r, a, z, loss, regs, error = self.costs(u, target, alpha, x_init,
+                                                         carry)
+        y        = target[:,:,:Nout]
+        mask     = target[:,:,Nout:]
+        masknorm = np.sum(mask)
+
+        #---------------------------------------------------------------------------------
+        # Backpropagation through time
+        #---------------------------------------------------------------------------------
+
+        # Loss
+        dz = self.d_f_loss(z, y)*mask/masknorm
+        da = backprop_output(p['output_activation'], a, z, dz)
+        dx = self.backward(x, da.dot(self.get_weight('Wout')), alpha)
+
+        # Gradient of the loss alone, for the vanishing gradient regularizer
+        dx_loss = dx
+
+        # L2 rate regularization
+        if p['lambda2_r'] > 0:
+            dr = 2*p['lambda2_r']*r[1:]/r[1:].size
+            dx = dx + self.backward(x, dr, alpha)
+
+        #---------------------------------------------------------------------------------
+        # Gradients
+        #---------------------------------------------------------------------------------
+
+        flat = lambda A: A.reshape((-1, A.shape[-1]))
+
+        g = {}
+        dI = alpha*dx[1:]
+        if 'Win' in self.vars:
+            g['Win'] = self.backprop_weight('Win', flat(dI).T.dot(flat(u_in)))
+        g['Wrec'] = self.backprop_weight('Wrec', flat(dI).T.dot(flat(r[:-1])))
+        g['Wout'] = self.backprop_weight('Wout', flat(da).T.dot(flat(r[1:])))
+        g['brec'] = np.sum(flat(dI), axis=0)
+        g['bout'] = np.sum(flat(da), axis=0)
+        g['x0']   = (1 - carry)*np.sum(dx[0], axis=0)
+
+        # Regularization terms
+        for name, k1, k2 in [('Win',  'lambda1_in',  'lambda2_in'),
+                             ('Wrec', 'lambda1_rec', 'lambda2_rec'),
+                             ('Wout', 'lambda1_out', 'lambda2_out')]:
+            if name in self.vars:
+                W = self.vars[name].value
+                if p[k1] > 0:
+                    g[name] = g[name] + p[k1]*np.sign(W)/W.size
+                if p[k2] > 0:
+                    g[name] = g[name] + 2*p[k2]*W/W.size
+
+        #---------------------------------------------------------------------------------
+        # Regularization for the vanishing gradient problem
+        #---------------------------------------------------------------------------------
+
+        if use_Omega:
+            Wrec_ = self.get_weight('Wrec')
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # As in the Theano backend, which takes the gradient with respect to
+                # the buffer of states in the scan: the firing rates are carried
+                # separately, so the gradient for x_t only has the leak part of
+                # dL/dx_{t+1}, and is zero for the last time point.
+                d  = np.concatenate(((1 - alpha)*dx_loss[2:],
+                                     np.zeros_like(dx_loss[:1])))
+                xt = x[1:]
+                if p['Omega_subsample'] is not None:
+                    d  = d [::p['Omega_subsample']]
+                    xt = xt[::p['Omega_subsample']]
+
+                fx  = self.d_f_hidden(xt)
+                ad  = alpha*d
+                num = (1 - alpha)*d + ad.dot(Wrec_)*fx
+
+                # Omega for each time point and trial, where only time points with large
+                # enough gradients count
+                denom = np.sum(d**2, axis=2)
+                valid = (denom >= bound)
+                ratio = np.where(valid, np.sum(num**2, axis=2)/denom, 1)
+
+                nelems = np.mean(valid, axis=1)
+                Omega  = np.sum(np.mean((ratio - 1)**2, axis=1))/np.sum(nelems)
+
+                # Immediate derivative with respect to the recurrent weights
+                B      = d.shape[1]
+                dratio = np.where(valid, 2*(ratio - 1)/denom, 0)/(B*np.sum(nelems))
+                dnum   = 2*dratio[:,:,np.newaxis]*num
+                g_Omega = self.backprop_weight('Wrec', flat(ad).T.dot(flat(dnum*fx)))
+            g['Wrec'] = g['Wrec'] + lambda_Omega*g_Omega
+        else:
+            Omega  = 0
+            nelems = np.zeros(1)
+
+        #---------------------------------------------------------------------------------
+        # Gradient clipping
+        #---------------------------------------------------------------------------------
+
+        g     = [g[name] for name in self.trainable_names]
+        gnorm = np.sqrt(sum([np.sum(i**2) for i in g]))
+        if gnorm > maxnorm:
+            g = [maxnorm*i/gnorm for i in g]
+
+        # Pascanu's safeguard for numerical precision issues with float32
+        new_cond = np.isnan(gnorm) or np.isinf(gnorm) or gnorm < 0 or gnorm > 1e10
+        if new_cond:
+            g = [np.float32(0.02)*theta.value if name == 'Wrec' else np.zeros_like(i)
+                 for name, theta, i in zip(self.trainable_names, self.trainables, g)]
+
+        #---------------------------------------------------------------------------------
+        # Training step
+        #---------------------------------------------------------------------------------
+
+        # The safeguard takes a plain gradient step and leaves the state unchanged
+        if new_cond or not self.optimizer_state:
+            steps = [-lr*i for i in g]
+        else:
+            state = {i.name: i.value for i in self.optimizer_state}
+            steps, new_state = SGD.optimizer_steps(p, self.trainable_names, g, lr,
+                                                   state, np.sqrt)
+            for i in self.optimizer_state:
+                i.value = np.asarray(new_state[i.name], dtype=self.floatX)
+
+        for theta, step in zip(self.trainables, steps):
+            theta.value = (theta.value + step).astype(self.floatX)
+
+        return [loss + regs, gnorm, Omega, np.mean(nelems), x[1:]]
@@ -7,15 +7,20 @@ from __future__ import division
 
 import cPickle as pickle
 import os
-import shutil
 import sys
-import time
 from   collections import OrderedDict
 
 import numpy as np
 
-from .utils import print_settings
-from .euler import euler, euler_no_Win
+try:
+    import scipy.sparse as sparse
+    from   scipy.sparse.linalg import ArpackError, ArpackNoConvergence, eigs
+except ImportError:
+    sparse = None
+
+from .       import netfile
+from .utils  import load_history, noise_factor, print_settings
+from .euler import euler, euler_batch, euler_sparse, euler_batch_sparse
 
 THIS = 'pycog.rnn'
 
@@ -56,6 +61,69 @@ activation_functions = {
     'softmax':       softmax
 }
 
+#-----------------------------------------------------------------------------------------
+# In-place versions for Euler integration: write f(x) into `out` without temporaries.
+#-----------------------------------------------------------------------------------------
+
+def linear_inplace(x, out):
+    if out is not x:
+        np.copyto(out, x)
+
+def rectify_inplace(x, out):
+    np.maximum(x, 0, out=out)
+
+def rectify_power_inplace(x, out, n=2):
+    np.maximum(x, 0, out=out)
+    np.power(out, n, out=out)
+
+def sigmoid_inplace(x, out):
+    np.negative(x, out=out)
+    np.exp(out, out=out)
+    out += 1
+    np.reciprocal(out, out=out)
+
+def tanh_inplace(x, out):
+    np.tanh(x, out=out)
+
+def rtanh_inplace(x, out):
+    np.maximum(x, 0, out=out)
+    np.tanh(out, out=out)
+
+def softmax_inplace(x, out):
+    """
+    Softmax over the last dimension of `x`.
+
+    """
+    np.exp(x, out=out)
+    out /= np.sum(out, axis=-1, keepdims=True)
+
+activation_functions_inplace = {
+    'linear':        linear_inplace,
+    'rectify':       rectify_inplace,
+    'rectify_power': rectify_power_inplace,
+    'sigmoid':       sigmoid_inplace,
+    'tanh':          tanh_inplace,
+    'rtanh':         rtanh_inplace,
+    'softmax':       softmax_inplace
+}
+
+#=========================================================================================
+
+def weight_property(name):
+    """
+    A weight matrix stored as an attribute of `RNN`, which discards the weights cached
+    by `RNN.get_weights` when it is assigned.
+
+    """
+    def fget(self):
+        return self.__dict__.get(name)
+
+    def fset(self, W):
+        self.__dict__[name]          = W
+        self.__dict__['sim_weights'] = None
+
+    return property(fget, fset)
+
 #=========================================================================================
 
 class RNN(object):
@@ -64,8 +132,10 @@ class RNN(object):
 
     """
     defaults = {
-        'threshold': 1e-4,
-        'sigma0':    0
+        'threshold':        1e-4,
+        'sigma0':           0,
+        'sparse_threshold': 0.2,
+        'sparse_min_N':     500
         }
     ou_defaults = {
         'N':                 100,
@@ -83,6 +153,11 @@ class RNN(object):
         }
     dtype = np.float32
 
+    # Weights, which discard the cached weights for simulation when assigned
+    Win  = weight_property('Win')
+    Wrec = weight_property('Wrec')
+    Wout = weight_property('Wout')
+
     #/////////////////////////////////////////////////////////////////////////////////////
 
     @staticmethod
@@ -99,12 +174,64 @@ class RNN(object):
         return p
 
     @staticmethod
-    def spectral_radius(A):
+    def spectral_radius(A, tol=1e-6, min_N=1000, v0=None):
         """
         Compute the spectral radius of a matrix.
 
+        See `RNN.dominant_eigenvector` for the parameters.
+
         """
-        return np.max(abs(np.linalg.eigvals(A)))
+        return RNN.dominant_eigenvector(A, tol, min_N, v0)[0]
+
+    @staticmethod
+    def dominant_eigenvector(A, tol=1e-6, min_N=1000, v0=None):
+        """
+        Compute the spectral radius of a dense or sparse matrix, and an eigenvector
+        for the largest eigenvalue that can be used as `v0` for a similar matrix.
+
+        Matrices with fewer than `min_N` rows are decomposed in full. Larger ones use
+        ARPACK's implicitly restarted Arnoldi method, which only needs matrix-vector
+        products, with relative tolerance `tol`. Several eigenvalues of largest
+        magnitude are computed with a generous Krylov subspace, since asking for only
+        one can converge to an eigenvalue close to, but smaller than, the largest when
+        the spectrum is crowded near its edge. Falls back to the full decomposition if
+        SciPy isn't available, ARPACK doesn't converge, or the residual of the
+        eigenpair is too large.
+
+        Returns
+        -------
+
+        rho : float
+              Spectral radius.
+
+        v : numpy.ndarray or None
+            Real starting vector for the next estimate, `None` for a full
+            decomposition.
+
+        """
+        n = A.shape[0]
+        if sparse is not None and n >= min_N:
+            if v0 is not None and (len(v0) != n or not np.any(v0)):
+                v0 = None
+            k   = min(6, n-2)
+            ncv = min(max(2*k+1, 40), n)
+            try:
+                w, v = eigs(A, k=k, ncv=ncv, which='LM', tol=tol, v0=v0)
+            except (ArpackError, ArpackNoConvergence):
+                pass
+            else:
+                i = np.argmax(abs(w))
+
+                # Check the residual ||Av - wv||
+                residual = np.linalg.norm(A.dot(v[:,i]) - w[i]*v[:,i])
+                if residual <= np.sqrt(tol)*abs(w[i])*np.linalg.norm(v[:,i]):
+                    # A real vector in the invariant subspace of a complex pair
+                    return abs(w[i]), v[:,i].real + v[:,i].imag
+
+        if sparse is not None and sparse.issparse(A):
+            A = A.toarray()
+
+        return np.max(abs(np.linalg.eigvals(A))), None
 
     @staticmethod
     def clip_weights(name, W, threshold):
@@ -114,6 +241,66 @@ class RNN(object):
         """
         W[np.where(abs(W) < threshold)] = 0
 
+    @staticmethod
+    def sparsify(W, threshold, min_N):
+        """
+        Convert `W` to compressed sparse row format if its density is below
+        `threshold` and its largest dimension is at least `min_N`. Sparse products
+        are slower per nonzero element than dense ones, so small or moderately
+        dense matrices are left alone.
+
+        Requires SciPy, otherwise `W` is always returned unchanged.
+
+        """
+        if W is None or sparse is None or max(W.shape) < min_N:
+            return W
+
+        density = np.count_nonzero(W)/W.size
+        if density >= threshold:
+            return W
+
+        return sparse.csr_matrix(W)
+
+    @staticmethod
+    def get_save_step(dt, dt_save):
+        """
+        Number of time steps between recorded time points.
+
+        """
+        if dt_save is None:
+            return 1
+        return max(int(round(dt_save/dt)), 1)
+
+    @staticmethod
+    def dot_transpose(X, W):
+        """
+        Compute X W^T for a dense or sparse matrix `W`, where the last dimension of
+        `X` is contracted.
+
+        """
+        if sparse is not None and sparse.issparse(W):
+            X2 = X.reshape((-1, X.shape[-1]))
+            return W.dot(X2.T).T.reshape(X.shape[:-1] + (W.shape[0],))
+        return X.dot(W.T)
+
+    def get_weights(self):
+        """
+        Weights to use for simulation, converted to sparse matrices if they are
+        sparse enough (see `RNN.sparsify`).
+
+        The conversion is done once and cached until `Win`, `Wrec`, or `Wout` is
+        assigned. Dense weights are used as they are, but sparse copies don't see
+        changes made in place after the first run, so assign the modified matrix,
+        e.g., `rnn.Wrec = W`, to update them.
+
+        """
+        key = (self.p['sparse_threshold'], self.p['sparse_min_N'])
+        if self.sim_weights is None or self.sim_weights[0] != key:
+            self.sim_weights = (key, [RNN.sparsify(W, *key)
+                                      for W in [self.Win, self.Wrec, self.Wout]])
+
+        return self.sim_weights[1]
+
     #/////////////////////////////////////////////////////////////////////////////////////
 
     def __init__(self, savefile=None, rnnparams={}, verbose=True):
@@ -125,6 +312,9 @@ class RNN(object):
 
         savefile:  str, optional
                    File name for trained network. If `None`, create a default network.
+                   If a current network file (see `pycog.netfile`) exists for the
+                   savefile, the weights are memory-mapped from it and the histories
+                   are only loaded when needed.
 
         rnnparams: dict, optional
                    These parameters will override those in savefile in `RNN.defaults`.
@@ -135,34 +325,38 @@ class RNN(object):
         """
         self.verbose = verbose
 
+        self.netfile = None
+        self.history = None
+
+        # Weights for simulation, see `RNN.get_weights`
+        self.sim_weights = None
+
         if savefile is not None:
-            # Check that file exists
-            if not os.path.isfile(savefile):
-                print("[ {}.RNN ] File {} doesn't exist.".format(THIS, savefile))
-                sys.exit(1)
-
-            # Ensure we have a readable file
-            base, ext = os.path.splitext(savefile)
-            savefile_copy = base + '_copy' + ext
-            while True:
-                shutil.copyfile(savefile, savefile_copy)
-                try:
-                    with file(savefile_copy, 'rb') as f:
-                        save = pickle.load(f)
-                    break
-                except EOFError:
-                    wait = 5
-                    print("[ {}.RNN ] Got an EOFError, trying again in {} seconds."
-                          .format(THIS, wait))
-                    time.sleep(wait)
+            if netfile.is_current(savefile):
+                # Memory-map the weights, load histories on demand
+                self.netfile = netfile.get_filename(savefile)
+                save = netfile.load(self.netfile)
+            else:
+                # Check that file exists
+                if not os.path.isfile(savefile):
+                    print("[ {}.RNN ] File {} doesn't exist.".format(THIS, savefile))
+                    sys.exit(1)
+
+                # Savefiles are replaced atomically, so this is always complete
+                with file(savefile, 'rb') as f:
+                    save = pickle.load(f)
+
+                # Get history
+                if 'history_size' in save:
+                    history_file = os.path.join(os.path.dirname(savefile),
+                                                save['history_file'])
+                    self.history = load_history(history_file, save['history_size'])
+                else:
+                    self.history = (save['costs_history'], save['Omega_history'])
 
             # Parameters
             self.p = save['params']
 
-            # Get history
-            self.costs_history = save['costs_history']
-            self.Omega_history = save['Omega_history']
-
             # Get best info
             best        = save['best']
             best_i      = best['iter']
@@ -198,8 +392,7 @@ class RNN(object):
             self.p = self.ou_defaults.copy()
 
             # Set history
-            self.costs_history = None
-            self.Omega_history = None
+            self.history = (None, None)
 
             #-----------------------------------------------------------------------------
             # Fill in parameters
@@ -223,12 +416,126 @@ class RNN(object):
             print("[ {}.RNN ] No savefile provided,"
                   " created independent Ornstein-Uhlenbeck processes.".format(THIS))
 
+        # Factor correlated noise covariances once
+        self.noise_factors = {}
+        for k in ['var_in', 'var_rec']:
+            self.get_noise_factor(k)
+
+    #/////////////////////////////////////////////////////////////////////////////////////
+
+    def get_history(self):
+        """
+        Return `(costs_history, Omega_history)`, reading them from the network file
+        the first time they are needed.
+
+        """
+        if self.history is None:
+            self.history = netfile.load_history(self.netfile)
+
+        return self.history
+
+    @property
+    def costs_history(self):
+        return self.get_history()[0]
+
+    @property
+    def Omega_history(self):
+        return self.get_history()[1]
+
+    def get_noise_factor(self, name):
+        """
+        Cached factor L of the covariance `self.p[name]`, or `None` if the noise is
+        independent. The factor is recomputed only if the parameter is replaced.
+
+        """
+        var = self.p[name]
+        if np.isscalar(var) or np.ndim(var) < 2:
+            return None
+
+        cached = self.noise_factors.get(name)
+        if cached is None or cached[0] is not var:
+            cached = (var, noise_factor(var))
+            self.noise_factors[name] = cached
+
+        return cached[1]
+
+    def generate_noise(self, rng, Nt, dtype):
+        """
+        Generate input and recurrent noise for `Nt` time points.
+
+        Parameters
+        ----------
+
+        rng : numpy.random.RandomState
+              Random number generator.
+
+        Nt : int
+             Number of time points.
+
+        dtype : dtype
+                Floating-point type for the noise.
+
+        Returns
+        -------
+
+        noise_in : 2D numpy.ndarray or None
+                   Input noise, `None` if the network has no inputs.
+
+        noise_rec : 2D numpy.ndarray
+                    Recurrent noise.
+
+        """
+        N       = self.p['N']
+        Nin     = self.p['Nin']
+        var_in  = self.p['var_in']
+        var_rec = self.p['var_rec']
+        dt      = self.p['dt']
+        tau     = self.p['tau']
+        tau_in  = self.p.get('tau_in', self.p['tau'])
+
+        # Input noise
+        if self.Win is not None:
+            L = self.get_noise_factor('var_in')
+            if L is None:
+                var_in = 2*tau_in/dt*var_in
+                if np.any(var_in > 0):
+                    noise_in = np.sqrt(var_in)*rng.normal(size=(Nt, Nin))
+                else:
+                    noise_in = np.zeros((Nt, Nin))
+            else:
+                noise_in  = rng.standard_normal(size=(Nt, Nin)).dot(L.T)
+                noise_in *= np.sqrt(2*tau_in/dt)
+            noise_in = np.asarray(noise_in, dtype=dtype)
+        else:
+            noise_in = None
+
+        # Recurrent noise
+        L = self.get_noise_factor('var_rec')
+        if L is None:
+            var_rec = 2/dt*var_rec
+            if np.any(var_rec > 0):
+                noise_rec = np.sqrt(var_rec)*rng.normal(size=(Nt, N))
+            else:
+                noise_rec = np.zeros((Nt, N))
+        else:
+            noise_rec  = rng.standard_normal(size=(Nt, N)).dot(L.T)
+            noise_rec *= np.sqrt(2/dt)
+        noise_rec = np.asarray(np.sqrt(tau)*noise_rec, dtype=dtype)
+
+        return noise_in, noise_rec
+
     #/////////////////////////////////////////////////////////////////////////////////////
 
-    def run(self, T=None, inputs=None, rng=None, seed=1234):
+    def run(self, T=None, inputs=None, rng=None, seed=1234, dt_save=None, units=None,
+            outputs=None, chunk=10000):
         """
         Run the network.
 
+        Noise and the external drive are generated for one chunk of time at a time and
+        only the recorded time points are kept, so memory for the recurrent units is
+        bounded by the chunk size rather than the duration of the run. Runs no longer
+        than `chunk` draw random numbers exactly as a single chunk.
+
         Parameters
         ----------
 
@@ -244,6 +551,19 @@ class RNN(object):
         seed : int, optional
                Seed for the random number generator.
 
+        dt_save : float, optional
+                  Only record every `dt_save/dt` time steps. If `None`, record every
+                  time step.
+
+        units : list of int, optional
+                Recurrent units to record. If `None`, record all units.
+
+        outputs : list of int, optional
+                  Outputs to record. If `None`, record all outputs.
+
+        chunk : float, optional
+                Duration of each chunk of integration.
+
         """
         if self.verbose:
             config = OrderedDict()
@@ -265,11 +585,8 @@ class RNN(object):
         Nin         = self.p['Nin']
         Nout        = self.p['Nout']
         baseline_in = self.p['baseline_in']
-        var_in      = self.p['var_in']
-        var_rec     = self.p['var_rec']
         dt          = self.p['dt']
         tau         = self.p['tau']
-        tau_in      = self.p.get('tau_in', self.p['tau'])
         sigma0      = self.p['sigma0']
         mode        = self.p['mode']
 
@@ -290,9 +607,8 @@ class RNN(object):
                                    .format(THIS))
 
             self.t = np.linspace(0, T, int(T/dt)+1).astype(dtype)
-            if self.Win is not None:
-                u = np.zeros((len(self.t), Nin), dtype=dtype)
-            info = None
+            u      = None
+            info   = None
         else:
             generate_trial, params = inputs
 
@@ -311,84 +627,105 @@ class RNN(object):
         # Variables to record
         #---------------------------------------------------------------------------------
 
+        # Record every `step` time steps
+        step  = RNN.get_save_step(dt, dt_save)
+        Nsave = (Nt - 1)//step + 1
+
         if self.Win is not None:
-            self.u = np.zeros((Nt, Nin), dtype=dtype)
+            self.u = np.zeros((Nsave, Nin), dtype=dtype)
         else:
             self.u = None
-        self.r = np.zeros((Nt, N), dtype=dtype)
-        self.z = np.zeros((Nt, Nout), dtype=dtype)
+        self.r = np.zeros((Nsave, N), dtype=dtype)
 
         #---------------------------------------------------------------------------------
         # Activation functions
         #---------------------------------------------------------------------------------
 
-        f_hidden = activation_functions[self.p['hidden_activation']]
+        f_hidden = activation_functions_inplace[self.p['hidden_activation']]
         f_output = activation_functions[self.p['output_activation']]
 
         #---------------------------------------------------------------------------------
-        # Integrate
+        # Integrate one chunk at a time
         #---------------------------------------------------------------------------------
 
         # Time step
         alpha = dt/tau
+        if np.isscalar(alpha):
+            alpha = alpha*np.ones(N, dtype=dtype)
 
-        # Input noise
-        if self.Win is not None:
-            var_in = 2*tau_in/dt*var_in
-            if np.isscalar(var_in) or var_in.ndim == 1:
-                if np.any(var_in > 0):
-                    noise_in = np.sqrt(var_in)*rng.normal(size=(Nt, Nin))
-                else:
-                    noise_in = np.zeros((Nt, Nin))
-            else:
-                noise_in = rng.multivariate_normal(np.zeros(Nin), var_in, Nt)
-            noise_in = np.asarray(noise_in, dtype=dtype)
+        # Time steps per chunk, a multiple of `step` so chunks start on saved points
+        nchunk = max(int(chunk/dt)//step, 1)*step
 
-        # Recurrent noise
-        var_rec = 2/dt*var_rec
-        if np.isscalar(var_rec) or var_rec.ndim == 1:
-            if np.any(var_rec > 0):
-                noise_rec = np.sqrt(var_rec)*rng.normal(size=(Nt, N))
-            else:
-                noise_rec = np.zeros((Nt, N))
-        else:
-            noise_rec = rng.multivariate_normal(np.zeros(N), var_rec, Nt)
-        noise_rec = np.asarray(np.sqrt(tau)*noise_rec, dtype=dtype)
+        # Dense or sparse weights
+        Win, Wrec, Wout = self.get_weights()
 
-        # Inputs
-        if self.Win is not None:
-            self.u = baseline_in + u + noise_in
-            if self.p['rectify_inputs']:
-                self.u = rectify(self.u)
+        start = 0
+        while True:
+            n = min(nchunk, Nt - 1 - start)
 
-        # Initial conditions
-        if hasattr(self, 'x_last'):
-            if self.verbose:
-                print("[ {}.RNN.run ] Continuing from previous run.".format(THIS))
-            x_t = self.x_last.copy()
-        else:
-            x_t = self.x0.copy()
-            if sigma0 > 0:
-                x_t += sigma0*rng.normal(size=N)
-        r_t = f_hidden(x_t)
+            # Time points not covered by the previous chunk
+            first = start + 1 if start > 0 else 0
 
-        # Record initial conditions
-        self.r[0] = r_t
+            # Input and recurrent noise for this chunk
+            noise_in, noise_rec = self.generate_noise(rng, start+n+1-first, dtype)
 
-        # Integrate
-        if np.isscalar(alpha):
-            alpha = alpha*np.ones(N, dtype=dtype)
-        if self.Win is not None:
-            euler(alpha, x_t, r_t, self.Win, self.Wrec, self.brec, self.bout,
-                  self.u, noise_rec, f_hidden, self.r)
-        else:
-            euler_no_Win(alpha, x_t, r_t, self.Wrec, self.brec, self.bout,
-                         noise_rec, f_hidden, self.r)
-        if self.Wout is not None:
-            self.z = f_output(self.r.dot(self.Wout.T) + self.bout)
+            # Initial conditions
+            if start == 0:
+                if hasattr(self, 'x_last'):
+                    if self.verbose:
+                        print("[ {}.RNN.run ] Continuing from previous run.".format(THIS))
+                    x_t = self.x_last.copy()
+                else:
+                    x_t = self.x0.copy()
+                    if sigma0 > 0:
+                        x_t += sigma0*rng.normal(size=N)
+
+                # Record initial conditions
+                f_hidden(x_t, self.r[0])
+
+            # Inputs, recording only the saved time points
+            if self.Win is not None:
+                if u is not None:
+                    u_chunk = baseline_in + u[first:start+n+1] + noise_in
+                else:
+                    u_chunk = baseline_in + noise_in
+                if self.p['rectify_inputs']:
+                    u_chunk = rectify(u_chunk)
+
+                offset = -first % step
+                self.u[(first+offset)//step:(start+n)//step+1] = u_chunk[offset::step]
+
+            # External drive, row 0 belongs to the previous chunk and is not used
+            I = np.empty((n+1, N), dtype=dtype)
+            I[first-start:]  = noise_rec
+            I[first-start:] += self.brec
+            if Win is not None:
+                I[first-start:] += RNN.dot_transpose(u_chunk, Win)
+
+            # Integrate, recording into the rows of `self.r` for this chunk
+            r = self.r[start//step:(start+n)//step+1]
+            if sparse is not None and sparse.issparse(Wrec):
+                euler_sparse(alpha, x_t, Wrec, I, f_hidden, r, step)
+            else:
+                euler(alpha, x_t, Wrec, I, f_hidden, r, step)
+
+            start += n
+            if start >= Nt - 1:
+                break
+
+        # Outputs
+        if Wout is not None:
+            self.z = f_output(RNN.dot_transpose(self.r, Wout) + self.bout)
         else:
             self.z = self.r
 
+        # Keep only the requested time points, units, and outputs
+        self.t = self.t[::step]
+        if units is not None:
+            self.r = self.r[:,units]
+        if outputs is not None:
+            self.z = self.z[:,outputs]
+
         # Transpose so first dimension is units
         if self.u is not None:
             self.u = self.u.T
@@ -405,6 +742,360 @@ class RNN(object):
 
     #/////////////////////////////////////////////////////////////////////////////////////
 
+    def run_batch(self, inputs, rng=None, seed=1234, dt_save=None, units=None,
+                  outputs=None):
+        """
+        Run the network on a batch of trials simultaneously.
+
+        The trials are padded to the longest trial and integrated together, so each
+        time step involves a single matrix-matrix product instead of one matrix-vector
+        product per trial. Random numbers are drawn in the same order as in repeated
+        calls to `RNN.run` with the same `rng`, so the results match (up to rounding)
+        running the trials one at a time in `batch` mode. Every trial starts from `x0`.
+
+        Memory scales with the number of trials times the duration of the longest
+        trial, so very long lists of trials should be split into smaller blocks.
+
+        Parameters
+        ----------
+
+        inputs : (generate_trial, [params, ...])
+                 One trial is generated for each element of the list of parameters.
+
+        rng : numpy.random.RandomState
+              Random number generator. If `None`, one will be created using seed.
+
+        seed : int, optional
+               Seed for the random number generator.
+
+        dt_save, units, outputs : optional
+                                  Time points, units, and outputs to record, as in
+                                  `RNN.run`.
+
+        Returns
+        -------
+
+        trials : list of dicts
+                 Each trial contains `t`, `u`, `r`, `z`, and `info`, with the same
+                 layout as the corresponding attributes after a call to `RNN.run`.
+
+        """
+        if self.verbose:
+            config = OrderedDict()
+
+            config['dt']        = '{} ms'.format(self.p['dt'])
+            config['threshold'] = self.p['threshold']
+
+            print_settings(config)
+
+        # Random number generator
+        if rng is None:
+            rng = np.random.RandomState(seed)
+
+        #---------------------------------------------------------------------------------
+        # Setup
+        #---------------------------------------------------------------------------------
+
+        N           = self.p['N']
+        Nin         = self.p['Nin']
+        Nout        = self.p['Nout']
+        baseline_in = self.p['baseline_in']
+        dt          = self.p['dt']
+        tau         = self.p['tau']
+        sigma0      = self.p['sigma0']
+
+        # Check dt
+        if np.any(dt > tau/10):
+            print("[ {}.RNN.run_batch ] Warning: dt seems a bit large.".format(THIS))
+
+        # Float
+        dtype = self.Wrec.dtype
+
+        #---------------------------------------------------------------------------------
+        # Generate trials and noise in the same order as `RNN.run`
+        #---------------------------------------------------------------------------------
+
+        generate_trial, params_list = inputs
+
+        ts         = []
+        infos      = []
+        trial_u    = []
+        noises_in  = []
+        noises_rec = []
+        x0s        = []
+        for params in params_list:
+            trial = generate_trial(rng, dt, params)
+            info  = trial['info']
+            t     = np.concatenate(([0], trial['t']))
+
+            u = np.zeros((len(t), trial['inputs'].shape[1]), dtype=dtype)
+            u[1:,:] = trial['inputs']
+
+            info['epochs'] = trial['epochs']
+
+            noise_in, noise_rec = self.generate_noise(rng, len(t), dtype)
+
+            x0 = self.x0.copy()
+            if sigma0 > 0:
+                x0 += sigma0*rng.normal(size=N)
+
+            ts.append(t)
+            infos.append(info)
+            trial_u.append(u)
+            noises_in.append(noise_in)
+            noises_rec.append(noise_rec)
+            x0s.append(x0)
+
+        #---------------------------------------------------------------------------------
+        # Pad trials
+        #---------------------------------------------------------------------------------
+
+        B  = len(ts)
+        Nt = max([len(t) for t in ts])
+
+        if self.Win is not None:
+            u = np.zeros((Nt, B, Nin), dtype=dtype)
+        noise_rec = np.zeros((Nt, B, N), dtype=dtype)
+        for b, t in enumerate(ts):
+            if self.Win is not None:
+                u[:len(t),b] = baseline_in + trial_u[b] + noises_in[b]
+            noise_rec[:len(t),b] = noises_rec[b]
+
+        if self.Win is not None and self.p['rectify_inputs']:
+            u = rectify(u)
+
+        #---------------------------------------------------------------------------------
+        # Integrate
+        #---------------------------------------------------------------------------------
+
+        f_hidden = activation_functions_inplace[self.p['hidden_activation']]
+        f_output = activation_functions[self.p['output_activation']]
+
+        # Time step
+        alpha = dt/tau
+        if np.isscalar(alpha):
+            alpha = alpha*np.ones(N, dtype=dtype)
+
+        # Initial conditions
+        x_t = np.asarray(x0s, dtype=dtype)
+
+        # Record every `step` time steps
+        step = RNN.get_save_step(dt, dt_save)
+
+        r = np.zeros(((Nt - 1)//step + 1, B, N), dtype=dtype)
+        f_hidden(x_t, r[0])
+
+        # Dense or sparse weights
+        Win, Wrec, Wout = self.get_weights()
+
+        # External drive for all time points and trials at once
+        I  = noise_rec
+        I += self.brec
+        if Win is not None:
+            I += RNN.dot_transpose(u, Win)
+
+        if sparse is not None and sparse.issparse(Wrec):
+            euler_batch_sparse(alpha, x_t, Wrec, I, f_hidden, r, step)
+        else:
+            euler_batch(alpha, x_t, Wrec, I, f_hidden, r, step)
+
+        #---------------------------------------------------------------------------------
+        # Unpad trials
+        #---------------------------------------------------------------------------------
+
+        trials = []
+        for b, t in enumerate(ts):
+            t   = t[::step]
+            r_b = r[:len(t),b]
+            if Wout is not None:
+                z_b = f_output(RNN.dot_transpose(r_b, Wout) + self.bout)
+            else:
+                z_b = r_b
+
+            if self.Win is not None:
+                u_b = u[:step*(len(t)-1)+1:step,b].T
+            else:
+                u_b = None
+
+            if units is not None:
+                r_b = r_b[:,units]
+            if outputs is not None:
+                z_b = z_b[:,outputs]
+
+            trials.append({
+                't':    t,
+                'u':    u_b,
+                'r':    r_b.T,
+                'z':    z_b.T,
+                'info': infos[b]
+                })
+
+        #---------------------------------------------------------------------------------
+
+        return trials
+
+    #/////////////////////////////////////////////////////////////////////////////////////
+
+    def stream(self, T, chunk=1000, rng=None, seed=1234):
+        """
+        Run the network without task inputs for duration `T`, integrating in chunks
+        and yielding the results of each chunk as soon as it is done.
+
+        Unlike `RNN.run`, nothing is allocated for the full duration: noise is
+        generated separately for each chunk and the state is carried over from one
+        chunk to the next, so memory is bounded by the chunk size. As in `RNN.run`,
+        the network continues from `x_last` if it exists, and in `continuous` mode
+        `x_last` is set at the end of the run.
+
+        Parameters
+        ----------
+
+        T : float
+            Duration for which to run the network.
+
+        chunk : float, optional
+                Duration of each chunk.
+
+        rng : numpy.random.RandomState
+              Random number generator. If `None`, one will be created using seed.
+
+        seed : int, optional
+               Seed for the random number generator.
+
+        Yields
+        ------
+
+        (t, u, r, z) : tuple of numpy.ndarray
+                       Time points, inputs, firing rates, and outputs for one chunk,
+                       with the same layout as the corresponding attributes after a
+                       call to `RNN.run`. The first chunk includes the initial
+                       conditions at t = 0, and `u` is `None` if the network has no
+                       inputs.
+
+        """
+        if self.verbose:
+            config = OrderedDict()
+
+            config['dt']        = '{} ms'.format(self.p['dt'])
+            config['threshold'] = self.p['threshold']
+            config['chunk']     = '{} ms'.format(chunk)
+
+            print_settings(config)
+
+        # Random number generator
+        if rng is None:
+            rng = np.random.RandomState(seed)
+
+        #---------------------------------------------------------------------------------
+        # Setup
+        #---------------------------------------------------------------------------------
+
+        N           = self.p['N']
+        Nin         = self.p['Nin']
+        baseline_in = self.p['baseline_in']
+        dt          = self.p['dt']
+        tau         = self.p['tau']
+        sigma0      = self.p['sigma0']
+        mode        = self.p['mode']
+
+        # Check dt
+        if np.any(dt > tau/10):
+            print("[ {}.RNN.stream ] Warning: dt seems a bit large.".format(THIS))
+
+        # Float
+        dtype = self.Wrec.dtype
+
+        # Number of time steps
+        nsteps = int(T/dt)
+        nchunk = max(int(chunk/dt), 1)
+
+        # Activation functions
+        f_hidden = activation_functions_inplace[self.p['hidden_activation']]
+        f_output = activation_functions[self.p['output_activation']]
+
+        # Time step
+        alpha = dt/tau
+        if np.isscalar(alpha):
+            alpha = alpha*np.ones(N, dtype=dtype)
+
+        # Dense or sparse weights
+        Win, Wrec, Wout = self.get_weights()
+
+        # Initial conditions
+        if hasattr(self, 'x_last'):
+            if self.verbose:
+                print("[ {}.RNN.stream ] Continuing from previous run.".format(THIS))
+            x_t = self.x_last.copy()
+        else:
+            x_t = self.x0.copy()
+            if sigma0 > 0:
+                x_t += sigma0*rng.normal(size=N)
+        r_t = np.empty(N, dtype=dtype)
+        f_hidden(x_t, r_t)
+
+        #---------------------------------------------------------------------------------
+        # Integrate one chunk at a time
+        #---------------------------------------------------------------------------------
+
+        start = 0
+        while True:
+            n = min(nchunk, nsteps - start)
+
+            # Row 0 holds the state at the end of the previous chunk
+            t = dt*np.arange(start, start+n+1, dtype=dtype)
+            r = np.zeros((n+1, N), dtype=dtype)
+            r[0] = r_t
+
+            # Inputs and noise for this chunk
+            noise_in, noise_rec = self.generate_noise(rng, n+1, dtype)
+            if Win is not None:
+                u = baseline_in + noise_in
+                if self.p['rectify_inputs']:
+                    u = rectify(u)
+            else:
+                u = None
+
+            # External drive
+            I  = noise_rec
+            I += self.brec
+            if Win is not None:
+                I += RNN.dot_transpose(u, Win)
+
+            # Integrate
+            if sparse is not None and sparse.issparse(Wrec):
+                euler_sparse(alpha, x_t, Wrec, I, f_hidden, r)
+            else:
+                euler(alpha, x_t, Wrec, I, f_hidden, r)
+            r_t[:] = r[-1]
+
+            # Outputs
+            if Wout is not None:
+                z = f_output(RNN.dot_transpose(r, Wout) + self.bout)
+            else:
+                z = r
+
+            # Only the first chunk includes the initial conditions
+            if start > 0:
+                t = t[1:]
+                r = r[1:]
+                z = z[1:]
+                if u is not None:
+                    u = u[1:]
+
+            # In continuous mode start from here the next time
+            if mode == 'continuous':
+                self.x_last = x_t.copy()
+
+            if u is not None:
+                u = u.T
+            yield t, u, r.T, z.T
+
+            start += n
+            if start >= nsteps:
+                break
+
+    #/////////////////////////////////////////////////////////////////////////////////////
+
     def plot_costs(self):
         """
         Plot the evolution of the cost functions.
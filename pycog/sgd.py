@@ -13,17 +13,27 @@ from __future__ import division
 
 import cPickle as pickle
 import datetime
+import multiprocessing
 import os
+import signal
 import sys
 
 import numpy as np
 
-import theano
-import theano.tensor as T
+# Not needed by subclasses that don't use Theano
+try:
+    import theano
+    import theano.tensor as T
+except ImportError:
+    theano = None
 
-from .      import theanotools
+from .      import netfile
 from .rnn   import RNN
-from .utils import dump
+from .utils import (Timer, append_history, append_json, dump, get_history_filename,
+                    get_timing_filename, load_history, truncate_history)
+
+if theano is not None:
+    from . import theanotools
 
 THIS = 'pycog.sgd'
 
@@ -78,6 +88,12 @@ class SGD(object):
                  Additinal information needed by the SGD training algorithm
                  (specifically, for computing the regularization term) that may not
                  be needed by other training algorithms (e.g., Hessian-free).
+                 With truncated backpropagation through time, `x_init` and `carry`
+                 are the inputs for the state to start from (see `Trainer`). With
+                 noise generated in the graph, `srng` and `srng_validation` are the
+                 random streams for training and validation, and `validation_noise`
+                 pairs the noise in the training graph with the noise to use for
+                 the validation cost.
 
         """
         self.trainables  = trainables
@@ -87,6 +103,13 @@ class SGD(object):
         # Trainable variable names
         self.trainable_names = [tr.name for tr in trainables]
 
+        # Starting vector for estimating the spectral radius
+        self.rho_v0 = None
+
+        # Random streams for noise generated in the graph
+        self.srng            = extras.get('srng')
+        self.srng_validation = extras.get('srng_validation')
+
         #---------------------------------------------------------------------------------
         # Setup
         #---------------------------------------------------------------------------------
@@ -100,14 +123,19 @@ class SGD(object):
         # Compute gradient
         #---------------------------------------------------------------------------------
 
+        # With gradient checkpointing `x` only holds some of the states, which isn't
+        # enough for the vanishing gradient regularizer, which is then disabled
+        use_Omega = self.p['scan_checkpoint'] is None and self.p['lambda_Omega'] > 0
+
         # Pascanu's trick for getting dL/dxt
         # scan_node.op.n_seqs is the number of sequences in the scan
         # init_x is the initial value of x at all time points, including x0
-        scan_node = x.owner.inputs[0].owner
-        assert isinstance(scan_node.op, theano.scan_module.scan_op.Scan)
-        npos   = scan_node.op.n_seqs + 1
-        init_x = scan_node.inputs[npos]
-        g_x,   = theanotools.grad(costs[0], [init_x])
+        if use_Omega:
+            scan_node = x.owner.inputs[0].owner
+            assert isinstance(scan_node.op, theano.scan_module.scan_op.Scan)
+            npos   = scan_node.op.n_seqs + 1
+            init_x = scan_node.inputs[npos]
+            g_x,   = theanotools.grad(costs[0], [init_x])
 
         # Get into "standard" order, by filling `self.trainables` with
         # `None`s if some of the parameters are not trained.
@@ -132,102 +160,383 @@ class SGD(object):
             alpha = T.scalar('alpha')
         else:
             alpha = T.vector('alpha')
-        d_xt = T.tensor3('d_xt') # Later replaced by g_x, of size (time+1), batchsize, N
-        xt   = T.tensor3('xt')   # Later replaced by x, of size time, batchsize, N
-        # Using temporary variables instead of actual x variables
-        # allows for calculation of immediate derivatives
-
-        # Here construct the regularizer Omega for the vanishing gradient problem
-
-        # Numerator of Omega (d_xt[1:] returns time X batchsize X N)
-        # Notice Wrec_ is used in the network equation as: T.dot(r_tm1, Wrec_.T)
-        num = (1 - alpha)*d_xt[1:] + T.dot(alpha*d_xt[1:], self.Wrec_)*d_f_hidden(xt)
-        num = (num**2).sum(axis=2)
-
-        # Denominator of Omega, small denominators are not considered
-        # \partial E/\partial x_{t+1}, squared and summed over hidden units
-        denom = (d_xt[1:]**2).sum(axis=2)
-        Omega = (T.switch(T.ge(denom, bound), num/denom, 1) - 1)**2
-
-        # First averaged across batches (.mean(axis=1)),
-        # then averaged across all time steps where |\p E/\p x_t|^2 > bound
-        nelems = T.mean(T.ge(denom, bound), axis=1)
-        Omega  = Omega.mean(axis=1).sum()/nelems.sum()
-
-        # tmp_g_Wrec: immediate derivative of Omega with respect to Wrec
-        # Notice grad is computed before the clone.
-        # This is critical for calculating the immediate derivative.
-        tmp_g_Wrec = theanotools.grad(Omega, Wrec)
-        Omega, tmp_g_Wrec, nelems = theano.clone([Omega, tmp_g_Wrec, nelems.mean()],
-                                                 replace=[(d_xt, g_x), (xt, x)])
-        # Add the gradient to the original gradient
-        g_Wrec += lambda_Omega * tmp_g_Wrec
+
+        if use_Omega:
+            d_xt = T.tensor3('d_xt') # Later replaced by g_x, (time+1) X batchsize X N
+            xt   = T.tensor3('xt')   # Later replaced by x, time X batchsize X N
+            # Using temporary variables instead of actual x variables
+            # allows for calculation of immediate derivatives
+
+            # Here construct the regularizer Omega for the vanishing gradient problem
+
+            # Time points to use (d_xt[1:] returns time X batchsize X N)
+            d_xt_ = d_xt[1:]
+            xt_   = xt
+            if self.p['Omega_subsample'] is not None:
+                d_xt_ = d_xt_[::self.p['Omega_subsample']]
+                xt_   = xt_[::self.p['Omega_subsample']]
+
+            # Numerator of Omega
+            # Notice Wrec_ is used in the network equation as: T.dot(r_tm1, Wrec_.T)
+            num = (1 - alpha)*d_xt_ + T.dot(alpha*d_xt_, self.Wrec_)*d_f_hidden(xt_)
+            num = (num**2).sum(axis=2)
+
+            # Denominator of Omega, small denominators are not considered
+            # \partial E/\partial x_{t+1}, squared and summed over hidden units
+            denom = (d_xt_**2).sum(axis=2)
+            Omega = (T.switch(T.ge(denom, bound), num/denom, 1) - 1)**2
+
+            # First averaged across batches (.mean(axis=1)),
+            # then averaged across all time steps where |\p E/\p x_t|^2 > bound
+            nelems = T.mean(T.ge(denom, bound), axis=1)
+            Omega  = Omega.mean(axis=1).sum()/nelems.sum()
+
+            # tmp_g_Wrec: immediate derivative of Omega with respect to Wrec
+            # Notice grad is computed before the clone.
+            # This is critical for calculating the immediate derivative.
+            tmp_g_Wrec = theanotools.grad(Omega, Wrec)
+            Omega, tmp_g_Wrec, nelems = theano.clone([Omega, tmp_g_Wrec, nelems.mean()],
+                                                     replace=[(d_xt, g_x), (xt, x)])
+        else:
+            Omega  = T.constant(np.cast[theano.config.floatX](0))
+            nelems = Omega
 
         #---------------------------------------------------------------------------------
-        # Gradient clipping
+        # Optimizer state
         #---------------------------------------------------------------------------------
 
-        g = []
-        if 'Win' in self.trainable_names:
-            g += [g_Win]
-        g += [g_Wrec, g_Wout]
-        if 'brec' in self.trainable_names:
-            g += [g_brec]
-        if 'bout' in self.trainable_names:
-            g += [g_bout]
-        if 'x0' in self.trainable_names:
-            g += [g_x0]
-
-        # Clip
-        gnorm = T.sqrt(sum([(i**2).sum() for i in g]))
-        g = [SGD.clip_norm(i, gnorm, maxnorm) for i in g]
-        g_Win, g_Wrec, g_Wout, g_brec, g_bout, g_x0 = RNN.fill(g, self.trainable_names)
-
-        # Pascanu's safeguard for numerical precision issues with float32
-        new_cond = T.or_(T.or_(T.isnan(gnorm), T.isinf(gnorm)),
-                         T.or_(gnorm < 0, gnorm > 1e10))
-        if 'Win' in self.trainable_names:
-            g_Win  = T.switch(new_cond, np.float32(0), g_Win)
-        g_Wrec = T.switch(new_cond, np.float32(0.02)*Wrec, g_Wrec)
-        g_Wout = T.switch(new_cond, np.float32(0), g_Wout)
-        if 'brec' in self.trainable_names:
-            g_brec = T.switch(new_cond, np.float32(0), g_brec)
-        if 'bout' in self.trainable_names:
-            g_bout = T.switch(new_cond, np.float32(0), g_bout)
-        if 'x0' in self.trainable_names:
-            g_x0 = T.switch(new_cond, np.float32(0), g_x0)
+        self.optimizer_state = []
+        for name in SGD.get_state_names(self.p, self.trainable_names):
+            if name == 'adam_t':
+                state = theanotools.shared_scalar(0, name=name)
+            else:
+                i     = self.trainable_names.index(name.rsplit('_', 1)[0])
+                shape = self.trainables[i].get_value(borrow=True).shape
+                state = theanotools.shared_zeros(shape, name=name)
+            self.optimizer_state.append(state)
+
+        # Inputs for the state to start from
+        if 'x_init' in extras:
+            truncation = [extras['x_init'], extras['carry']]
+        else:
+            truncation = []
 
         #---------------------------------------------------------------------------------
-        # Training step
+        # Update functions
         #---------------------------------------------------------------------------------
 
-        # Final gradients
-        g = []
-        if 'Win' in self.trainable_names:
-            g += [g_Win]
-        g += [g_Wrec, g_Wout]
-        if 'brec' in self.trainable_names:
-            g += [g_brec]
-        if 'bout' in self.trainable_names:
-            g += [g_bout]
-        if 'x0' in self.trainable_names:
-            g += [g_x0]
-
-        # Update rule
-        updates = [(theta, theta - lr*grad) for theta, grad in zip(self.trainables, g)]
-
-        # Update function
-        self.train_step = theanotools.function(
-            inputs + [alpha, lambda_Omega, lr, maxnorm, bound],
-            [costs[0] + regs, gnorm, Omega, nelems, x],
-            updates=updates
-            )
+        def compile_step(g_Wrec, Omega, nelems, use_Omega):
+            """
+            Compile a training step that follows the gradient with `g_Wrec` for the
+            recurrent weights.
+
+            """
+            #-----------------------------------------------------------------------------
+            # Gradient clipping
+            #-----------------------------------------------------------------------------
+
+            g = []
+            if 'Win' in self.trainable_names:
+                g += [g_Win]
+            g += [g_Wrec, g_Wout]
+            if 'brec' in self.trainable_names:
+                g += [g_brec]
+            if 'bout' in self.trainable_names:
+                g += [g_bout]
+            if 'x0' in self.trainable_names:
+                g += [g_x0]
+
+            # Clip
+            gnorm = T.sqrt(sum([(i**2).sum() for i in g]))
+            g = [SGD.clip_norm(i, gnorm, maxnorm) for i in g]
+            g_Win_, g_Wrec_, g_Wout_, g_brec_, g_bout_, g_x0_ = RNN.fill(
+                g, self.trainable_names
+                )
+
+            # Pascanu's safeguard for numerical precision issues with float32
+            new_cond = T.or_(T.or_(T.isnan(gnorm), T.isinf(gnorm)),
+                             T.or_(gnorm < 0, gnorm > 1e10))
+            if 'Win' in self.trainable_names:
+                g_Win_  = T.switch(new_cond, np.float32(0), g_Win_)
+            g_Wrec_ = T.switch(new_cond, np.float32(0.02)*Wrec, g_Wrec_)
+            g_Wout_ = T.switch(new_cond, np.float32(0), g_Wout_)
+            if 'brec' in self.trainable_names:
+                g_brec_ = T.switch(new_cond, np.float32(0), g_brec_)
+            if 'bout' in self.trainable_names:
+                g_bout_ = T.switch(new_cond, np.float32(0), g_bout_)
+            if 'x0' in self.trainable_names:
+                g_x0_ = T.switch(new_cond, np.float32(0), g_x0_)
+
+            #-----------------------------------------------------------------------------
+            # Training step
+            #-----------------------------------------------------------------------------
+
+            # Final gradients
+            g = []
+            if 'Win' in self.trainable_names:
+                g += [g_Win_]
+            g += [g_Wrec_, g_Wout_]
+            if 'brec' in self.trainable_names:
+                g += [g_brec_]
+            if 'bout' in self.trainable_names:
+                g += [g_bout_]
+            if 'x0' in self.trainable_names:
+                g += [g_x0_]
+
+            # Update rule
+            if self.optimizer_state:
+                state = {s.name: s for s in self.optimizer_state}
+                steps, new_state = SGD.optimizer_steps(self.p, self.trainable_names, g,
+                                                       lr, state, T.sqrt)
+
+                # The safeguard takes a plain gradient step and leaves the state
+                # unchanged
+                updates = [(theta, T.switch(new_cond, theta - lr*grad, theta + step))
+                           for theta, grad, step in zip(self.trainables, g, steps)]
+                updates += [(s, T.switch(new_cond, s, new_state[s.name]))
+                            for s in self.optimizer_state]
+            else:
+                updates = [(theta, theta - lr*grad)
+                           for theta, grad in zip(self.trainables, g)]
+
+            # Update function
+            return theanotools.function(
+                inputs + [alpha, lambda_Omega, lr, maxnorm, bound] + truncation,
+                [costs[0] + regs, gnorm, Omega, nelems, x],
+                updates=updates,
+                on_unused_input='warn' if use_Omega else 'ignore'
+                )
+
+        # With Omega, if it is used
+        if use_Omega:
+            self.train_step = compile_step(g_Wrec + lambda_Omega*tmp_g_Wrec, Omega,
+                                           nelems, True)
+        else:
+            self.train_step = compile_step(g_Wrec, Omega, nelems, False)
+
+        # Without Omega, for steps that skip it
+        if use_Omega and SGD.throttles_Omega(self.p):
+            zero = T.constant(np.cast[theano.config.floatX](0))
+            self.train_step_plain = compile_step(g_Wrec, zero, zero, False)
+        else:
+            self.train_step_plain = self.train_step
 
         # Cost function
-        self.f_cost = theanotools.function(inputs, [costs[0] + regs] + costs[1:] + [z])
+        if truncation:
+            x_init, carry = truncation
+            x_zeros = T.zeros((inputs[0].shape[1], self.p['N']), dtype=x_init.dtype)
+            givens  = [(x_init, x_zeros), (carry, np.cast[carry.dtype](0))]
+
+            # Final state, for windows that are only run forward
+            self.f_state = theanotools.function([inputs[0]] + truncation, x[-1])
+        else:
+            givens = []
+        outputs = [costs[0] + regs] + costs[1:] + [z]
+        if 'validation_noise' in extras:
+            outputs = theano.clone(outputs, replace=extras['validation_noise'])
+        self.f_cost = theanotools.function(inputs, outputs, givens=givens)
 
     #/////////////////////////////////////////////////////////////////////////////////////
 
+    def train_truncated(self, inputs, args, x_last=None, train_step=None):
+        """
+        Truncated backpropagation through time: take a training step for each window
+        of `bptt_window` time steps in a minibatch, starting from the state where the
+        previous window ended. Windows without unmasked time steps are only run
+        forward.
+
+        Parameters
+        ----------
+
+        inputs : [inputs, targets]
+                 Minibatch.
+
+        args : list
+               Other arguments of `train_step`.
+
+        x_last : numpy.ndarray, optional
+                 State to start from. If `None`, start from the initial conditions.
+
+        train_step : function, optional
+                     Training step to use, `train_step` by default.
+
+        Returns
+        -------
+
+        result : list
+                 Outputs of the last training step, or `None` if every window was
+                 masked.
+
+        x_last : numpy.ndarray
+                 Final state.
+
+        """
+        u, target = inputs
+        Nout      = self.p['Nout']
+        window    = self.p['bptt_window']
+        if train_step is None:
+            train_step = self.train_step
+
+        if x_last is None or x_last.shape[0] != u.shape[1]:
+            x_last = np.zeros((u.shape[1], self.p['N']), dtype=u.dtype)
+            carry  = u.dtype.type(0)
+        else:
+            carry  = u.dtype.type(1)
+
+        result = None
+        for start in xrange(0, u.shape[0], window):
+            u_w      = u[start:start+window]
+            target_w = target[start:start+window]
+            if np.any(target_w[:,:,Nout:]):
+                result = train_step(*([u_w, target_w] + args + [x_last, carry]))
+                x_last = result[-1][-1]
+            else:
+                x_last = self.f_state(u_w, x_last, carry)
+            carry = u.dtype.type(1)
+
+        return result, x_last
+
+    @staticmethod
+    def throttles_Omega(params):
+        """
+        Whether some training steps skip the vanishing gradient regularizer.
+
+        """
+        return params['Omega_every'] > 1 or params['Omega_anneal'] is not None
+
+    @staticmethod
+    def get_lambda_Omega(params, iter):
+        """
+        Multiplier of the vanishing gradient regularizer for update `iter`, or `None`
+        if the update skips the regularizer.
+
+        """
+        lambda_Omega = params['lambda_Omega']
+
+        # The term is disabled, e.g., with gradient checkpointing (see `Trainer`)
+        if lambda_Omega == 0:
+            return None
+
+        # Anneal linearly to zero, after which the term is dropped
+        anneal = params['Omega_anneal']
+        if anneal is not None:
+            lambda_Omega *= max(0, 1 - (iter - 1)/anneal)
+            if lambda_Omega == 0:
+                return None
+
+        if (iter - 1) % params['Omega_every'] != 0:
+            return None
+
+        return lambda_Omega
+
+    @staticmethod
+    def describe_method(params):
+        """
+        Describe the optimizer given by `params`.
+
+        """
+        method = params['method']
+        if method == 'sgd':
+            s = 'SGD'
+        elif method == 'rmsprop':
+            s = 'RMSprop (decay = {})'.format(params['decay'])
+        elif method == 'adam':
+            s = 'Adam (beta1 = {}, beta2 = {})'.format(params['beta1'], params['beta2'])
+        else:
+            raise ValueError("[ {}.SGD ] Unknown optimization method {}."
+                             .format(THIS, method))
+
+        if params['momentum'] and method != 'adam':
+            s += ' with momentum {}'.format(params['momentum'])
+
+        return s
+
+    @staticmethod
+    def get_state_names(params, names):
+        """
+        Names of the optimizer's state variables for the trained variables `names`.
+        Except for Adam's step count `adam_t`, each state variable has the shape of
+        the variable whose name it starts with.
+
+        """
+        method = params['method']
+
+        state_names = []
+        if method == 'adam':
+            state_names += ['adam_t']
+        for name in names:
+            if method == 'rmsprop':
+                state_names += [name + '_ms']
+            elif method == 'adam':
+                state_names += [name + '_m', name + '_s']
+            if params['momentum'] and method != 'adam':
+                state_names += [name + '_v']
+
+        return state_names
+
+    @staticmethod
+    def optimizer_steps(params, names, g, lr, state, sqrt):
+        """
+        Changes in the trained variables `names` with gradients `g`, for Theano
+        expressions or NumPy arrays.
+
+        Parameters
+        ----------
+
+        state : dict
+                Optimizer state by name (see `get_state_names`).
+
+        sqrt : function
+               Square root for the type of `g`.
+
+        Returns
+        -------
+
+        steps : list
+                Change in each variable.
+
+        new_state : dict
+                    Updated optimizer state.
+
+        """
+        method   = params['method']
+        momentum = params['momentum']
+        decay    = params['decay']
+        beta1    = params['beta1']
+        beta2    = params['beta2']
+        epsilon  = params['epsilon']
+
+        new_state = {}
+
+        # Adam's bias correction
+        if method == 'adam':
+            t = state['adam_t'] + 1
+            new_state['adam_t'] = t
+            lr = lr*sqrt(1 - beta2**t)/(1 - beta1**t)
+
+        steps = []
+        for name, grad in zip(names, g):
+            if method == 'sgd':
+                step = -lr*grad
+            elif method == 'rmsprop':
+                ms = decay*state[name + '_ms'] + (1 - decay)*grad**2
+                new_state[name + '_ms'] = ms
+                step = -lr*grad/(sqrt(ms) + epsilon)
+            elif method == 'adam':
+                m = beta1*state[name + '_m'] + (1 - beta1)*grad
+                v = beta2*state[name + '_s'] + (1 - beta2)*grad**2
+                new_state[name + '_m'] = m
+                new_state[name + '_s'] = v
+                step = -lr*m/(sqrt(v) + epsilon)
+
+            if momentum and method != 'adam':
+                step = momentum*state[name + '_v'] + step
+                new_state[name + '_v'] = step
+
+            steps.append(step)
+
+        return steps, new_state
+
     @staticmethod
     def get_value(x):
         """
@@ -248,6 +557,71 @@ class SGD(object):
         """
         return [SGD.get_value(theta) for theta in thetas]
 
+    @staticmethod
+    def get_rstates(srng):
+        """
+        Return the shared variables holding the states of a random stream.
+
+        """
+        return [state_update[0] for state_update in srng.state_updates]
+
+    def reseed_validation_noise(self, validation_data):
+        """
+        Reseed the random stream for the validation noise generated in the graph from
+        `validation_seed` and the number of times `validation_data` has drawn noise,
+        so the noise changes exactly when the validation set would draw new noise.
+
+        """
+        if self.srng_validation is None:
+            return
+
+        seed = np.random.RandomState([self.p['validation_seed'],
+                                      validation_data.noise_draws]).randint(2**30)
+        self.srng_validation.seed(seed)
+
+    def uses_gpu(self):
+        """
+        Whether the training functions run on a GPU.
+
+        """
+        return theanotools.get_processor_type() == 'gpu'
+
+    @staticmethod
+    def fork(f, *args):
+        """
+        Call `f(*args)` in a child process, which sees a snapshot of the current state
+        of the parent, including the network weights.
+
+        Returns
+        -------
+
+        wait : function
+               Waits for the child to finish and returns the result, which must be
+               picklable.
+
+        """
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+
+        def target():
+            # Finish even if training is interrupted, the parent waits for us
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            sender.send(f(*args))
+
+        process = multiprocessing.Process(target=target)
+        process.start()
+        sender.close()
+
+        def wait():
+            try:
+                return receiver.recv()
+            except EOFError:
+                raise RuntimeError("[ {}.SGD.fork ] Child process failed."
+                                   .format(THIS))
+            finally:
+                process.join()
+
+        return wait
+
     #/////////////////////////////////////////////////////////////////////////////////////
 
     def train(self, gradient_data, validation_data, savefile):
@@ -278,45 +652,79 @@ class SGD(object):
             patience = 100*checkfreq
 
         alpha        = self.p['dt']/self.p['tau']
-        lambda_Omega = self.p['lambda_Omega']
         lr           = self.p['learning_rate']
         maxnorm      = self.p['max_gradient_norm']
         bound        = self.p['bound']
         save_exclude = ['callback', 'performance', 'terminate']
 
+        # Costs are appended to the history log as they are computed, and each
+        # checkpoint records how much of the log belongs to it.
+        history_file = get_history_filename(savefile)
+
+        # State of the random stream for noise generated in the graph
+        def rng_graph():
+            if self.srng is None:
+                return None
+            return [np.copy(SGD.get_value(i)) for i in SGD.get_rstates(self.srng)]
+
+        # Time spent in each phase of training, optionally logged at every check
+        timer = Timer()
+        if self.p['timing_log']:
+            timing_file = get_timing_filename(savefile)
+        else:
+            timing_file = None
+
         #---------------------------------------------------------------------------------
         # Continue previous run if we can
         #---------------------------------------------------------------------------------
-    
-        
-                      
+
         if os.path.isfile(savefile):
-            
-            while True:                
-                try:
-                    with file(savefile, 'rb') as f:
-                        save = pickle.load(f)
-                    break
-                except EOFError:
-                    wait = 5
-                    print("[ {}.RNN ] Got an EOFError, trying again in {} seconds."
-                          .format(THIS, wait))
-                    time.sleep(wait)
-                    
-            best          = save['best']
-            init_p        = save['current']
-            first_iter    = save['iter']
-            costs_history = save['costs_history']
-            Omega_history = save['Omega_history']
+            with file(savefile, 'rb') as f:
+                save = pickle.load(f)
+
+            best       = save['best']
+            init_p     = save['current']
+            first_iter = save['iter']
+
+            # Discard costs computed after the checkpoint
+            if 'history_size' in save:
+                history_size = save['history_size']
+                truncate_history(history_file, history_size)
+                costs_history, Omega_history = load_history(history_file, history_size)
+            else:
+                costs_history = save['costs_history']
+                Omega_history = save['Omega_history']
+
+                # Move the histories of older savefiles to the log
+                truncate_history(history_file, 0)
+                history_size = 0
+                for entry in costs_history:
+                    history_size = append_history(history_file, 'costs_history', entry)
+                for entry in Omega_history:
+                    history_size = append_history(history_file, 'Omega_history', entry)
 
             # Restore RNGs for datasets
             gradient_data.rng   = save['rng_gradient']
             validation_data.rng = save['rng_validation']
 
+            # Restore the random stream for noise generated in the graph
+            if self.srng is not None and save.get('rng_graph') is not None:
+                for i, j in zip(SGD.get_rstates(self.srng), save['rng_graph']):
+                    i.set_value(j)
+
             # Restore parameter values
             for i, j in zip(self.trainables, init_p):
                 i.set_value(j)
 
+            # Restore optimizer state
+            optimizer = save.get('optimizer', {})
+            for i in self.optimizer_state:
+                if i.name in optimizer:
+                    i.set_value(optimizer[i.name])
+                else:
+                    print("[ {}.SGD.train ] No saved state for {}, starting from zero."
+                          .format(THIS, i.name))
+
             print(("[ {}.SGD.train ] Recovered saved model,"
                    " continuing from iteration {}.").format(THIS, first_iter))
         else:
@@ -330,6 +738,10 @@ class SGD(object):
             costs_history = []
             Omega_history = []
 
+            # Start a new history log
+            history_size = 0
+            truncate_history(history_file, history_size)
+
             # Save initial conditions
             save = {
                 'params':         {k: v for k, v in self.p.items()
@@ -337,27 +749,204 @@ class SGD(object):
                 'varlist':        self.trainable_names,
                 'iter':           1,
                 'current':        SGD.get_values(self.trainables),
+                'optimizer':      {i.name: SGD.get_value(i)
+                                   for i in self.optimizer_state},
                 'best':           best,
-                'costs_history':  costs_history,
-                'Omega_history':  Omega_history,
+                'history_file':   os.path.basename(history_file),
+                'history_size':   history_size,
                 'rng_gradient':   gradient_data.rng,
-                'rng_validation': validation_data.rng
+                'rng_validation': validation_data.rng,
+                'rng_graph':      rng_graph()
                 }
             base, ext = os.path.splitext(savefile)
             dump(base + '_init' + ext, save)
+            netfile.dump(netfile.get_filename(base + '_init' + ext), save)
 
         #---------------------------------------------------------------------------------
-        # Updates
+        # Validation
         #---------------------------------------------------------------------------------
 
         performance = self.p['performance']
         terminate   = self.p['terminate']
-        tr_Omega    = None
-        tr_gnorm    = None
+        histories   = {'costs_history': costs_history, 'Omega_history': Omega_history}
+
+        def check(iter, ntrials, inputs, best, history_size, tr_Omega, tr_gnorm,
+                  tr_lambda_Omega, timing):
+            """
+            Evaluate the validation set, update the best network, and save progress.
+
+            """
+            check_timer = Timer()
+
+            # Validation cost
+            with check_timer('f_cost'):
+                costs = self.f_cost(*inputs)
+            z     = costs[-1] # network outputs
+            costs = [float(i) for i in costs[:-1]]
+            s0    = "| validation loss / RMSE"
+            s1    = ": {:.6f} / {:.6f}".format(costs[0], costs[1])
+
+            # Dashes
+            nfill = 70
+
+            # Compute task-specific performance
+            if performance is not None:
+                with check_timer('performance'):
+                    costs.append(performance(validation_data.get_trials(),
+                                             SGD.get_value(z)))
+                s0    += " / performance"
+                s1    += " / {:.2f}".format(costs[-1])
+            s = s0 + s1
+
+            # Callback
+            if self.p['callback'] is not None:
+                with check_timer('callback'):
+                    callback_results = self.p['callback'](
+                        validation_data.get_trials(), SGD.get_value(z)
+                        )
+            else:
+                callback_results = None
+
+            # Keep track of costs
+            entries = [('costs_history', (ntrials, costs))]
+
+            # Record the value of the regularization term in the last iteration
+            if tr_Omega is not None:
+                entries.append(('Omega_history', (ntrials, tr_lambda_Omega*tr_Omega)))
+
+            with check_timer('save'):
+                for name, entry in entries:
+                    history_size = append_history(history_file, name, entry)
+
+            # New best
+            if costs[0] < best['cost']:
+                s += ' ' + '-'*(nfill - len(s))
+                s += " NEW BEST (prev. best: {:.6f})".format(best['cost'])
+                best = {
+                    'iter':        iter,
+                    'cost':        costs[0],
+                    'other_costs': costs[1:],
+                    'params':      SGD.get_values(self.save_values)
+                    }
+            print(s)
+
+            # Spectral radius, starting from the last dominant eigenvector
+            with check_timer('spectral radius'):
+                rho, rho_v0 = RNN.dominant_eigenvector(self.Wrec_.eval(),
+                                                       self.p['rho_tol'],
+                                                       self.p['rho_min_N'],
+                                                       self.rho_v0)
+
+            # Format
+            Omega = ('n/a' if tr_Omega is None
+                     else '{:.8f}'.format(float(tr_Omega)))
+            gnorm = ('n/a' if tr_gnorm is None
+                     else '{:.8f}'.format(float(tr_gnorm)))
+
+            # Info
+            print("| Omega      (last iter) = {}".format(Omega))
+            print("| grad. norm (last iter) = {}".format(gnorm))
+            print("| rho                    = {:.8f}".format(rho))
+            print("| padding  (grad. data)  = {:.2f}%"
+                  .format(100*gradient_data.get_padding()))
+            print("| throughput             = {:.2f} updates/s, {:.1f} trials/s"
+                  .format(timing['updates_per_sec'], timing['trials_per_sec']))
+            sys.stdout.flush()
+
+            # Save progress
+            save = {
+                'params':         {k: v for k, v in self.p.items()
+                                   if k not in save_exclude},
+                'varlist':        self.trainable_names,
+                'iter':           iter,
+                'current':        SGD.get_values(self.trainables),
+                'optimizer':      {i.name: SGD.get_value(i)
+                                   for i in self.optimizer_state},
+                'best':           best,
+                'history_file':   os.path.basename(history_file),
+                'history_size':   history_size,
+                'rng_gradient':   gradient_data.rng,
+                'rng_validation': validation_data.rng,
+                'rng_graph':      rng_graph(),
+                'timing':         timing
+                }
+            with check_timer('save'):
+                dump(savefile, save)
+                netfile.dump(netfile.get_filename(savefile), save)
+
+            return {
+                'costs':            costs,
+                'best':             best,
+                'entries':          entries,
+                'history_size':     history_size,
+                'callback_results': callback_results,
+                'rho_v0':           rho_v0,
+                'timers':           check_timer.totals
+                }
+
+        def merge(result):
+            """
+            Record the results of a check and decide whether to stop training.
+
+            """
+            for name, entry in result['entries']:
+                histories[name].append(entry)
+            costs = result['costs']
+            timer.update(result['timers'])
+
+            # Start the next estimate of the spectral radius from here, also when the
+            # check ran in a child process
+            self.rho_v0 = result['rho_v0']
+
+            stop = False
+            if costs[1] <= self.p['min_error']:
+                print("Reached minimum error of {:.6f}".format(self.p['min_error']))
+                stop = True
+
+            # This termination criterion assumes that performance is not None
+            elif terminate(np.array([c[-1] for _, c in costs_history])):
+                print("Termination criterion satisfied -- we\'ll call it a day.")
+                stop = True
+
+            return (result['best'], result['history_size'], result['callback_results'],
+                    stop)
+
+        # With asynchronous validation, each check runs in a child process while
+        # training continues, and its results are merged at the next check.
+        async_validation = self.p['async_validation']
+        if async_validation and self.uses_gpu():
+            print("[ {}.SGD.train ] Asynchronous validation is not supported on GPUs."
+                  .format(THIS))
+            async_validation = False
+        pending = None
+
+        #---------------------------------------------------------------------------------
+        # Updates
+        #---------------------------------------------------------------------------------
+
+        callback_results = None
+        tr_Omega         = None
+        tr_gnorm         = None
+        tr_lambda_Omega  = None
+        x_last           = None
         try:
-            tstart = datetime.datetime.now()
+            tstart        = datetime.datetime.now()
+            ntrials_start = gradient_data.ntrials
             for iter in xrange(first_iter, 1+self.p['max_iter']):
                 if iter % checkfreq == 1:
+                    #---------------------------------------------------------------------
+                    # Results of the previous check, if it ran in the background
+                    #---------------------------------------------------------------------
+
+                    if pending is not None:
+                        with timer('wait'):
+                            result = pending()
+                        pending = None
+
+                        best, history_size, callback_results, stop = merge(result)
+                        if stop:
+                            break
+
                     #---------------------------------------------------------------------
                     # Timestamp
                     #---------------------------------------------------------------------
@@ -374,98 +963,44 @@ class SGD(object):
                           .format(iter-1, timestamp, hrs, mins, secs))
 
                     #---------------------------------------------------------------------
-                    # Validate
+                    # Throughput in this run
                     #---------------------------------------------------------------------
 
-                    # Validation cost
-                    costs = self.f_cost(*validation_data(best['other_costs']))
-                    z     = costs[-1] # network outputs
-                    costs = [float(i) for i in costs[:-1]]
-                    s0    = "| validation loss / RMSE"
-                    s1    = ": {:.6f} / {:.6f}".format(costs[0], costs[1])
-
-                    # Dashes
-                    nfill = 70
-
-                    # Compute task-specific performance
-                    if performance is not None:
-                        costs.append(performance(validation_data.get_trials(),
-                                                 SGD.get_value(z)))
-                        s0    += " / performance"
-                        s1    += " / {:.2f}".format(costs[-1])
-                    s = s0 + s1
-
-                    # Callback
-                    if self.p['callback'] is not None:
-                        callback_results = self.p['callback'](
-                            validation_data.get_trials(), SGD.get_value(z)
-                            )
-                    else:
-                        callback_results = None
-
-                    # Keep track of costs
-                    costs_history.append((gradient_data.ntrials, costs))
-
-                    # Record the value of the regularization term in the last iteration
-                    if tr_Omega is not None:
-                        Omega_history.append(
-                            (gradient_data.ntrials, lambda_Omega*tr_Omega)
-                            )
-
-                    # New best
-                    if costs[0] < best['cost']:
-                        s += ' ' + '-'*(nfill - len(s))
-                        s += " NEW BEST (prev. best: {:.6f})".format(best['cost'])
-                        best = {
-                            'iter':        iter,
-                            'cost':        costs[0],
-                            'other_costs': costs[1:],
-                            'params':      SGD.get_values(self.save_values)
-                            }
-                    print(s)
-
-                    # Spectral radius
-                    rho = RNN.spectral_radius(self.Wrec_.eval())
-
-                    # Format
-                    Omega = ('n/a' if tr_Omega is None
-                             else '{:.8f}'.format(float(tr_Omega)))
-                    gnorm = ('n/a' if tr_gnorm is None
-                             else '{:.8f}'.format(float(tr_gnorm)))
-
-                    # Info
-                    print("| Omega      (last iter) = {}".format(Omega))
-                    print("| grad. norm (last iter) = {}".format(gnorm))
-                    print("| rho                    = {:.8f}".format(rho))
-                    sys.stdout.flush()
+                    nupdates = iter - first_iter
+                    ntrials  = gradient_data.ntrials - ntrials_start
+                    timing   = {
+                        'iter':            iter,
+                        'elapsed':         totalsecs,
+                        'updates':         nupdates,
+                        'trials':          ntrials,
+                        'updates_per_sec': nupdates/totalsecs if totalsecs > 0 else 0,
+                        'trials_per_sec':  ntrials/totalsecs if totalsecs > 0 else 0,
+                        'phases':          timer.totals.copy()
+                        }
+                    if timing_file is not None:
+                        append_json(timing_file, timing)
 
                     #---------------------------------------------------------------------
-                    # Save progress
+                    # Validate and save progress
                     #---------------------------------------------------------------------
 
-                    save = {
-                        'params':         {k: v for k, v in self.p.items()
-                                           if k not in save_exclude},
-                        'varlist':        self.trainable_names,
-                        'iter':           iter,
-                        'current':        SGD.get_values(self.trainables),
-                        'best':           best,
-                        'costs_history':  costs_history,
-                        'Omega_history':  Omega_history,
-                        'rng_gradient':   gradient_data.rng,
-                        'rng_validation': validation_data.rng
-                        }
-                    dump(savefile, save)
+                    with timer('validation data'):
+                        inputs = validation_data(best['other_costs'])
+                        self.reseed_validation_noise(validation_data)
+                    args = (iter, gradient_data.ntrials, inputs, best, history_size,
+                            tr_Omega, tr_gnorm, tr_lambda_Omega, timing)
 
-                    if costs[1] <= self.p['min_error']:
-                        print("Reached minimum error of {:.6f}"
-                              .format(self.p['min_error']))
-                        break
+                    # Only report Omega computed since this check, so it is no longer
+                    # reported once the term is dropped
+                    tr_Omega        = None
+                    tr_lambda_Omega = None
 
-                    # This termination criterion assumes that performance is not None
-                    if terminate(np.array([c[-1] for _, c in costs_history])):
-                        print("Termination criterion satisfied -- we\'ll call it a day.")
-                        break
+                    if async_validation:
+                        pending = SGD.fork(check, *args)
+                    else:
+                        best, history_size, callback_results, stop = merge(check(*args))
+                        if stop:
+                            break
 
                 if iter - best['iter'] > patience:
                     print("We've run out of patience -- time to give up.")
@@ -475,12 +1010,37 @@ class SGD(object):
                 # Training step
                 #-------------------------------------------------------------------------
 
-                tr_cost, tr_gnorm, tr_Omega, tr_nelems, tr_x = self.train_step(
-                    *(gradient_data(best['other_costs'], callback_results)
-                      + [alpha, lambda_Omega, lr, maxnorm, bound])
-                     )
+                # Some steps may skip the vanishing gradient regularizer
+                lambda_Omega = SGD.get_lambda_Omega(self.p, iter)
+                if lambda_Omega is None:
+                    train_step = self.train_step_plain
+                    args       = [alpha, 0, lr, maxnorm, bound]
+                else:
+                    train_step = self.train_step
+                    args       = [alpha, lambda_Omega, lr, maxnorm, bound]
+
+                with timer('gradient data'):
+                    inputs = gradient_data(best['other_costs'], callback_results)
+                with timer('train_step'):
+                    if self.p['bptt_window'] is None:
+                        result = train_step(*(inputs + args))
+                    else:
+                        # In continuous mode, continue from the previous minibatch
+                        if self.p['mode'] != 'continuous':
+                            x_last = None
+                        result, x_last = self.train_truncated(inputs, args, x_last,
+                                                              train_step)
+                if result is not None:
+                    tr_cost, tr_gnorm, Omega_step, tr_nelems, tr_x = result
+                    if lambda_Omega is not None:
+                        tr_Omega        = Omega_step
+                        tr_lambda_Omega = lambda_Omega
 
                 #-------------------------------------------------------------------------
         except KeyboardInterrupt:
             print("[ {}.SGD.train ] Training interrupted by user during iteration {}."
                   .format(THIS, iter))
+
+        # Let the last check finish saving
+        if pending is not None:
+            pending()
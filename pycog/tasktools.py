@@ -72,6 +72,137 @@ def truncated_normal(rng, dt, mean, sigma, xmin=-np.inf, xmax=np.inf):
         if xmin <= x < xmax:
             return (x//dt)*dt
 
+#-----------------------------------------------------------------------------------------
+# Functions for generating batches of trials
+#-----------------------------------------------------------------------------------------
+#
+# A task can define
+#
+#   generate_batch(rng, dt, params, B)
+#
+# in addition to `generate_trial`, returning a dictionary with
+#
+#   inputs  : (T, B, Nin) array of inputs, padded to the longest trial
+#   outputs : (T, B, Nout) array of target outputs
+#   mask    : (T, B, Nout) array, optional
+#   trials  : list of B dictionaries with the `t`, `epochs`, and `info` of each trial
+#
+# Trial b of the batch corresponds to `params['minibatch_index'] = b` in
+# `generate_trial`. Datasets use `generate_batch` when it is available.
+#
+# If, apart from noise, every trial is one of a fixed set of conditions, a task can
+# instead declare its condition space with
+#
+#   conditions : list of conditions, e.g., (coherence, direction) pairs
+#   sample_conditions(rng, params, B) : indices into `conditions` for B trials
+#
+# and have `generate_trial` return the trial for `params['condition']` when it is
+# given. Datasets then generate each condition once, store the padded inputs and
+# targets, and build each batch by gathering the stored conditions and adding noise.
+# The stored trials are regenerated when `params['callback_results']` changes.
+#
+
+def uniform_batch(rng, dt, xmin, xmax, B):
+    return (rng.uniform(xmin, xmax, size=B)//dt)*dt
+
+def truncated_exponential_batch(rng, dt, mean, B, xmin=0, xmax=np.inf):
+    x   = np.empty(B)
+    bad = np.arange(B)
+    while len(bad) > 0:
+        x[bad] = rng.exponential(mean, size=len(bad))
+        bad    = bad[(x[bad] < xmin) | (x[bad] >= xmax)]
+
+    return (x//dt)*dt
+
+def get_epochs_mask(dt, T, epochs):
+    """
+    Batch version of `get_epochs_idx`.
+
+    Parameters
+    ----------
+
+    dt : float
+         Time step.
+
+    T : numpy.ndarray
+        Duration of each trial.
+
+    epochs : dict
+             `(start, end)` of each epoch, where `start` and `end` are numbers or
+             arrays with one element per trial. Use `start = end` for trials that
+             don't contain the epoch.
+
+    Returns
+    -------
+
+    t : numpy.ndarray
+        Time points of the longest trial.
+
+    lengths : numpy.ndarray
+              Number of time points in each trial.
+
+    e : dict
+        Boolean array of shape `(len(t), len(T))` for each epoch.
+
+    """
+    lengths = (np.asarray(T)/dt).astype(int)
+    t       = dt*np.arange(1, np.max(lengths)+1)
+
+    tt = t[:,np.newaxis]
+    on = np.ones(len(lengths), dtype=bool)
+    e  = {k: (start < tt) & (tt <= end) & on for k, (start, end) in epochs.items()}
+
+    return t, lengths, e
+
+def split_trials(t, lengths, T, epochs, infos, catch):
+    """
+    Trial dictionaries (without inputs and outputs) for a batch. As in the trials
+    returned by `generate_trial`, the epochs of catch trials only contain `T`.
+
+    """
+    B      = len(lengths)
+    epochs = {k: (np.broadcast_to(start, (B,)), np.broadcast_to(end, (B,)))
+              for k, (start, end) in epochs.items()}
+
+    trials = []
+    for b in xrange(B):
+        epochs_b = {'T': np.asarray(T)[b].item()}
+        if not catch[b]:
+            for k, (start, end) in epochs.items():
+                epochs_b[k] = (start[b].item(), end[b].item())
+        trials.append({'t': t[:lengths[b]], 'epochs': epochs_b, 'info': infos[b]})
+
+    return trials
+
+def targets_2afc(lengths, e, choice, catch, hi=1, lo=0.2):
+    """
+    Target outputs and mask for a batch of two-alternative forced choice trials:
+    both outputs are low during fixation, and during the decision period the output
+    for the correct choice is high. Catch trials are low throughout.
+
+    """
+    T, B = e['fixation'].shape
+    Y = np.zeros((T, B, 2))
+    M = np.zeros_like(Y)
+
+    # Fixation
+    Y[e['fixation']] = lo
+
+    # Decision
+    rows, cols = np.nonzero(e['decision'])
+    Y[rows,cols]              = lo
+    Y[rows,cols,choice[cols]] = hi
+
+    # Only care about fixation and decision periods
+    M[e['fixation'] | e['decision']] = 1
+
+    # Catch trials
+    catch_idx = (np.arange(T)[:,np.newaxis] < lengths) & catch
+    Y[catch_idx] = lo
+    M[catch_idx] = 1
+
+    return Y, M
+
 #-----------------------------------------------------------------------------------------
 # Functions for generating orientation tuning curves
 #-----------------------------------------------------------------------------------------
@@ -11,17 +11,25 @@ from   collections import OrderedDict
 
 import numpy as np
 
-import theano
-import theano.tensor as T
+# Not needed by the NumPy backend
+try:
+    import theano
+    import theano.tensor as T
+    from   theano.sandbox.rng_mrg import MRG_RandomStreams
+except ImportError:
+    theano = None
 
-from .             import theanotools
 from .connectivity import Connectivity
 from .dataset      import Dataset
 from .defaults     import defaults
+from .numpysgd     import NumpySGD
 from .rnn          import RNN
 from .sgd          import SGD
 from .utils        import print_settings
 
+if theano is not None:
+    from . import theanotools
+
 THIS = 'pycog.trainer'
 
 class Trainer(object):
@@ -29,7 +37,7 @@ class Trainer(object):
     Train an RNN.
 
     """
-    def __init__(self, params, floatX=theano.config.floatX):
+    def __init__(self, params, floatX=None):
         """
         Initialize.
 
@@ -102,14 +110,101 @@ class Trainer(object):
           n_validation : int, optional
                          Minibatch size for validation dataset.
 
+          bptt_window : int, optional
+                        If given, use truncated backpropagation through time: each
+                        gradient minibatch is split into windows of `bptt_window`
+                        time steps, with a training step for each window that
+                        starts from the state where the previous window ended.
+                        Windows without any unmasked time steps are only run
+                        forward. In `continuous` mode the state is also carried
+                        from one minibatch to the next, and `n_gradient` can be
+                        larger than 1.
+
+          scan_checkpoint : int, optional
+                            If given, only store the state every `scan_checkpoint`
+                            time steps during the forward pass and recompute the
+                            steps in between during the backward pass, which uses
+                            far less memory at the cost of extra computation. The
+                            vanishing gradient regularizer needs all states, so
+                            `lambda_Omega` is set to 0. Not used by the `numpy`
+                            backend.
+
           gradient_batch_size, validation_batch_size : int, optional
                                                        Number of trials to precompute
                                                        and store in each dataset. Make
                                                        sure the batch sizes are larger
                                                        than the minibatch sizes.
 
+          prefetch : bool, optional
+                     Generate the next batch of gradient trials in the background
+                     while the current batch is used for training.
+
+          bucket : bool, optional
+                   Group gradient trials of similar duration into the same minibatch
+                   and cut each minibatch after its longest trial. Only has an effect
+                   if `gradient_batch_size` is larger than `n_gradient`. The loss is
+                   unchanged, but `lambda2_r` and `lambda_Omega` terms are averaged
+                   over fewer padded time steps.
+
+          backend : str, optional
+                    `theano`, or `numpy` to train with backpropagation through time
+                    written in NumPy (see `pycog.numpysgd`), which needs no
+                    compilation but is slower for large networks.
+
+          graph_noise : bool, optional
+                        Generate the input and recurrent noise in the Theano graph
+                        instead of storing it in the datasets, which then only hold
+                        the `Nin` input channels. The validation cost has its own
+                        random stream, which is reseeded from `validation_seed` and
+                        the number of times the validation set has drawn noise, so
+                        `fixed_validation` and `validation_refresh` apply as for
+                        noise in the datasets. The state of the training stream is
+                        saved in checkpoints.
+
+          fixed_validation : bool, optional
+                             Generate the validation trials once and reuse them at
+                             every check instead of generating new ones.
+
+          validation_refresh : int, optional
+                               With `fixed_validation`, draw new noise for the
+                               validation trials every `validation_refresh` checks.
+                               If `None`, the noise is fixed too.
+
+          async_validation : bool, optional
+                             Evaluate the validation set and save progress in a child
+                             process working on a snapshot of the weights, while
+                             training continues. The results, including the
+                             termination criteria, are applied at the next check.
+                             Not available on GPUs.
+
+          timing_log : bool, optional
+                       Time spent in each phase of training (generating trials,
+                       training steps, validation, performance and callback
+                       functions, spectral radius, saving), with updates/sec and
+                       trials/sec, is always stored in the checkpoint as `timing`.
+                       If `True`, it is also appended at every check to a JSON-lines
+                       log next to the savefile (see
+                       `pycog.utils.get_timing_filename`). Phases of a check are
+                       counted at the next check.
+
           lambda_Omega : float, optinonal
-                         Multiplier for the vanishing gradient regularizer.
+                         Multiplier for the vanishing gradient regularizer. If 0, the
+                         regularizer is not computed and reported as `n/a`.
+
+          Omega_every : int, optional
+                        Only include the vanishing gradient regularizer in every
+                        `Omega_every`-th training step. The other steps use a
+                        separately compiled function without it, which costs about
+                        as much as plain backpropagation through time.
+
+          Omega_anneal : int, optional
+                         Decrease `lambda_Omega` linearly to 0 over the first
+                         `Omega_anneal` updates, after which the regularizer is
+                         dropped.
+
+          Omega_subsample : int, optional
+                            Only compute the vanishing gradient regularizer for every
+                            `Omega_subsample`-th time step.
 
           lambda1_in, lambda1_rec, lambda1_out : float, optional
                                                  Multipliers for L1 weight regularization.
@@ -135,6 +230,24 @@ class Trainer(object):
           learning_rate : float, optional
                           Learning rate for gradient descent.
 
+          method : str, optional
+                   `sgd`, `rmsprop`, or `adam`. The optimizer is applied to the
+                   clipped gradient, and its state is saved in checkpoints. Adam
+                   usually needs a smaller `learning_rate` than `sgd`.
+
+          momentum : float, optional
+                     Momentum coefficient for `sgd` and `rmsprop`, or `False` for none.
+
+          decay : float, optional
+                  Decay rate of RMSprop's running average of squared gradients.
+
+          beta1, beta2 : float, optional
+                         Decay rates of Adam's running averages of gradients and
+                         squared gradients.
+
+          epsilon : float, optional
+                    Added to the root mean square gradient in `rmsprop` and `adam`.
+
           max_gradient_norm : float, optional
                               Clip gradient if its norm is greater than.
 
@@ -161,6 +274,11 @@ class Trainer(object):
           rho0 : float, optional
                  Spectral radius for the initial recurrent weight matrix.
 
+          rho_tol, rho_min_N : float, int, optional
+                               Spectral radii of recurrent weight matrices with at
+                               least `rho_min_N` units are estimated iteratively with
+                               relative tolerance `rho_tol`.
+
           max_iter : int, optional
                      Maximum number of iterations for gradient descent.
 
@@ -186,15 +304,17 @@ class Trainer(object):
                      Terminate training if the objective function doesn't change
                      for longer than `patience`.
 
-          Not used currently
-          ------------------
-
-          momentum, method
-
         floatX : str, optional
-                 Floating-point type.
+                 Floating-point type. Default is Theano's `floatX`, or `float32`
+                 without Theano.
 
         """
+        if floatX is None:
+            if theano is not None:
+                floatX = theano.config.floatX
+            else:
+                floatX = 'float32'
+
         self.p      = params.copy()
         self.floatX = floatX
 
@@ -329,124 +449,95 @@ class Trainer(object):
 
         return W.reshape((m, n))
 
-    def train(self, savefile, task, recover=True):
+    def graph_noise(self, u, srng):
         """
-        Train the RNN.
+        Add noise to the inputs and generate the recurrent noise in the graph, with the
+        same distributions as in `pycog.Dataset`.
 
         Parameters
         ----------
 
-        savefile : str
+        u : theano.tensor.tensor3
+            Inputs without baseline and noise.
 
-        task : function
+        srng : theano.sandbox.rng_mrg.MRG_RandomStreams
+               Random stream to draw the noise from.
 
-        recover : bool, optional
-                  If `True`, will attempt to recover from a previously saved run.
-
-        """
-        N     = self.p['N']
-        Nin   = self.p['Nin']
-        Nout  = self.p['Nout']
-        alpha = self.p['dt']/self.p['tau']
+        Returns
+        -------
 
-        # Initialize settings
-        settings = OrderedDict()
+        u_in : theano.tensor.tensor3
+               Inputs with baseline and noise.
 
-        # Check if file already exists
-        if not recover:
-            if os.path.isfile(savefile):
-                os.remove(savefile)
+        noise_rec : theano.tensor.tensor3
+                    Recurrent noise.
 
-        #---------------------------------------------------------------------------------
-        # Are we using GPUs?
-        #---------------------------------------------------------------------------------
-
-        if theanotools.get_processor_type() == 'gpu':
-            settings['GPU'] = 'enabled'
-        else:
-            settings['GPU'] = 'no'
-
-        #---------------------------------------------------------------------------------
-        # Random number generator
-        #---------------------------------------------------------------------------------
+        """
+        Nin = self.p['Nin']
+        N   = self.p['N']
 
-        settings['init seed'] = self.p['seed']
-        rng = np.random.RandomState(self.p['seed'])
+        def noise(var, shape):
+            L = Dataset.get_noise_factor(var)
+            if L is None:
+                # Independent noise
+                sigma = np.asarray(np.sqrt(var), dtype=self.floatX)
+                return srng.normal(shape, dtype=self.floatX)*sigma
 
-        #---------------------------------------------------------------------------------
-        # Weight initialization
-        #---------------------------------------------------------------------------------
+            # Correlated noise
+            L = np.asarray(L, dtype=self.floatX)
+            return T.dot(srng.normal(shape, dtype=self.floatX), L.T)
 
-        settings['distribution (Win)']  = self.p['distribution_in']
-        settings['distribution (Wrec)'] = self.p['distribution_rec']
-        settings['distribution (Wout)'] = self.p['distribution_out']
+        # Rescale noise
+        var_in  = 2*self.p['tau_in']/self.p['dt']*self.p['var_in']
+        var_rec = 2/self.p['dt']*self.p['var_rec']
 
+        # Input noise
+        u_in = u
         if Nin > 0:
-            Win_0 = self.init_weights(rng, self.p['Cin'], N, Nin,
-                                      self.p['distribution_in'])
-        Wrec_0 = self.init_weights(rng, self.p['Crec'],
-                                   N, N, self.p['distribution_rec'])
-        Wout_0 = self.init_weights(rng, self.p['Cout'],
-                                   Nout, N, self.p['distribution_out'])
+            u_in = u + self.p['baseline_in']
+            if np.any(np.asarray(var_in) > 0):
+                u_in = u_in + noise(var_in, (u.shape[0], u.shape[1], Nin))
+            if self.p['rectify_inputs']:
+                u_in = theanotools.rectify(u_in)
 
-        #---------------------------------------------------------------------------------
-        # Enforce Dale's law on the initial weights
-        #---------------------------------------------------------------------------------
+        # Recurrent noise
+        shape = (u.shape[0], u.shape[1], N)
+        if np.any(np.asarray(var_rec) > 0):
+            tau       = np.asarray(self.p['tau'], dtype=self.floatX)
+            noise_rec = noise(var_rec, shape)*np.sqrt(tau)
+        else:
+            noise_rec = T.zeros(shape, dtype=self.floatX)
 
-        settings['Nin/N/Nout'] = '{}/{}/{}'.format(Nin, N, Nout)
+        return u_in, noise_rec
 
-        if self.p['ei'] is not None:
-            Nexc = len(np.where(self.p['ei'] > 0)[0])
-            Ninh = len(np.where(self.p['ei'] < 0)[0])
-            settings['Dale\'s law'] = 'E/I = {}/{}'.format(Nexc, Ninh)
+    def build_theano(self, init, settings):
+        """
+        Build the Theano graph for the network, the loss, and the regularization
+        terms.
 
-            if Nin > 0:
-                Win_0 = abs(Win_0) # If Dale, assume inputs are excitatory
-            Wrec_0 = abs(Wrec_0)
-            Wout_0 = abs(Wout_0)
-        else:
-            settings['Dale\'s law'] = 'no'
+        Parameters
+        ----------
 
-        #---------------------------------------------------------------------------------
-        # Fix spectral radius
-        #---------------------------------------------------------------------------------
+        init : list
+               Initial values of `Win`, `Wrec`, `Wout`, `brec`, `bout`, and `x0`.
 
-        # Compute spectral radius
-        C = self.p['Crec']
-        if C is not None:
-            Wrec_0_full = C.mask_plastic*Wrec_0 + C.mask_fixed
-        else:
-            Wrec_0_full = Wrec_0
-        if self.p['ei'] is not None:
-            Wrec_0_full = Wrec_0_full*self.p['ei']
-        rho = RNN.spectral_radius(Wrec_0_full)
+        settings : OrderedDict
+                   Settings to report.
 
-        # Scale Wrec to have fixed spectral radius
-        if self.p['ei'] is not None:
-            R = self.p['rho0']/rho
-        else:
-            R = 1.1/rho
-        Wrec_0 *= R
-        if C is not None:
-            C.mask_fixed *= R
+        Returns
+        -------
 
-        # Check spectral radius
-        if C is not None:
-            Wrec_0_full = C.mask_plastic*Wrec_0 + C.mask_fixed
-        else:
-            Wrec_0_full = Wrec_0
-        if self.p['ei'] is not None:
-            Wrec_0_full = Wrec_0_full*self.p['ei']
-        rho = RNN.spectral_radius(Wrec_0_full)
-        settings['initial spectral radius'] = '{:.2f}'.format(rho)
+        make_sgd : function
+                   Compiles the training functions and returns the `pycog.SGD`
+                   instance.
 
-        #---------------------------------------------------------------------------------
-        # Others
-        #---------------------------------------------------------------------------------
+        """
+        N     = self.p['N']
+        Nin   = self.p['Nin']
+        Nout  = self.p['Nout']
+        alpha = self.p['dt']/self.p['tau']
 
-        brec_0 = self.p['brec']*np.ones(N)
-        bout_0 = self.p['bout']*np.ones(Nout)
-        x0_0   = self.p['x0']*np.ones(N)
+        Win_0, Wrec_0, Wout_0, brec_0, bout_0, x0_0 = init
 
         #---------------------------------------------------------------------------------
         # RNN parameters
@@ -604,31 +695,51 @@ class Trainer(object):
         # Dims: time, trials, units
         # u[:,:,:Nin]  contains the inputs (including baseline and noise),
         # u[:,:,Nin:]  contains the recurrent noise
+        # unless the noise is generated in the graph, in which case u only contains
+        # the inputs without baseline and noise.
         u   = T.tensor3('u')
         x0_ = T.alloc(x0, u.shape[1], x0.shape[0])
 
-        if Nin > 0:
-            def rnn(u_t, x_tm1, r_tm1, WinT, WrecT):
-                x_t = ((1 - alpha)*x_tm1
-                       + alpha*(T.dot(r_tm1, WrecT)        # Recurrent
-                                + brec                     # Bias
-                                + T.dot(u_t[:,:Nin], WinT) # Input
-                                + u_t[:,Nin:])             # Recurrent noise
-                       )
-                r_t = f_hidden(x_t)
+        # With truncated backpropagation through time, start from `x_init` when
+        # `carry` is 1 and from the initial conditions when it is 0
+        if self.p['bptt_window'] is not None:
+            settings['truncated BPTT'] = '{} steps'.format(self.p['bptt_window'])
+            x_init = T.matrix('x_init')
+            carry  = T.scalar('carry')
+            x0_    = carry*x_init + (1 - carry)*x0_
+            truncation = {'x_init': x_init, 'carry': carry}
+        else:
+            truncation = {}
+
+        if self.p['graph_noise']:
+            settings['noise'] = 'generated in graph'
+            srng = MRG_RandomStreams(seed=self.p['gradient_seed'])
+            u_in, noise_rec = self.graph_noise(u, srng)
+
+            # The validation cost draws its noise from its own stream, so that the
+            # noise can be kept fixed between checks (see `SGD.train`)
+            srng_validation = MRG_RandomStreams(seed=self.p['validation_seed'])
+            u_val, noise_val = self.graph_noise(u, srng_validation)
+            noise = {'srng':             srng,
+                     'srng_validation':  srng_validation,
+                     'validation_noise': [(v, v_val) for v, v_val
+                                          in [(u_in, u_val), (noise_rec, noise_val)]
+                                          if v is not v_val]}
+        else:
+            u_in, noise_rec = u[:,:,:Nin], u[:,:,Nin:]
+            noise = {}
 
-                return [x_t, r_t]
+        if self.p['scan_checkpoint'] is None:
+            # External drive for all time points and trials, computed as one large
+            # product outside of the recurrence
+            I = brec + noise_rec               # Bias + recurrent noise
+            if Nin > 0:
+                I = I + T.dot(u_in, Win_.T)    # Input
 
-            [x, r], _ = theano.scan(fn=rnn,
-                                    outputs_info=[x0_, f_hidden(x0_)],
-                                    sequences=u,
-                                    non_sequences=[Win_.T, Wrec_.T])
-        else:
-            def rnn(u_t, x_tm1, r_tm1, WrecT):
+            def rnn(I_t, x_tm1, r_tm1, WrecT):
                 x_t = ((1 - alpha)*x_tm1
                        + alpha*(T.dot(r_tm1, WrecT) # Recurrent
-                                + brec              # Bias
-                                + u_t[:,Nin:]) # Recurrent noise
+                                + I_t)              # External drive
                        )
                 r_t = f_hidden(x_t)
 
@@ -636,9 +747,69 @@ class Trainer(object):
 
             [x, r], _ = theano.scan(fn=rnn,
                                     outputs_info=[x0_, f_hidden(x0_)],
-                                    sequences=u,
+                                    sequences=I,
                                     non_sequences=[Wrec_.T])
 
+            # Output before the activation function, mean squared rate
+            a  = T.dot(r, Wout_.T) + bout
+            r2 = T.mean(r**2)
+        else:
+            # Gradient checkpointing: an outer scan over segments of k time steps
+            # only stores the state at the end of each segment, and the inner scan
+            # that runs a segment is recomputed in the backward pass. Only the
+            # outputs and squared rates are kept for every time step.
+            k = self.p['scan_checkpoint']
+            settings['scan checkpoints'] = 'every {} steps'.format(k)
+
+            if self.p['lambda_Omega'] > 0:
+                print("[ Trainer.train ] Omega needs the states at every time step,"
+                      " so we're setting lambda_Omega to 0.")
+                self.p['lambda_Omega'] = 0
+
+            # Pad to whole segments with steps that leave the state unchanged
+            nt    = u.shape[0]
+            nseg  = (nt + k - 1)//k
+            npad  = nseg*k - nt
+            valid = T.concatenate([T.ones((nt,), dtype=self.floatX),
+                                   T.zeros((npad,), dtype=self.floatX)])
+
+            def segments(v):
+                pad = T.zeros((npad, v.shape[1], v.shape[2]), dtype=v.dtype)
+                v   = T.concatenate([v, pad])
+                return v.reshape((nseg, k, v.shape[1], v.shape[2]))
+
+            def rnn(valid_t, u_t, noise_t, x_tm1, r_tm1, WrecT):
+                I_t = brec + noise_t
+                if Nin > 0:
+                    I_t = I_t + T.dot(u_t, Win_.T)
+                x_t = T.switch(valid_t,
+                               (1 - alpha)*x_tm1 + alpha*(T.dot(r_tm1, WrecT) + I_t),
+                               x_tm1)
+                r_t = f_hidden(x_t)
+
+                return [x_t, r_t, T.dot(r_t, Wout_.T) + bout, (r_t**2).sum(axis=1)]
+
+            def rnn_segment(valid_s, u_s, noise_s, x_tm1, r_tm1, WrecT):
+                [x_s, r_s, a_s, r2_s], _ = theano.scan(
+                    fn=rnn,
+                    outputs_info=[x_tm1, r_tm1, None, None],
+                    sequences=[valid_s, u_s, noise_s],
+                    non_sequences=[WrecT]
+                    )
+
+                return [x_s[-1], r_s[-1], a_s, r2_s]
+
+            # `x` only contains the state at the end of each segment
+            [x, _, a, r2], _ = theano.scan(fn=rnn_segment,
+                                           outputs_info=[x0_, f_hidden(x0_), None, None],
+                                           sequences=[valid.reshape((nseg, k)),
+                                                      segments(u_in),
+                                                      segments(noise_rec)],
+                                           non_sequences=[Wrec_.T])
+            a  = a.reshape((nseg*k, a.shape[2], a.shape[3]))[:nt]
+            r2 = r2.reshape((nseg*k, r2.shape[2]))[:nt]
+            r2 = r2.sum()/T.cast(nt*r2.shape[1]*N, self.floatX)
+
         #---------------------------------------------------------------------------------
         # Running mode
         #---------------------------------------------------------------------------------
@@ -646,7 +817,7 @@ class Trainer(object):
         if self.p['mode'] == 'continuous':
             settings['mode'] = 'continuous'
 
-            if self.p['n_gradient'] != 1:
+            if self.p['n_gradient'] != 1 and self.p['bptt_window'] is None:
                 print("[ Trainer.train ] In continuous mode,"
                       " so we're setting n_gradient to 1.")
                 self.p['n_gradient'] = 1
@@ -659,18 +830,7 @@ class Trainer(object):
         # Readout
         #---------------------------------------------------------------------------------
 
-        z = f_output(T.dot(r, Wout_.T) + bout)
-
-        #---------------------------------------------------------------------------------
-        # Deduce whether the task specification contains an output mask -- use a
-        # temporary dataset so it doesn't affect the training.
-        #---------------------------------------------------------------------------------
-
-        dataset = Dataset(1, task, self.floatX, self.p, name='gradient')
-        if dataset.has_output_mask():
-            settings['output mask'] = 'yes'
-        else:
-            settings['output mask'] = 'no'
+        z = f_output(a)
 
         #---------------------------------------------------------------------------------
         # Loss
@@ -752,7 +912,7 @@ class Trainer(object):
         lambda2 = self.p['lambda2_r']
         if lambda2 > 0:
             settings['L2 rate regularization'] = 'lambda2_r = {}'.format(lambda2)
-            regs += lambda2 * T.mean(r**2)
+            regs += lambda2 * r2
 
         #---------------------------------------------------------------------------------
         # Final costs
@@ -760,6 +920,174 @@ class Trainer(object):
 
         costs = [loss, error]
 
+        #---------------------------------------------------------------------------------
+        # A few important Theano settings
+        #---------------------------------------------------------------------------------
+
+        settings['(Theano) floatX']   = self.floatX
+        settings['(Theano) allow_gc'] = theano.config.allow_gc
+
+        #---------------------------------------------------------------------------------
+
+        def make_sgd():
+            extras = dict(truncation, Wrec_=Wrec_, d_f_hidden=d_f_hidden)
+            extras.update(noise)
+            return SGD(trainables, inputs, costs, regs, x, z, self.p, save_values,
+                       extras)
+
+        return make_sgd
+
+    def train(self, savefile, task, recover=True):
+        """
+        Train the RNN.
+
+        Parameters
+        ----------
+
+        savefile : str
+
+        task : function
+
+        recover : bool, optional
+                  If `True`, will attempt to recover from a previously saved run.
+
+        """
+        N    = self.p['N']
+        Nin  = self.p['Nin']
+        Nout = self.p['Nout']
+
+        if self.p['backend'] == 'theano' and theano is None:
+            raise ImportError("[ {}.Trainer.train ] The Theano backend requires Theano."
+                              .format(THIS))
+
+        # Initialize settings
+        settings = OrderedDict()
+
+        # Check if file already exists
+        if not recover:
+            if os.path.isfile(savefile):
+                os.remove(savefile)
+
+        #---------------------------------------------------------------------------------
+        # Are we using GPUs?
+        #---------------------------------------------------------------------------------
+
+        if self.p['backend'] == 'numpy':
+            settings['backend'] = 'NumPy'
+            settings['GPU']     = 'no'
+        elif theanotools.get_processor_type() == 'gpu':
+            settings['GPU'] = 'enabled'
+        else:
+            settings['GPU'] = 'no'
+
+        #---------------------------------------------------------------------------------
+        # Random number generator
+        #---------------------------------------------------------------------------------
+
+        settings['init seed'] = self.p['seed']
+        rng = np.random.RandomState(self.p['seed'])
+
+        #---------------------------------------------------------------------------------
+        # Weight initialization
+        #---------------------------------------------------------------------------------
+
+        settings['distribution (Win)']  = self.p['distribution_in']
+        settings['distribution (Wrec)'] = self.p['distribution_rec']
+        settings['distribution (Wout)'] = self.p['distribution_out']
+
+        if Nin > 0:
+            Win_0 = self.init_weights(rng, self.p['Cin'], N, Nin,
+                                      self.p['distribution_in'])
+        Wrec_0 = self.init_weights(rng, self.p['Crec'],
+                                   N, N, self.p['distribution_rec'])
+        Wout_0 = self.init_weights(rng, self.p['Cout'],
+                                   Nout, N, self.p['distribution_out'])
+
+        #---------------------------------------------------------------------------------
+        # Enforce Dale's law on the initial weights
+        #---------------------------------------------------------------------------------
+
+        settings['Nin/N/Nout'] = '{}/{}/{}'.format(Nin, N, Nout)
+
+        if self.p['ei'] is not None:
+            Nexc = len(np.where(self.p['ei'] > 0)[0])
+            Ninh = len(np.where(self.p['ei'] < 0)[0])
+            settings['Dale\'s law'] = 'E/I = {}/{}'.format(Nexc, Ninh)
+
+            if Nin > 0:
+                Win_0 = abs(Win_0) # If Dale, assume inputs are excitatory
+            Wrec_0 = abs(Wrec_0)
+            Wout_0 = abs(Wout_0)
+        else:
+            settings['Dale\'s law'] = 'no'
+
+        #---------------------------------------------------------------------------------
+        # Fix spectral radius
+        #---------------------------------------------------------------------------------
+
+        # Compute spectral radius
+        C = self.p['Crec']
+        if C is not None:
+            Wrec_0_full = C.mask_plastic*Wrec_0 + C.mask_fixed
+        else:
+            Wrec_0_full = Wrec_0
+        if self.p['ei'] is not None:
+            Wrec_0_full = Wrec_0_full*self.p['ei']
+        rho = RNN.spectral_radius(Wrec_0_full, self.p['rho_tol'], self.p['rho_min_N'])
+
+        # Scale Wrec to have fixed spectral radius
+        if self.p['ei'] is not None:
+            R = self.p['rho0']/rho
+        else:
+            R = 1.1/rho
+        Wrec_0 *= R
+        if C is not None:
+            C.mask_fixed *= R
+
+        # Check spectral radius
+        if C is not None:
+            Wrec_0_full = C.mask_plastic*Wrec_0 + C.mask_fixed
+        else:
+            Wrec_0_full = Wrec_0
+        if self.p['ei'] is not None:
+            Wrec_0_full = Wrec_0_full*self.p['ei']
+        rho = RNN.spectral_radius(Wrec_0_full, self.p['rho_tol'], self.p['rho_min_N'])
+        settings['initial spectral radius'] = '{:.2f}'.format(rho)
+
+        #---------------------------------------------------------------------------------
+        # Others
+        #---------------------------------------------------------------------------------
+
+        brec_0 = self.p['brec']*np.ones(N)
+        bout_0 = self.p['bout']*np.ones(Nout)
+        x0_0   = self.p['x0']*np.ones(N)
+
+        #---------------------------------------------------------------------------------
+        # Network and training functions
+        #---------------------------------------------------------------------------------
+
+        if Nin > 0:
+            init = [Win_0, Wrec_0, Wout_0, brec_0, bout_0, x0_0]
+        else:
+            init = [None, Wrec_0, Wout_0, brec_0, bout_0, x0_0]
+
+        if self.p['backend'] == 'numpy':
+            make_sgd = NumpySGD.build(self.p, init, settings, self.floatX)
+        else:
+            make_sgd = self.build_theano(init, settings)
+
+        #---------------------------------------------------------------------------------
+        # Deduce whether the task specification contains an output mask -- use a
+        # temporary dataset so it doesn't affect the training.
+        #---------------------------------------------------------------------------------
+
+        dataset = Dataset(1, task, self.floatX, self.p, name='gradient',
+                          graph_noise=self.p['graph_noise'])
+        if dataset.has_output_mask():
+            settings['output mask'] = 'yes'
+        else:
+            settings['output mask'] = 'no'
+
         #---------------------------------------------------------------------------------
         # Datasets
         #---------------------------------------------------------------------------------
@@ -767,11 +1095,17 @@ class Trainer(object):
         gradient_data   = Dataset(self.p['n_gradient'], task, self.floatX, self.p,
                                   batch_size=self.p['gradient_batch_size'],
                                   seed=self.p['gradient_seed'],
-                                  name='gradient')
+                                  name='gradient',
+                                  prefetch=self.p['prefetch'],
+                                  bucket=self.p['bucket'],
+                                  graph_noise=self.p['graph_noise'])
         validation_data = Dataset(self.p['n_validation'], task, self.floatX, self.p,
                                   batch_size=self.p['validation_batch_size'],
                                   seed=self.p['validation_seed'],
-                                  name='validation')
+                                  name='validation',
+                                  fixed=self.p['fixed_validation'],
+                                  refresh=self.p['validation_refresh'],
+                                  graph_noise=self.p['graph_noise'])
 
         # Input noise
         if np.isscalar(self.p['var_in']):
@@ -790,6 +1124,11 @@ class Trainer(object):
         settings['rectify inputs']            = self.p['rectify_inputs']
         settings['gradient minibatch size']   = gradient_data.minibatch_size
         settings['validation minibatch size'] = validation_data.minibatch_size
+        settings['bucket by duration']        = self.p['bucket']
+        settings['fixed validation set']      = self.p['fixed_validation']
+        if self.p['fixed_validation'] and self.p['validation_refresh']:
+            settings['validation noise refresh'] = ('every {} checks'
+                                                    .format(self.p['validation_refresh']))
 
         #---------------------------------------------------------------------------------
         # Other settings
@@ -802,22 +1141,23 @@ class Trainer(object):
             settings['tau'] = 'custom'
         settings['tau_in']            = '{} ms'.format(self.p['tau_in'])
         settings['learning rate']     = '{}'.format(self.p['learning_rate'])
+        settings['optimizer']         = SGD.describe_method(self.p)
         settings['lambda_Omega']      = '{}'.format(self.p['lambda_Omega'])
+        if self.p['Omega_every'] > 1:
+            settings['Omega every']       = '{} updates'.format(self.p['Omega_every'])
+        if self.p['Omega_anneal'] is not None:
+            settings['Omega annealed']    = ('to 0 over {} updates'
+                                             .format(self.p['Omega_anneal']))
+        if self.p['Omega_subsample'] is not None:
+            settings['Omega subsampling'] = ('every {} time steps'
+                                             .format(self.p['Omega_subsample']))
         settings['max gradient norm'] = '{}'.format(self.p['max_gradient_norm'])
 
-        #---------------------------------------------------------------------------------
-        # A few important Theano settings
-        #---------------------------------------------------------------------------------
-
-        settings['(Theano) floatX']   = self.floatX
-        settings['(Theano) allow_gc'] = theano.config.allow_gc
-
         #---------------------------------------------------------------------------------
         # Train!
         #---------------------------------------------------------------------------------
 
         print_settings(settings)
 
-        sgd = SGD(trainables, inputs, costs, regs, x, z, self.p, save_values,
-                  {'Wrec_': Wrec_, 'd_f_hidden': d_f_hidden})
+        sgd = make_sgd()
         sgd.train(gradient_data, validation_data, savefile)
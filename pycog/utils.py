@@ -4,9 +4,18 @@ Useful functions.
 """
 import cPickle as pickle
 import errno
+import hashlib
+import io
+import json
+import numbers
 import os
 import signal
 import sys
+import time
+from   collections import OrderedDict
+from   contextlib  import contextmanager
+
+import numpy as np
 
 def println(line):
     sys.stdout.write(line)
@@ -42,12 +51,190 @@ def mkdir_p(path):
         else:
             raise
 
-def dump(filename, obj):
+def noise_factor(C):
+    """
+    Factor a covariance matrix as C = L L^T so that correlated noise can be drawn as
+    `standard_normal(size=(..., n)).dot(L.T)` without decomposing C every time.
+
+    Uses the Cholesky decomposition, falling back to an eigendecomposition if C is
+    only positive semidefinite.
+
+    """
+    C = np.asarray(C)
+    try:
+        return np.linalg.cholesky(C)
+    except np.linalg.LinAlgError:
+        w, V = np.linalg.eigh(C)
+        return V*np.sqrt(np.maximum(w, 0))
+
+# Parameters that determine the structure of the training graph
+graph_params = ['Nin', 'N', 'Nout', 'dt', 'tau', 'tau_in', 'Cin', 'Crec', 'Cout', 'ei',
+                'ei_positive_func', 'hidden_activation', 'output_activation', 'mode',
+                'train_brec', 'train_bout', 'train_x0', 'lambda1_in', 'lambda1_rec',
+                'lambda1_out', 'lambda2_in', 'lambda2_rec', 'lambda2_out', 'lambda2_r',
+                'Omega_every', 'Omega_anneal', 'Omega_subsample',
+                'bptt_window', 'scan_checkpoint', 'baseline_in', 'var_in', 'var_rec',
+                'rectify_inputs', 'graph_noise', 'backend', 'method', 'momentum', 'decay',
+                'beta1', 'beta2', 'epsilon']
+
+def graph_key(params, *extra):
+    """
+    Hash of the parameters that determine the structure of the training graph, to
+    name compile directories that can be shared by runs of the same network, e.g.,
+    with different seeds.
+
+    Arrays and connectivity matrices only contribute their shapes, since their values
+    are stored in shared variables. A key shared by different graphs only costs
+    compilation time, because Theano caches compiled code by the code itself.
+
+    Parameters
+    ----------
+
+    params : dict
+             Training parameters, with defaults for those not given.
+
+    extra : str
+            Other settings that affect the compiled code, e.g., the device.
+
+    """
+    def describe(v):
+        if isinstance(v, np.generic):
+            return v.item()
+        if v is None or isinstance(v, (basestring, numbers.Number)):
+            return v
+        if isinstance(v, np.ndarray):
+            return ('array', v.shape)
+        return (type(v).__name__, getattr(v, 'shape', None))
+
+    desc = [(k, describe(params.get(k))) for k in graph_params] + list(extra)
+
+    return hashlib.sha1(repr(desc).encode('utf-8')).hexdigest()[:16]
+
+@contextmanager
+def open_atomic(filename):
     """
-    Disable keyboard interrupt while pickling.
+    Open a temporary file for writing that replaces `filename` when it is closed,
+    so readers see either the old or the new file but never a partially written
+    one. Keyboard interrupts are disabled while writing.
 
     """
+    tmp = filename + '.tmp'
     s = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    with open(filename, 'wb') as f:
+    try:
+        with open(tmp, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, filename)
+    finally:
+        signal.signal(signal.SIGINT, s)
+
+def dump(filename, obj):
+    """
+    Pickle atomically (see `open_atomic`).
+
+    """
+    with open_atomic(filename) as f:
         pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-    signal.signal(signal.SIGINT, s)
+
+#=========================================================================================
+# Training history log
+#=========================================================================================
+
+def get_history_filename(savefile):
+    """
+    Name of the append-only log of cost histories for `savefile`.
+
+    """
+    return os.path.splitext(savefile)[0] + '.history'
+
+def append_history(filename, name, entry):
+    """
+    Append an entry to the `costs_history` or `Omega_history` in a history log.
+
+    Returns the size of the log, which marks the end of this entry.
+
+    """
+    with open(filename, 'ab') as f:
+        pickle.dump((name, entry), f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+def truncate_history(filename, size):
+    """
+    Discard entries written after the first `size` bytes of a history log, e.g.,
+    those added after the last checkpoint. Creates the log if it doesn't exist.
+
+    """
+    with open(filename, 'ab') as f:
+        f.truncate(size)
+
+def load_history(filename, size):
+    """
+    Read the first `size` bytes of a history log.
+
+    Returns
+    -------
+
+    (costs_history, Omega_history)
+
+    """
+    history = {'costs_history': [], 'Omega_history': []}
+    if size > 0:
+        with open(filename, 'rb') as f:
+            buf = io.BytesIO(f.read(size))
+        while buf.tell() < size:
+            name, entry = pickle.load(buf)
+            history[name].append(entry)
+
+    return history['costs_history'], history['Omega_history']
+
+#=========================================================================================
+# Timing
+#=========================================================================================
+
+class Timer(object):
+    """
+    Total wall-clock time spent in each phase of a computation, measured with
+
+      with timer('phase'):
+          ...
+
+    """
+    def __init__(self):
+        self.totals = OrderedDict()
+
+    @contextmanager
+    def __call__(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start)
+
+    def add(self, phase, secs):
+        self.totals[phase] = self.totals.get(phase, 0) + secs
+
+    def update(self, totals):
+        """
+        Add the times in `totals`, e.g., from another `Timer`.
+
+        """
+        for phase, secs in totals.items():
+            self.add(phase, secs)
+
+def get_timing_filename(savefile):
+    """
+    Name of the JSON-lines log of training throughput for `savefile`.
+
+    """
+    return os.path.splitext(savefile)[0] + '.timing.jsonl'
+
+def append_json(filename, entry):
+    """
+    Append `entry` to a JSON-lines log.
+
+    """
+    with open(filename, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
@@ -0,0 +1,110 @@
+"""
+Compare a training step of the NumPy backend with the Theano backend.
+
+"""
+from __future__ import division
+
+import unittest
+from   collections import OrderedDict
+
+import numpy as np
+
+try:
+    import theano
+except ImportError:
+    theano = None
+
+from pycog.dataset  import Dataset
+from pycog.model    import Struct
+from pycog.numpysgd import NumpySGD
+from pycog.rnn      import RNN
+from pycog.sgd      import SGD
+from pycog.trainer  import Trainer
+
+params = {
+    'Nin':            2,
+    'N':              20,
+    'Nout':           1,
+    'dt':             20,
+    'lambda_Omega':   2,
+    'lambda2_r':      0.1,
+    'learning_rate':  1e-2,
+    'n_gradient':     10
+    }
+
+def generate_trial(rng, dt, params):
+    """
+    Report the difference between two constant inputs.
+
+    """
+    t = np.arange(dt, 400+dt, dt)
+    a, b = rng.uniform(size=2)
+
+    X = np.zeros((len(t), 2))
+    X[:,0] = a
+    X[:,1] = b
+
+    Y = (a - b)*np.ones((len(t), 1))
+
+    M = np.zeros_like(Y)
+    M[len(t)//2:] = 1
+
+    return {'t': t, 'inputs': X, 'outputs': Y, 'mask': M, 'info': {}}
+
+@unittest.skipIf(theano is None, "requires Theano")
+class TestNumpySGD(unittest.TestCase):
+    def setUp(self):
+        floatX = theano.config.floatX
+        self.rtol = 1e-4 if floatX == 'float32' else 1e-8
+
+        trainer = Trainer(params, floatX=floatX)
+        p       = trainer.p
+        N       = p['N']
+
+        rng  = np.random.RandomState(1)
+        Win  = trainer.init_weights(rng, p['Cin'], N, p['Nin'], p['distribution_in'])
+        Wrec = trainer.init_weights(rng, p['Crec'], N, N, p['distribution_rec'])
+        Wout = trainer.init_weights(rng, p['Cout'], p['Nout'], N,
+                                    p['distribution_out'])
+        Wrec *= 1.1/RNN.spectral_radius(p['Crec'].mask_plastic*Wrec)
+        init = [Win, Wrec, Wout, np.zeros(N), np.zeros(p['Nout']), 0.1*np.ones(N)]
+
+        self.sgd = {
+            'theano': trainer.build_theano([np.copy(i) for i in init], OrderedDict())(),
+            'numpy':  NumpySGD.build(dict(p, backend='numpy'),
+                                     [np.copy(i) for i in init], OrderedDict(),
+                                     floatX)()
+            }
+
+        task = Struct(generate_trial=generate_trial)
+        data = Dataset(p['n_gradient'], task, floatX, p, seed=2, name='gradient')
+
+        self.inputs = data([])
+        self.args   = [p['dt']/p['tau'], p['lambda_Omega'], p['learning_rate'],
+                       p['max_gradient_norm'], p['bound']]
+
+    def test_train_step(self):
+        results = {}
+        weights = {}
+        for backend, sgd in self.sgd.items():
+            results[backend] = sgd.train_step(*(self.inputs + self.args))
+            weights[backend] = dict(zip(sgd.trainable_names,
+                                        SGD.get_values(sgd.trainables)))
+
+        # Cost, gradient norm, Omega, and the fraction of time points used for Omega
+        for i, name in enumerate(['cost', 'gnorm', 'Omega', 'nelems']):
+            np.testing.assert_allclose(float(results['numpy'][i]),
+                                       float(results['theano'][i]),
+                                       rtol=self.rtol, err_msg=name)
+
+        # States
+        np.testing.assert_allclose(results['numpy'][-1], results['theano'][-1],
+                                   rtol=self.rtol, atol=self.rtol)
+
+        # Updated weights
+        for name in weights['theano']:
+            np.testing.assert_allclose(weights['numpy'][name], weights['theano'][name],
+                                       rtol=self.rtol, atol=self.rtol, err_msg=name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Compare the spectral radius computed with ARPACK with the full decomposition.
+
+"""
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+from pycog.rnn import RNN
+
+@unittest.skipIf(sparse is None, "requires SciPy")
+class TestSpectralRadius(unittest.TestCase):
+    def setUp(self):
+        # Random matrices have many eigenvalues close to the spectral radius
+        N = 1200
+        self.matrices = []
+        for seed in xrange(3):
+            rng = np.random.RandomState(seed)
+            A   = sparse.random(N, N, density=0.1, random_state=rng,
+                                data_rvs=rng.standard_normal)
+            self.matrices.append(A.tocsr()/np.sqrt(0.1*N))
+
+    def test_sparse(self):
+        for A in self.matrices:
+            rho = np.max(abs(np.linalg.eigvals(A.toarray())))
+            self.assertGreater(A.shape[0], 1000)
+            np.testing.assert_allclose(RNN.spectral_radius(A), rho, rtol=1e-6)
+
+    def test_dense(self):
+        A   = self.matrices[0].toarray()
+        rho = np.max(abs(np.linalg.eigvals(A)))
+        np.testing.assert_allclose(RNN.spectral_radius(A), rho, rtol=1e-6)
+
+    def test_eigenvector(self):
+        A = self.matrices[0]
+        rho, v = RNN.dominant_eigenvector(A)
+        self.assertEqual(v.shape, (A.shape[0],))
+
+        # The eigenvector can be used to start the next estimate
+        np.testing.assert_allclose(RNN.dominant_eigenvector(A, v0=v)[0], rho,
+                                   rtol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()